@@ -0,0 +1,157 @@
+"""
+Micro-benchmark of parsed listings as dicts and as slotted Listing
+records, and of decoding a search response at once or as a stream.
+
+Listings are generated from the recorded fixtures with unique ids and
+descriptions of a few hundred characters. Memory is what tracemalloc
+sees retained or at peak, throughput the best of --repeat runs.
+
+    python benchmarks/records.py --listings 500 5000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from dataclasses import asdict
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from listing_record import Listing
+from listing_stream import CHUNK_SIZE, iter_listings
+from parser import build_listing_record, extract_listings
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--listings', type=int, nargs='+', default=[500, 5000], help='listings per response')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement, the best is reported')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    return parser.parse_args(argv)
+
+
+def make_response(count):
+    """Search response body with `count` listings, as OLX sends it"""
+    with open(os.path.join(BENCHMARKS_DIR, 'fixtures', 'listings.json'), encoding='utf-8') as f:
+        templates = json.load(f)
+    listings = []
+    for number in range(count):
+        listing = dict(templates[number % len(templates)])
+        listing['id'] = 900000000 + number
+        listing['description'] = f"Оголошення {number}. " + "Затишна квартира, поруч метро і парк. " * 8
+        listings.append(listing)
+    response = {'data': {'clientCompatibleListings': {'__typename': 'ListingSuccess', 'data': listings}}}
+    return json.dumps(response, ensure_ascii=False).encode('utf-8')
+
+
+def _verdict(listing):
+    return {'is_realtor': False, 'decided_by': 'keywords', 'listings_count': None, 'description': listing['description']}
+
+
+def _build_dict(**values):
+    # The dict the parser built before, the same fields as keyword arguments
+    return values
+
+
+def best_time(function, repeat):
+    """Best wall time of `repeat` calls in seconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def traced(function):
+    """
+    Call a function under tracemalloc.
+
+    Returns:
+        tuple: (result, bytes still allocated, peak bytes)
+    """
+    tracemalloc.start()
+    try:
+        result = function()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, current, peak
+
+
+def measure(count, repeat):
+    body = make_response(count)
+    chunks = [body[i:i + CHUNK_SIZE] for i in range(0, len(body), CHUNK_SIZE)]
+
+    def decode_whole():
+        return extract_listings(json.loads(body))
+
+    def decode_stream():
+        return list(iter_listings(chunks))
+
+    raw = decode_whole()
+    assert decode_stream() == raw
+    values = [asdict(build_listing_record(listing, _verdict(listing))) for listing in raw]
+
+    def build_dicts():
+        return [_build_dict(**fields) for fields in values]
+
+    def build_records():
+        return [Listing(**fields) for fields in values]
+
+    dicts = build_dicts()
+    records = build_records()
+
+    def read_dicts():
+        return sum(len(d['title']) + len(d['url']) + (d['listings_count'] or 0) for d in dicts if not d['is_realtor'])
+
+    def read_records():
+        return sum(len(r.title) + len(r.url) + (r.listings_count or 0) for r in records if not r.is_realtor)
+
+    # Strings are shared with the raw listings, only the containers differ
+    _, dict_bytes, _ = traced(build_dicts)
+    _, record_bytes, _ = traced(build_records)
+    _, _, whole_peak = traced(decode_whole)
+    _, _, stream_peak = traced(decode_stream)
+    parse_time = best_time(lambda: [build_listing_record(listing, _verdict(listing)) for listing in raw], repeat)
+
+    return {
+        'listings': count,
+        'body_kib': len(body) // 1024,
+        'decode_whole_per_s': round(count / best_time(decode_whole, repeat)),
+        'decode_stream_per_s': round(count / best_time(decode_stream, repeat)),
+        'decode_whole_peak_kib': whole_peak // 1024,
+        'decode_stream_peak_kib': stream_peak // 1024,
+        'parse_per_s': round(count / parse_time),
+        'dict_bytes': round(dict_bytes / count),
+        'record_bytes': round(record_bytes / count),
+        'dict_build_per_s': round(count / best_time(build_dicts, repeat)),
+        'record_build_per_s': round(count / best_time(build_records, repeat)),
+        'dict_read_per_s': round(count / best_time(read_dicts, repeat)),
+        'record_read_per_s': round(count / best_time(read_records, repeat)),
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = [measure(count, args.repeat) for count in args.listings]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for result in results:
+        print(f"{result['listings']} listings, {result['body_kib']} KiB response")
+        print(f"  {'':<22}{'whole':>12}{'stream':>12}")
+        print(f"  {'decode listings/s':<22}{result['decode_whole_per_s']:>12}{result['decode_stream_per_s']:>12}")
+        print(f"  {'decode peak KiB':<22}{result['decode_whole_peak_kib']:>12}{result['decode_stream_peak_kib']:>12}")
+        print(f"  {'':<22}{'dict':>12}{'Listing':>12}")
+        print(f"  {'bytes per listing':<22}{result['dict_bytes']:>12}{result['record_bytes']:>12}")
+        print(f"  {'build listings/s':<22}{result['dict_build_per_s']:>12}{result['record_build_per_s']:>12}")
+        print(f"  {'read listings/s':<22}{result['dict_read_per_s']:>12}{result['record_read_per_s']:>12}")
+        print(f"  parse_listing_data with debug logging off: {result['parse_per_s']} listings/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+"""
+Offline replay benchmark of a full fetch cycle.
+
+Starts local stand-ins for the OLX API and the Telegram Bot API, then runs
+process_new_listings end to end followed by delivery of the queued
+messages, once per cycle size. Every size runs in a fresh subprocess with
+its own database so module level state does not leak between runs.
+
+    python benchmarks/replay.py --sizes 20 200 2000 --latency-ms 50
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+import urllib.request
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+# Listings on the stand-in before the measured cycle, they set the watermark
+HISTORY_SIZE = 20
+PAGE_SIZE = 50
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 200, 2000],
+                        help='new listings per measured cycle')
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help='latency added to every OLX response')
+    parser.add_argument('--telegram-latency-ms', type=float, default=0,
+                        help='latency added to every Telegram response')
+    parser.add_argument('--olx-rate', type=int, default=0,
+                        help='OLX requests per second before 429 responses, 0 for no limit')
+    parser.add_argument('--telegram-rate', type=int, default=0,
+                        help='Telegram requests per second before 429 responses, 0 for no limit')
+    parser.add_argument('--chats', type=int, default=2, help='chats every listing is sent to')
+    parser.add_argument('--digest', action='store_true', help='deliver to every chat in digest mode')
+    parser.add_argument('--enrich-mode', choices=['async', 'sync'], default='async')
+    parser.add_argument('--delivery-timeout', type=float, default=300,
+                        help='seconds to wait for the outbox to drain')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='also report the Python heap peak via tracemalloc (slows the run down)')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def _control(olx_url, path):
+    request = urllib.request.Request(f"{olx_url}{path}", data=b'' if path != '/__stats' else None)
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)
+
+
+def run_child(args):
+    """Measure one cycle size. Runs with the environment prepared by run_size."""
+    sys.path.insert(0, REPO_DIR)
+    import asyncio
+    import logging
+    import tracemalloc
+
+    from telegram.request import HTTPXRequest
+
+    import bot
+    import database
+    import main
+    from outbox import OutboxWorker
+
+    logging.disable(logging.WARNING)
+    olx_url = os.environ['OLX_BASE_URL']
+
+    statements = [0]
+    counting = [False]
+
+    def count_statement(_):
+        if counting[0]:
+            statements[0] += 1
+
+    connect_db = database.connect_db
+
+    def traced_connect_db():
+        conn = connect_db()
+        conn.set_trace_callback(count_statement)
+        return conn
+
+    database.connect_db = traced_connect_db
+
+    async def drain_outbox():
+        # A bot per event loop, process_new_listings closes its own loop
+        request = HTTPXRequest(connection_pool_size=bot.POOL_SIZE)
+        worker = OutboxWorker(bot.TelegramSender(bot.create_bot(request)))
+        deadline = time.monotonic() + args.delivery_timeout
+        try:
+            while database.outbox_depth() and time.monotonic() < deadline:
+                if not await worker.drain_once():
+                    await asyncio.sleep(0.1)
+        finally:
+            await request.shutdown()
+        return database.outbox_depth()
+
+    database.create_table_if_not_exists()
+    main.seen_index.load(database.iter_sent_listing_ids())
+
+    # Warm-up cycle stores the watermark, as on a long running bot
+    main.process_new_listings()
+    asyncio.run(drain_outbox())
+
+    _control(olx_url, f'/__publish?count={args.child}')
+    _control(olx_url, '/__reset')
+    if args.trace_memory:
+        tracemalloc.start()
+    counting[0] = True
+
+    started = time.perf_counter()
+    main.process_new_listings()
+    cycle_time = time.perf_counter() - started
+    undelivered = asyncio.run(drain_outbox())
+    total_time = time.perf_counter() - started
+
+    counting[0] = False
+    heap_peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+    sent = database.get_connection().execute("SELECT COUNT(*) FROM outbox WHERE state = 'sent'").fetchone()[0]
+
+    result = {
+        'size': args.child,
+        'cycle_seconds': cycle_time,
+        'total_seconds': total_time,
+        'calls': _control(olx_url, '/__stats'),
+        'db_statements': statements[0],
+        'delivered': sent,
+        'undelivered': undelivered,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'heap_peak_mb': heap_peak / 1024 / 1024 if heap_peak is not None else None
+    }
+    with open(args.result_file, 'w') as f:
+        json.dump(result, f)
+
+
+def run_size(args, size, olx_url, telegram_url):
+    """Run one cycle size in a subprocess and return its measurements."""
+    with tempfile.TemporaryDirectory() as workdir:
+        result_file = os.path.join(workdir, 'result.json')
+        chat_settings_file = os.path.join(workdir, 'chat_settings.json')
+        with open(chat_settings_file, 'w') as f:
+            json.dump({'default': {'digest': args.digest}}, f)
+        env = dict(
+            os.environ,
+            OLX_BASE_URL=olx_url,
+            TELEGRAM_API_URL=f"{telegram_url}/bot",
+            TELEGRAM_BOT_TOKEN='123456:replay',
+            TELEGRAM_CHAT_IDS=','.join(str(100 + i) for i in range(args.chats)),
+            DATABASE_PATH=os.path.join(workdir, 'replay.db'),
+            SEARCH_PROFILES_FILE='',
+            REALTOR_KEYWORDS_FILE='',
+            CHAT_SETTINGS_FILE=chat_settings_file,
+            ENRICH_MODE=args.enrich_mode,
+            OLX_PAGE_SIZE=str(PAGE_SIZE),
+            OLX_MAX_PAGES=str(size // PAGE_SIZE + 2),
+            # Client side limits are lifted, the stand-in enforces --telegram-rate
+            TELEGRAM_GLOBAL_RATE='100000',
+            TELEGRAM_PER_CHAT_RATE='100000',
+            TELEGRAM_PER_CHAT_BURST='100000',
+            OUTBOX_RETRY_DELAY='0.5',
+            OUTBOX_RETRY_MAX_DELAY='2'
+        )
+        command = [
+            sys.executable, os.path.abspath(__file__), '--child', str(size), '--result-file', result_file,
+            '--delivery-timeout', str(args.delivery_timeout)
+        ]
+        if args.trace_memory:
+            command.append('--trace-memory')
+        subprocess.run(command, env=env, cwd=workdir, check=True, stdout=subprocess.DEVNULL)
+        with open(result_file) as f:
+            return json.load(f)
+
+
+def print_table(results):
+    header = f"{'listings':>8} {'cycle s':>8} {'total s':>8} {'olx/lst':>8} {'tg/lst':>7} {'db stmts':>9} {'rss MB':>7} {'heap MB':>8}  calls"
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        calls = result['calls']
+        size = result['size']
+        requests = {endpoint: count for endpoint, count in calls.items() if not endpoint.endswith('_rate_limited')}
+        olx = sum(count for endpoint, count in requests.items() if not endpoint.startswith('telegram'))
+        telegram = sum(count for endpoint, count in requests.items() if endpoint.startswith('telegram'))
+        heap = f"{result['heap_peak_mb']:.1f}" if result['heap_peak_mb'] is not None else '-'
+        print(
+            f"{size:>8} {result['cycle_seconds']:>8.2f} {result['total_seconds']:>8.2f} "
+            f"{olx / size:>8.2f} {telegram / size:>7.2f} {result['db_statements']:>9} "
+            f"{result['peak_rss_mb']:>7.1f} {heap:>8}  {json.dumps(calls, sort_keys=True)}"
+        )
+        if result['undelivered']:
+            print(f"{'':>8} {result['undelivered']} deliveries still queued after the delivery timeout")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child:
+        return run_child(args)
+
+    sys.path.insert(0, BENCHMARKS_DIR)
+    from stub_servers import OlxHandler, StubState, TelegramHandler, server_url, start_server
+
+    results = []
+    for size in args.sizes:
+        state = StubState(
+            latency=args.latency_ms / 1000,
+            olx_rate=args.olx_rate,
+            telegram_latency=args.telegram_latency_ms / 1000,
+            telegram_rate=args.telegram_rate
+        )
+        state.publish(HISTORY_SIZE)
+        olx = start_server(OlxHandler, state)
+        telegram = start_server(TelegramHandler, state)
+        try:
+            results.append(run_size(args, size, server_url(olx), server_url(telegram)))
+        finally:
+            olx.shutdown()
+            telegram.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == '__main__':
+    main()
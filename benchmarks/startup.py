@@ -0,0 +1,122 @@
+"""
+Startup benchmark: wall time and peak RSS of fresh interpreters importing
+the bot, which is what every cron or container run of `cli.py --once`
+pays before its first request.
+
+Each case runs --repeat times in a new subprocess, the median time and
+the largest RSS are reported. The `eager` case also imports telegram and
+requests and creates the bot, as importing main.py did before they were
+loaded on first use.
+
+    python benchmarks/startup.py --repeat 10 --importtime
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+CASES = [
+    ('python', 'pass'),
+    ('cli --help', 'import sys, cli\nsys.argv = ["cli.py", "--help"]\ntry:\n    cli.parse_args()\nexcept SystemExit:\n    pass'),
+    ('import main', 'import main'),
+    ('eager', 'import telegram, requests, main, bot\nbot.get_bot()'),
+]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='runs per case')
+    parser.add_argument('--importtime', action='store_true',
+                        help='also list the modules that take longest to import with main')
+    parser.add_argument('--top', type=int, default=10, help='modules listed by --importtime')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    return parser.parse_args(argv)
+
+
+def run_case(code, env):
+    """
+    Run code in a fresh interpreter.
+
+    Returns:
+        tuple: (wall seconds, peak RSS in MB)
+    """
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', code], cwd=REPO_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode:
+        raise RuntimeError(f"{code!r} exited with {process.returncode}")
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return elapsed, usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def slowest_imports(env, top):
+    """
+    Modules with the largest cumulative import time under `import main`.
+
+    Returns:
+        list: (module, milliseconds) pairs, slowest first
+    """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=REPO_DIR, env=env,
+                            capture_output=True, text=True, check=True).stderr
+    # A module is listed after its own imports, nested two spaces deeper
+    times = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = len(name) - len(name.lstrip())
+        if depth == 3:
+            times.append((name.strip(), int(cumulative) / 1000))
+        elif depth == 1:
+            if name.strip() == 'main':
+                times.append(('main (total)', int(cumulative) / 1000))
+                break
+            times = []
+    return sorted(times, key=lambda item: -item[1])[:top]
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(
+            os.environ,
+            TELEGRAM_BOT_TOKEN='123456:startup',
+            DATABASE_PATH=os.path.join(workdir, 'startup.db'),
+            SEARCH_PROFILES_FILE='',
+            METRICS_PORT='0'
+        )
+        results = []
+        for name, code in CASES:
+            runs = [run_case(code, env) for _ in range(args.repeat)]
+            results.append({
+                'case': name,
+                'wall_ms': round(statistics.median(elapsed for elapsed, _ in runs) * 1000, 1),
+                'rss_mb': round(max(rss for _, rss in runs), 1)
+            })
+        imports = slowest_imports(env, args.top) if args.importtime else []
+
+    if args.json:
+        print(json.dumps({'cases': results, 'imports': imports}, indent=2))
+        return
+    print(f"{'case':<14}{'wall ms':>10}{'rss MB':>10}")
+    print('-' * 34)
+    for result in results:
+        print(f"{result['case']:<14}{result['wall_ms']:>10}{result['rss_mb']:>10}")
+    if imports:
+        print(f"\nslowest imports of main ({args.top}):")
+        for name, ms in imports:
+            print(f"  {name:<30}{ms:>8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# Listings of one stub user, so enrichment sees repeated users like on OLX
+LISTINGS_PER_USER = 3
+
+
+def load_fixture(name):
+    """Load a recorded API response from the fixtures directory."""
+    with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as f:
+        return json.load(f)
+
+
+class RateLimiter:
+    """Fixed one-second window limiter, unlimited if rate is 0."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._window = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Take a slot in the current window.
+
+        Returns:
+            float: 0 if allowed, otherwise seconds until the next window
+        """
+        if not self.rate:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            window = int(now)
+            if window != self._window:
+                self._window = window
+                self._count = 0
+            if self._count < self.rate:
+                self._count += 1
+                return 0
+            return window + 1 - now
+
+
+class StubState:
+    """
+    Listings published by the OLX stand-in and calls received by both stubs.
+
+    Listings are generated from the recorded fixtures with unique ids and
+    creation times, the newest first as OLX returns them.
+    """
+
+    def __init__(self, latency=0.0, olx_rate=0, telegram_latency=0.0, telegram_rate=0):
+        self.latency = latency
+        self.telegram_latency = telegram_latency
+        self.olx_limiter = RateLimiter(olx_rate)
+        self.telegram_limiter = RateLimiter(telegram_rate)
+        self.calls = Counter()
+        self._listings = []
+        self._next = 0
+        self._clock = datetime(2024, 3, 1, tzinfo=timezone(timedelta(hours=2)))
+        self._lock = threading.Lock()
+        self._templates = load_fixture('listings.json')
+        self._users = load_fixture('users.json')
+        self._user_offers = load_fixture('user_offers.json')
+        self._offers = load_fixture('offers.json')
+
+    def publish(self, count):
+        """Publish `count` new listings on top of the existing ones."""
+        with self._lock:
+            batch = []
+            for _ in range(count):
+                number = self._next
+                self._next += 1
+                self._clock += timedelta(seconds=1)
+                listing = json.loads(json.dumps(self._templates[number % len(self._templates)]))
+                user_number = number // LISTINGS_PER_USER
+                listing['id'] = 900000000 + number
+                listing['user'] = {'id': 2000000 + user_number, 'uuid': f'stub-user-{user_number}'}
+                listing['url'] = f"https://www.olx.ua/d/uk/obyavlenie/stub-{number}.html"
+                listing['created_time'] = listing['last_refresh_time'] = self._clock.isoformat()
+                batch.append(listing)
+            self._listings[:0] = reversed(batch)
+
+    def page(self, offset, limit):
+        with self._lock:
+            return self._listings[offset:offset + limit]
+
+    def user(self, user_id):
+        # Every fifth user is a business account
+        return self._users[1] if int(user_id) % 5 == 0 else self._users[0]
+
+    def user_offers(self, user_uuid):
+        return self._user_offers[int(user_uuid.rsplit('-', 1)[-1]) % len(self._user_offers)]
+
+    def offer(self, listing_id):
+        return self._offers[int(listing_id) % len(self._offers)]
+
+    def count(self, endpoint):
+        with self._lock:
+            self.calls[endpoint] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.calls)
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Enrichment opens many connections at once
+    request_queue_size = 256
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class OlxHandler(_Handler):
+    """OLX GraphQL search, user, user offers and offer endpoints plus controls."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+
+        if url.path == '/__stats':
+            return self._send_json(self.state.stats())
+
+        if parts[:3] == ['api', 'v1', 'users'] and len(parts) == 4:
+            endpoint, payload = 'users', lambda: self.state.user(parts[3])
+        elif parts == ['api', 'v1', 'offers']:
+            user_uuid = parse_qs(url.query).get('user_id', ['0'])[0]
+            endpoint, payload = 'user_offers', lambda: self.state.user_offers(user_uuid)
+        elif parts[:3] == ['api', 'v1', 'offers'] and len(parts) == 4:
+            endpoint, payload = 'offer', lambda: self.state.offer(parts[3])
+        else:
+            return self._send_json({'error': 'not found'}, 404)
+        self._answer(endpoint, payload)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self._read_body()
+
+        if url.path == '/__publish':
+            self.state.publish(int(parse_qs(url.query).get('count', ['0'])[0]))
+            return self._send_json({'ok': True})
+        if url.path == '/__reset':
+            self.state.reset()
+            return self._send_json({'ok': True})
+        if url.path != '/apigateway/graphql':
+            return self._send_json({'error': 'not found'}, 404)
+
+        parameters = {
+            parameter['key']: parameter['value']
+            for parameter in json.loads(body)['variables']['searchParameters']
+        }
+        offset = int(parameters.get('offset', 0))
+        limit = int(parameters.get('limit', 20))
+        self._answer('graphql', lambda: {
+            'data': {'clientCompatibleListings': {
+                '__typename': 'ListingSuccess',
+                'data': self.state.page(offset, limit)
+            }}
+        })
+
+    def _answer(self, endpoint, payload):
+        self.state.count(endpoint)
+        if self.state.olx_limiter.allow():
+            self.state.count('olx_rate_limited')
+            return self._send_json({'error': 'too many requests'}, 429)
+        if self.state.latency:
+            time.sleep(self.state.latency)
+        self._send_json(payload())
+
+
+class TelegramHandler(_Handler):
+    """Telegram Bot API methods used by the bot."""
+
+    def do_POST(self):
+        self._read_body()
+        method = self.path.rsplit('/', 1)[-1]
+        self.state.count(f'telegram_{method}')
+
+        retry_after = self.state.telegram_limiter.allow()
+        if retry_after:
+            self.state.count('telegram_rate_limited')
+            return self._send_json({
+                'ok': False,
+                'error_code': 429,
+                'description': 'Too Many Requests: retry after 1',
+                'parameters': {'retry_after': max(1, round(retry_after))}
+            }, 429)
+        if self.state.telegram_latency:
+            time.sleep(self.state.telegram_latency)
+
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'stub', 'username': 'stub_bot'}
+        else:
+            result = {'message_id': 1, 'date': int(time.time()), 'chat': {'id': 1, 'type': 'private'}, 'text': ''}
+        self._send_json({'ok': True, 'result': result})
+
+
+def start_server(handler, state, port=0):
+    """
+    Serve a stub in a daemon thread.
+
+    Args:
+        handler: Request handler class
+        state (StubState): Shared stub state
+        port (int): Port to listen on, any free port if 0
+
+    Returns:
+        ThreadingHTTPServer: Running server
+    """
+    handler_class = type(handler.__name__, (handler,), {'state': state})
+    server = _StubServer(('127.0.0.1', port), handler_class)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def server_url(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
@@ -1,80 +1,204 @@
 import os
+import sys
+import time
 import logging
 import asyncio
 
 from dotenv import load_dotenv
-from telegram import Bot
-from telegram.error import RetryAfter, NetworkError, TimedOut
 
-from message_formatter import format_telegram_message
+from metrics import STAGE_SECONDS, TELEGRAM_MESSAGES, TELEGRAM_RETRIES, TELEGRAM_RETRY_AFTER_SECONDS
 
 load_dotenv()
-# Initialize bot
-bot = Bot(token=os.getenv('TELEGRAM_BOT_TOKEN'))
 
+# Telegram allows about 30 messages per second overall and 1 per second per chat
+GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))
+PER_CHAT_RATE = float(os.getenv('TELEGRAM_PER_CHAT_RATE', '1'))
+PER_CHAT_BURST = int(os.getenv('TELEGRAM_PER_CHAT_BURST', '3'))
+POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', '16'))
+# Bot API endpoint, the bot token is appended to it
+API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org/bot')
 
-async def send_message_with_retry(chat_id, message, max_retries=3, initial_delay=1):
+# The telegram package is imported and the bot created on first use, so
+# starting up, dry runs and runs with nothing to send do without them
+_bot = None
+
+
+def create_bot(request=None):
     """
-    Send a message with retry logic.
-    
+    Create a Telegram bot for the configured token and API endpoint.
+
     Args:
-        chat_id: Telegram chat ID
-        message: Message text
-        max_retries: Maximum number of retry attempts
-        initial_delay: Initial delay between retries in seconds
-        
+        request: telegram.request.HTTPXRequest to use, a pooled one if None
+
     Returns:
-        bool: True if message was sent successfully, False otherwise
+        telegram.Bot: New bot
     """
-    delay = initial_delay
-    for attempt in range(max_retries):
-        try:
-            await bot.send_message(chat_id=chat_id, text=message)
-            return True
-        except RetryAfter as e:
-            wait_time = e.retry_after
-            logging.warning(f"Rate limited. Waiting {wait_time} seconds before retry...")
-            await asyncio.sleep(wait_time)
-        except (NetworkError, TimedOut) as e:
-            if attempt < max_retries - 1:
-                logging.warning(f"Network error (attempt {attempt + 1}/{max_retries}): {e}")
-                await asyncio.sleep(delay)
-                delay *= 2
-            else:
-                logging.error(f"Failed to send message after {max_retries} attempts: {e}")
-                return False
-        except Exception as e:
-            logging.error(f"Unexpected error while sending message: {e}")
-            return False
-    return False
+    from telegram import Bot
+    from telegram.request import HTTPXRequest
+
+    return Bot(
+        token=os.getenv('TELEGRAM_BOT_TOKEN'),
+        base_url=API_URL,
+        request=request or HTTPXRequest(connection_pool_size=POOL_SIZE)
+    )
+
+
+def get_bot():
+    """Get the shared Telegram bot, creating it on first use."""
+    global _bot
+    if _bot is None:
+        _bot = create_bot()
+    return _bot
+
 
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second up to `capacity`."""
 
-async def send_listing_to_chats(listing_data, chat_ids):
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class TelegramSender:
     """
-    Send listing to multiple Telegram chats.
-    
-    Args:
-        listing_data (dict): Parsed listing data
-        chat_ids (list): List of chat IDs to send to
+    Long-lived sender that fans messages out to many chats concurrently.
+
+    Every message takes a token from the global bucket and from the bucket
+    of its chat. A RetryAfter from Telegram pauses all sends until the
+    requested time has passed instead of sleeping in each coroutine.
     """
-    try:
-        message = format_telegram_message(listing_data)
-        for chat_id in chat_ids:
-            success = await send_message_with_retry(chat_id, message)
-            if success:
-                logging.info(f"Message for listing {listing_data['id']} sent to chat {chat_id}")
-            else:
-                logging.error(f"Failed to send message for listing {listing_data['id']} to chat {chat_id}")
-    except Exception as e:
-        logging.error(f"Error sending message for listing {listing_data['id']}: {e}")
-
-
-def send_listing_to_chats_sync(listing_data, chat_ids):
+
+    def __init__(self, telegram_bot=None, global_rate=GLOBAL_RATE, per_chat_rate=PER_CHAT_RATE,
+                 per_chat_burst=PER_CHAT_BURST, max_retries=3, initial_delay=1):
+        self._bot = telegram_bot
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_retries = max_retries
+        self.initial_delay = initial_delay
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        self._resume_at = 0
+
+    @property
+    def bot(self):
+        """Telegram bot the messages go through, the shared one if none was given"""
+        if self._bot is None:
+            self._bot = get_bot()
+        return self._bot
+
+    async def send_message(self, chat_id, message, max_retries=None, initial_delay=None):
+        """
+        Send a message with rate limiting and retry logic.
+
+        Args:
+            chat_id: Telegram chat ID
+            message: Message text
+            max_retries: Maximum number of attempts, sender default if None
+            initial_delay: Initial delay between retries, sender default if None
+
+        Returns:
+            bool: True if message was sent successfully, False otherwise
+        """
+        from telegram.error import RetryAfter, NetworkError, TimedOut
+
+        max_retries = max_retries or self.max_retries
+        delay = initial_delay or self.initial_delay
+        for attempt in range(max_retries):
+            await self._wait_for_slot(chat_id)
+            try:
+                with STAGE_SECONDS.labels('send').time():
+                    await self.bot.send_message(chat_id=chat_id, text=message)
+                TELEGRAM_MESSAGES.labels('sent').inc()
+                return True
+            except RetryAfter as e:
+                TELEGRAM_MESSAGES.labels('retry_after').inc()
+                self._pause(e.retry_after)
+                if attempt < max_retries - 1:
+                    TELEGRAM_RETRIES.labels('retry_after').inc()
+            except (NetworkError, TimedOut) as e:
+                TELEGRAM_MESSAGES.labels('network_error').inc()
+                if attempt < max_retries - 1:
+                    TELEGRAM_RETRIES.labels('network_error').inc()
+                    logging.warning(f"Network error (attempt {attempt + 1}/{max_retries}): {e}")
+                    await asyncio.sleep(delay)
+                    delay *= 2
+                else:
+                    logging.error(f"Failed to send message after {max_retries} attempts: {e}")
+                    return False
+            except Exception as e:
+                TELEGRAM_MESSAGES.labels('error').inc()
+                logging.error(f"Unexpected error while sending message: {e}")
+                return False
+        return False
+
+    async def _wait_for_slot(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+        await bucket.acquire()
+        await self._global_bucket.acquire()
+        # Checked last so sends already waiting for a token also honour a new pause
+        while True:
+            wait = self._resume_at - time.monotonic()
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+
+    def _pause(self, retry_after):
+        if hasattr(retry_after, 'total_seconds'):
+            retry_after = retry_after.total_seconds()
+        now = time.monotonic()
+        resume_at = now + retry_after
+        if resume_at > self._resume_at:
+            logging.warning(f"Rate limited. Pausing all sends for {retry_after} seconds...")
+            # Only the extension of an already running pause adds waiting time
+            TELEGRAM_RETRY_AFTER_SECONDS.inc(resume_at - max(now, self._resume_at))
+            self._resume_at = resume_at
+
+
+class DryRunSender:
     """
-    Synchronous wrapper for sending messages to Telegram chats.
-    
-    Args:
-        listing_data (dict): Parsed listing data
-        chat_ids (list): List of chat IDs to send to
+    Stand-in for TelegramSender that prints messages instead of sending
+    them. Needs neither a bot token nor the telegram package.
     """
-    asyncio.run(send_listing_to_chats(listing_data, chat_ids)) 
\ No newline at end of file
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.messages = 0
+
+    async def send_message(self, chat_id, message, max_retries=None, initial_delay=None):
+        """
+        Print a message as it would be sent.
+
+        Returns:
+            bool: Always True
+        """
+        self.messages += 1
+        print(f"----- chat {chat_id} -----\n{message}\n", file=self.stream or sys.stdout)
+        return True
+
+
+_sender = None
+
+
+def get_sender():
+    """Get the shared Telegram sender, creating it on first use."""
+    global _sender
+    if _sender is None:
+        _sender = TelegramSender()
+    return _sender
@@ -0,0 +1,80 @@
+import os
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+CHAT_SETTINGS_FILE = os.getenv('CHAT_SETTINGS_FILE', 'chat_settings.json')
+
+# Separate messages per listing, realtor listings kept and sorted last in
+# digests, no price drop notifications
+DEFAULT_SETTINGS = {'digest': False, 'realtors': 'last', 'price_drops': False}
+REALTOR_OPTIONS = ('last', 'drop')
+
+
+def _validate(settings, where):
+    if settings['realtors'] not in REALTOR_OPTIONS:
+        raise ValueError(f"'realtors' of {where} must be one of {REALTOR_OPTIONS}, got {settings['realtors']!r}")
+    settings['digest'] = bool(settings['digest'])
+    settings['price_drops'] = bool(settings['price_drops'])
+    return settings
+
+
+def load_chat_settings(path=CHAT_SETTINGS_FILE):
+    """
+    Load per-chat delivery preferences from a JSON file.
+
+    The file maps chat ids to objects with a "digest" flag, a "realtors"
+    option, "last" or "drop", and a "price_drops" flag. The "default" entry
+    applies to every chat not listed and falls back to DEFAULT_SETTINGS.
+
+    Args:
+        path (str): Path of the JSON file
+
+    Returns:
+        dict: 'default' settings and 'chats' settings by chat id
+    """
+    raw = {}
+    if path and os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            raw = json.load(f)
+        logger.info(f"Loaded chat settings from {path}")
+
+    default = _validate(dict(DEFAULT_SETTINGS, **raw.get('default', {})), 'default')
+    chats = {
+        str(chat_id): _validate(dict(default, **settings), f"chat {chat_id}")
+        for chat_id, settings in raw.items()
+        if chat_id != 'default'
+    }
+    return {'default': default, 'chats': chats}
+
+
+def get_chat_settings(chat_id):
+    """
+    Get the delivery preferences of a chat.
+
+    Args:
+        chat_id: Telegram chat ID
+
+    Returns:
+        dict: Settings with 'digest', 'realtors' and 'price_drops'
+    """
+    return chat_settings['chats'].get(str(chat_id), chat_settings['default'])
+
+
+def uses_digest(chat_id):
+    """Check whether a chat gets the listings of a cycle as digests."""
+    return get_chat_settings(chat_id)['digest']
+
+
+def drops_realtors(chat_id):
+    """Check whether a chat does not want realtor listings at all."""
+    return get_chat_settings(chat_id)['realtors'] == 'drop'
+
+
+def wants_price_drops(chat_id):
+    """Check whether a chat is notified when a sent listing gets cheaper."""
+    return get_chat_settings(chat_id)['price_drops']
+
+
+chat_settings = load_chat_settings()
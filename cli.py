@@ -0,0 +1,118 @@
+"""
+Command line entry point of the bot.
+
+    python cli.py                    run until stopped, like main.py
+    python cli.py --once             run one fetch cycle, deliver its messages and exit
+    python cli.py --dry-run          run one cycle and print the messages instead of sending them
+
+--once suits cron jobs and containers started per run. It exits with 0
+when every search profile was fetched and every message delivered, 1
+otherwise, and 2 on usage errors. --dry-run needs no bot token and runs
+on a temporary copy of the database, so the next real run still sends
+everything.
+
+Only the standard library is imported before the arguments are parsed,
+the bot modules and their dependencies are loaded for the mode that runs.
+"""
+import os
+import sys
+import shutil
+import logging
+import argparse
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--once', action='store_true', help='run one fetch cycle and exit')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='format messages and print them instead of sending, implies --once')
+    parser.add_argument('--delivery-timeout', type=float,
+                        help='seconds to wait for the messages of a one-shot run, ONCE_DELIVERY_TIMEOUT by default')
+    parser.add_argument('--no-retention', action='store_true', help='skip the retention policy after a one-shot run')
+    args = parser.parse_args(argv)
+    if args.dry_run:
+        args.once = True
+    if not args.once and (args.delivery_timeout is not None or args.no_retention):
+        parser.error('--delivery-timeout and --no-retention only apply with --once')
+    return parser, args
+
+
+def copy_database(path, directory):
+    """
+    Copy the database to `directory` through the SQLite backup API, which
+    also takes what is still in the write-ahead log.
+
+    Args:
+        path (str): Database to copy, may not exist yet
+        directory (str): Directory of the copy
+
+    Returns:
+        str: Path of the copy
+    """
+    import sqlite3
+
+    copy_path = os.path.join(directory, os.path.basename(path) or 'database.db')
+    target = sqlite3.connect(copy_path)
+    try:
+        if os.path.exists(path):
+            source = sqlite3.connect(path)
+            try:
+                source.backup(target)
+            finally:
+                source.close()
+    finally:
+        target.close()
+    return copy_path
+
+
+def main(argv=None):
+    parser, args = parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    if not args.once:
+        import main as bot_main
+        bot_main.main()
+        return 0
+
+    scratch = None
+    if args.dry_run:
+        # Set before the database module reads it on import
+        scratch = tempfile.mkdtemp(prefix='rieltor_zlo_')
+        os.environ['DATABASE_PATH'] = copy_database(os.getenv('DATABASE_PATH', 'database.db'), scratch)
+        os.environ['DATABASE_ARCHIVE_PATH'] = ''
+        os.environ['METRICS_DUMP_FILE'] = ''
+    elif not os.getenv('TELEGRAM_BOT_TOKEN'):
+        parser.error('TELEGRAM_BOT_TOKEN is not set, use --dry-run to run without it')
+
+    try:
+        import asyncio
+        import main as bot_main
+        from bot import DryRunSender
+
+        sender = DryRunSender() if args.dry_run else None
+        delivery_timeout = bot_main.DELIVERY_TIMEOUT if args.delivery_timeout is None else args.delivery_timeout
+        try:
+            success = asyncio.run(bot_main.run_once(
+                sender, delivery_timeout, retention=not (args.dry_run or args.no_retention)
+            ))
+        except KeyboardInterrupt:
+            logger.info("Stopped")
+            return 1
+        except Exception as e:
+            logger.error(f"Run failed: {e}")
+            return 1
+        if args.dry_run:
+            logger.info(f"Dry run formatted {sender.messages} messages")
+        return 0 if success else 1
+    finally:
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
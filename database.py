@@ -1,15 +1,139 @@
+import os
+import json
+import time
 import sqlite3
+import threading
+
+from metrics import timed
+
+DATABASE_PATH = os.getenv('DATABASE_PATH', 'database.db')
+# Seconds a connection waits for the write lock held by another process
+BUSY_TIMEOUT = float(os.getenv('DATABASE_BUSY_TIMEOUT', '30'))
+# SQLite file receiving listings and price history before retention deletes them, empty to just delete
+ARCHIVE_PATH = os.getenv('DATABASE_ARCHIVE_PATH', '')
+
+# Maximum number of ids bound into a single IN (...) clause
+MAX_QUERY_PARAMS = 500
+
+_local = threading.local()
+
+OUTBOX_SCHEMA = '''
+    listing_id INTEGER NOT NULL,
+    chat_id TEXT NOT NULL,
+    message TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    sent_at REAL,
+    digest_entry TEXT,
+    is_realtor INTEGER NOT NULL DEFAULT 0,
+    maybe_realtor INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires_at REAL,
+    kind TEXT NOT NULL DEFAULT 'listing',
+    PRIMARY KEY (listing_id, chat_id, kind)
+'''
 
 
 def connect_db():
     """Connect to SQLite database"""
-    return sqlite3.connect('database.db')
+    return sqlite3.connect(DATABASE_PATH, timeout=BUSY_TIMEOUT)
+
+
+def get_connection():
+    """
+    Get the long-lived database connection of the current thread, opening
+    it on first use.
+
+    The connection runs in WAL mode so readers never block the writer and
+    each commit costs a single append to the write-ahead log.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = connect_db()
+        # Only a new database takes this, and only before the switch to WAL
+        # writes its header. Existing ones switch in _enable_incremental_vacuum
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def close_db():
+    """Close the long-lived database connection of the current thread"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+def _chunks(items, size=MAX_QUERY_PARAMS):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _add_missing_columns(cursor, table, columns):
+    existing = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    for name, definition in columns:
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
+def _add_outbox_kind(cursor):
+    # The kind joins the primary key, which takes a new table in SQLite
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(outbox)")]
+    cursor.execute("ALTER TABLE outbox RENAME TO outbox_old")
+    cursor.execute(f"CREATE TABLE outbox ({OUTBOX_SCHEMA})")
+    cursor.execute(f"INSERT INTO outbox ({', '.join(columns)}) SELECT {', '.join(columns)} FROM outbox_old")
+    cursor.execute("DROP TABLE outbox_old")
+    print("Table 'outbox' migrated to delivery kinds.")
+
+
+def _listing_timestamps(cursor):
+    _add_missing_columns(cursor, 'listings', [
+        ('first_seen_at', 'REAL'),
+        ('last_seen_at', 'REAL'),
+        ('sent_at', 'REAL')
+    ])
+    # Rows from before the timestamps age from the migration on
+    now = time.time()
+    cursor.execute("UPDATE listings SET first_seen_at = ? WHERE first_seen_at IS NULL", (now,))
+    cursor.execute("UPDATE listings SET last_seen_at = ? WHERE last_seen_at IS NULL", (now,))
+    cursor.execute("UPDATE listings SET sent_at = ? WHERE sent = 1 AND sent_at IS NULL", (now,))
+
+
+def _retention_indexes(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_listings_last_seen ON listings (last_seen_at)")
+    # Claims are renewed and checked on unsent listings only
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_listings_claims ON listings (claimed_by) WHERE sent = 0")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_finished ON outbox (state, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_reputation_last_seen ON user_reputation (last_seen)")
+
+
+# Schema changes in order, PRAGMA user_version counts those applied. Tables
+# and columns from before versioning are created by create_table_if_not_exists.
+MIGRATIONS = [
+    _listing_timestamps,
+    _retention_indexes,
+]
+
+
+def _migrate(cursor):
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        migration(cursor)
+        cursor.execute(f"PRAGMA user_version = {number}")
+        print(f"Database migrated to version {number} ({migration.__name__.strip('_')}).")
 
 
 def create_table_if_not_exists():
-    """Check if table exists and create if needed"""
-    conn = connect_db()
+    """Check if table exists and create if needed, then apply pending migrations"""
+    conn = get_connection()
     cursor = conn.cursor()
+    # Processes starting together must not create the same tables twice
+    cursor.execute("BEGIN IMMEDIATE")
 
     cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='listings';")
     table_exists = cursor.fetchone()
@@ -17,40 +141,1077 @@ def create_table_if_not_exists():
     if not table_exists:
         cursor.execute('''CREATE TABLE listings (
             id INTEGER PRIMARY KEY,
-            sent INTEGER DEFAULT 0
+            sent INTEGER DEFAULT 0,
+            claimed_by TEXT,
+            claim_expires_at REAL,
+            first_seen_at REAL,
+            last_seen_at REAL,
+            sent_at REAL
         )''')
         print("Table 'listings' created.")
     else:
         print("Table 'listings' already exists.")
+        _add_missing_columns(cursor, 'listings', [
+            ('claimed_by', 'TEXT'),
+            ('claim_expires_at', 'REAL')
+        ])
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS user_profiles (
+        user_key TEXT PRIMARY KEY,
+        is_business INTEGER,
+        business_checked_at REAL,
+        listings_count INTEGER,
+        count_checked_at REAL
+    )''')
+
+    # Aggregates of the listings of each OLX user, updated incrementally
+    cursor.execute('''CREATE TABLE IF NOT EXISTS user_reputation (
+        user_key TEXT PRIMARY KEY,
+        listings_seen INTEGER NOT NULL,
+        realtor_listings INTEGER NOT NULL,
+        keyword_listings INTEGER NOT NULL,
+        checked_listings INTEGER NOT NULL,
+        first_seen REAL NOT NULL,
+        last_seen REAL NOT NULL,
+        score REAL NOT NULL,
+        weight REAL NOT NULL,
+        scored_at REAL NOT NULL,
+        keywords TEXT NOT NULL DEFAULT '{}'
+    )''')
+
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS outbox ({OUTBOX_SCHEMA})")
+    _add_missing_columns(cursor, 'outbox', [
+        ('digest_entry', 'TEXT'),
+        ('is_realtor', 'INTEGER NOT NULL DEFAULT 0'),
+        ('maybe_realtor', 'INTEGER NOT NULL DEFAULT 0'),
+        ('lease_owner', 'TEXT'),
+        ('lease_expires_at', 'REAL')
+    ])
+    if 'kind' not in {row[1] for row in cursor.execute("PRAGMA table_info(outbox)")}:
+        _add_outbox_kind(cursor)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (state, next_attempt_at)")
+
+    # Chats that want a listing, whichever process ends up queueing it
+    cursor.execute('''CREATE TABLE IF NOT EXISTS listing_targets (
+        listing_id INTEGER NOT NULL,
+        chat_id TEXT NOT NULL,
+        drop_realtors INTEGER NOT NULL DEFAULT 0,
+        drop_maybe_realtors INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (listing_id, chat_id)
+    )''')
+    _add_missing_columns(cursor, 'listing_targets', [('drop_maybe_realtors', 'INTEGER NOT NULL DEFAULT 0')])
+
+    # Per-chat filters on the listings of the search profiles, see subscriptions.py
+    cursor.execute('''CREATE TABLE IF NOT EXISTS subscriptions (
+        chat_id TEXT PRIMARY KEY,
+        min_price REAL,
+        max_price REAL,
+        districts TEXT NOT NULL DEFAULT '[]',
+        realtors TEXT NOT NULL DEFAULT 'any',
+        profiles TEXT NOT NULL DEFAULT '[]',
+        updated_at REAL NOT NULL
+    )''')
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS leases (
+        name TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )''')
+
+    # Last seen content of handled listings, to notice edits and price changes
+    cursor.execute('''CREATE TABLE IF NOT EXISTS listing_snapshots (
+        listing_id INTEGER PRIMARY KEY,
+        content_hash INTEGER NOT NULL,
+        price INTEGER,
+        last_refresh_time TEXT,
+        is_realtor INTEGER
+    )''')
+
+    # One row per price change, nothing while the price stays the same
+    cursor.execute('''CREATE TABLE IF NOT EXISTS price_history (
+        listing_id INTEGER NOT NULL,
+        old_price INTEGER,
+        new_price INTEGER,
+        changed_at REAL NOT NULL
+    )''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_price_history_listing ON price_history (listing_id)")
+
+    # SimHash fingerprints of handled listings, reposts point to the first listing
+    cursor.execute('''CREATE TABLE IF NOT EXISTS listing_fingerprints (
+        listing_id INTEGER PRIMARY KEY,
+        simhash INTEGER NOT NULL,
+        duplicate_of INTEGER,
+        created_at REAL NOT NULL
+    )''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_listing_fingerprints_duplicate ON listing_fingerprints (duplicate_of)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_listing_fingerprints_created ON listing_fingerprints (created_at)")
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS crawl_state (
+        profile TEXT PRIMARY KEY,
+        last_listing_id INTEGER,
+        last_created_time TEXT
+    )''')
 
+    _migrate(cursor)
     conn.commit()
-    conn.close()
+    _enable_incremental_vacuum(conn)
 
 
-def save_listing_to_db(listing_id):
-    """Save listing to database and return sent status"""
-    conn = connect_db()
-    cursor = conn.cursor()
+def _enable_incremental_vacuum(conn):
+    # Freed pages are returned to the file system a few at a time by
+    # incremental_vacuum(), switching an existing database takes one full
+    # VACUUM. It needs free disk space of twice the file, a failed switch
+    # is tried again on the next start.
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return
+    print("Switching the database to incremental vacuum, this rewrites the file once...")
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    except sqlite3.Error as e:
+        print(f"Switching to incremental vacuum failed, retrying on the next start: {e}")
 
-    cursor.execute("SELECT sent FROM listings WHERE id = ?", (listing_id,))
-    result = cursor.fetchone()
 
-    if result:
-        print(f"Listing with ID {listing_id} already exists.")
-        return result[0]
-    else:
-        cursor.execute("INSERT INTO listings (id, sent) VALUES (?, ?)", (listing_id, 0))
-        conn.commit()
-        print(f"Listing with ID {listing_id} added to database.")
+@timed('db')
+def claim_listings(listing_ids, owner, lease_ttl):
+    """
+    Save listings and claim the unsent ones for this process.
+
+    A listing claimed by another process is left alone until its claim
+    expires, so concurrent processes never enrich and queue the same
+    listing twice. Insert, claim and check run in one write transaction.
+
+    Args:
+        listing_ids (list): Listing IDs
+        owner (str): ID of the claiming process
+        lease_ttl (float): Seconds the claim lasts unless renewed
+
+    Returns:
+        set: IDs claimed by `owner` that still have to be sent
+    """
+    listing_ids = list(dict.fromkeys(listing_ids))
+    if not listing_ids:
+        return set()
+
+    now = time.time()
+    claimed = set()
+    conn = get_connection()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            "INSERT OR IGNORE INTO listings (id, sent, first_seen_at, last_seen_at) VALUES (?, 0, ?, ?)",
+            ((listing_id, now, now) for listing_id in listing_ids)
+        )
+        for chunk in _chunks(listing_ids):
+            placeholders = ','.join('?' * len(chunk))
+            conn.execute(
+                f"UPDATE listings SET claimed_by = ?, claim_expires_at = ? "
+                f"WHERE id IN ({placeholders}) AND sent = 0 "
+                f"AND (claimed_by IS NULL OR claimed_by = ? OR claim_expires_at < ?)",
+                [owner, now + lease_ttl, *chunk, owner, now]
+            )
+            rows = conn.execute(
+                f"SELECT id FROM listings WHERE id IN ({placeholders}) AND sent = 0 AND claimed_by = ?",
+                [*chunk, owner]
+            )
+            claimed.update(row[0] for row in rows)
+    print(f"Saved {len(listing_ids)} listings, claimed {len(claimed)} not sent yet.")
+    return claimed
+
+
+def renew_listing_claims(owner, lease_ttl):
+    """
+    Extend the claims of listings this process is still working on.
+
+    Args:
+        owner (str): ID of the process
+        lease_ttl (float): Seconds from now the claims last
+
+    Returns:
+        int: Number of renewed claims
+    """
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute(
+            "UPDATE listings SET claim_expires_at = ? WHERE sent = 0 AND claimed_by = ?",
+            (time.time() + lease_ttl, owner)
+        )
+    return cursor.rowcount
+
+
+@timed('db')
+def release_listing_claims(listing_ids, owner):
+    """
+    Give up the claims of listings this process did not queue, so another
+    process or a later cycle can pick them up.
+
+    Args:
+        listing_ids (iterable): Listing IDs claimed by `owner`
+        owner (str): ID of the process
+
+    Returns:
+        int: Number of released claims
+    """
+    listing_ids = list(listing_ids)
+    if not listing_ids:
         return 0
+    released = 0
+    conn = get_connection()
+    with conn:
+        for chunk in _chunks(listing_ids):
+            placeholders = ','.join('?' * len(chunk))
+            cursor = conn.execute(
+                f"UPDATE listings SET claimed_by = NULL, claim_expires_at = NULL "
+                f"WHERE id IN ({placeholders}) AND sent = 0 AND claimed_by = ?",
+                [*chunk, owner]
+            )
+            released += cursor.rowcount
+    return released
 
 
-def mark_listing_as_sent(listing_id):
-    """Mark listing as sent in database"""
-    conn = connect_db()
-    cursor = conn.cursor()
+@timed('db')
+def add_listing_targets(targets):
+    """
+    Record the chats that want listings.
+
+    Args:
+        targets (list): (listing_id, chat_id, drop_realtors,
+            drop_maybe_realtors) tuples
+    """
+    if not targets:
+        return
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO listing_targets (listing_id, chat_id, drop_realtors, drop_maybe_realtors) "
+            "VALUES (?, ?, ?, ?)",
+            (
+                (listing_id, str(chat_id), int(bool(drop)), int(bool(drop_maybe)))
+                for listing_id, chat_id, drop, drop_maybe in targets
+            )
+        )
+
+
+@timed('db')
+def enqueue_listings(deliveries, skipped_ids=(), owner=None):
+    """
+    Queue messages for delivery and mark their listings as handled, in one
+    transaction.
+
+    Chats recorded in listing_targets get the same messages in the same
+    transaction, also those added by other processes.
+
+    Args:
+        deliveries (list): (listing_id, chat_id, message, digest_entry,
+            is_realtor, maybe_realtor) tuples
+        skipped_ids (iterable): IDs of listings no chat wants, marked as
+            handled without a delivery
+        owner (str): Process that claimed the listings, listings it no
+            longer holds are left out. None skips the check.
+
+    Returns:
+        set: IDs of the listings that were queued or skipped
+    """
+    listing_ids = {delivery[0] for delivery in deliveries} | set(skipped_ids)
+    if not listing_ids:
+        return set()
+
+    now = time.time()
+    conn = get_connection()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if owner is not None:
+            listing_ids = {
+                listing_id for listing_id in listing_ids
+                if conn.execute(
+                    "SELECT 1 FROM listings WHERE id = ? AND sent = 0 AND claimed_by = ?", (listing_id, owner)
+                ).fetchone()
+            }
+            deliveries = [delivery for delivery in deliveries if delivery[0] in listing_ids]
+        conn.executemany(
+            "INSERT OR IGNORE INTO outbox "
+            "(listing_id, chat_id, message, digest_entry, is_realtor, maybe_realtor, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (listing_id, str(chat_id), message, digest_entry, int(bool(is_realtor)), int(bool(maybe)), now)
+                for listing_id, chat_id, message, digest_entry, is_realtor, maybe in deliveries
+            )
+        )
+        conn.executemany(
+            "UPDATE listings SET sent = 1, sent_at = ?, claimed_by = NULL, claim_expires_at = NULL WHERE id = ?",
+            ((now, listing_id) for listing_id in listing_ids)
+        )
+        _copy_to_targets(conn, list(listing_ids), now)
+    print(f"Queued {len(deliveries)} messages for {len(listing_ids)} listings.")
+    return listing_ids
+
+
+@timed('db')
+def deliver_to_targets(listing_ids):
+    """
+    Queue already formatted messages of handled listings for the chats in
+    listing_targets that do not have them yet.
+
+    Args:
+        listing_ids (list): IDs of listings that may be in the outbox
+
+    Returns:
+        int: Number of deliveries added
+    """
+    listing_ids = list(dict.fromkeys(listing_ids))
+    if not listing_ids:
+        return 0
+    conn = get_connection()
+    with conn:
+        added = _copy_to_targets(conn, listing_ids, time.time())
+    if added:
+        print(f"Queued {added} messages of already handled listings.")
+    return added
+
+
+@timed('db')
+def enqueue_updates(deliveries):
+    """
+    Queue follow-up messages about listings that were already sent, such
+    as price drops.
+
+    A delivery is queued once per kind, queueing the same kind again for a
+    chat does nothing.
+
+    Args:
+        deliveries (list): (listing_id, chat_id, kind, message, digest_entry,
+            is_realtor) tuples
+
+    Returns:
+        int: Number of deliveries added
+    """
+    if not deliveries:
+        return 0
+    now = time.time()
+    conn = get_connection()
+    before = conn.total_changes
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO outbox (listing_id, chat_id, kind, message, digest_entry, is_realtor, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (listing_id, str(chat_id), kind, message, digest_entry, int(bool(is_realtor)), now)
+                for listing_id, chat_id, kind, message, digest_entry, is_realtor in deliveries
+            )
+        )
+    return conn.total_changes - before
+
+
+def _copy_to_targets(conn, listing_ids, now):
+    before = conn.total_changes
+    for chunk in _chunks(listing_ids):
+        placeholders = ','.join('?' * len(chunk))
+        conn.execute(
+            f"INSERT OR IGNORE INTO outbox "
+            f"(listing_id, chat_id, message, digest_entry, is_realtor, maybe_realtor, created_at) "
+            f"SELECT t.listing_id, t.chat_id, o.message, o.digest_entry, o.is_realtor, o.maybe_realtor, ? "
+            f"FROM listing_targets t JOIN ("
+            f"    SELECT listing_id, message, digest_entry, is_realtor, maybe_realtor FROM outbox "
+            f"    WHERE listing_id IN ({placeholders}) AND kind = 'listing' GROUP BY listing_id"
+            f") o ON o.listing_id = t.listing_id "
+            f"WHERE NOT (o.is_realtor AND t.drop_realtors) AND NOT (o.maybe_realtor AND t.drop_maybe_realtors) "
+            # A repost does not go to chats that got its original or another repost
+            f"AND NOT EXISTS ("
+            f"    SELECT 1 FROM listing_fingerprints f JOIN listing_fingerprints g "
+            f"    ON g.listing_id = f.duplicate_of OR g.duplicate_of = f.duplicate_of "
+            f"    JOIN outbox r ON r.listing_id = g.listing_id AND r.chat_id = t.chat_id AND r.kind = 'listing' "
+            f"    WHERE f.listing_id = t.listing_id AND g.listing_id != t.listing_id"
+            f")",
+            [now, *chunk]
+        )
+    return conn.total_changes - before
+
+
+@timed('db')
+def claim_due_deliveries(limit, owner=None, lease_ttl=300, whole_chat=None):
+    """
+    Take due deliveries and lease them to this process.
+
+    Pending deliveries are due when their retry time has come, deliveries
+    being sent when their lease expired. Select and update run in one
+    write transaction, so two processes never claim the same delivery.
+
+    Args:
+        limit (int): Maximum number of deliveries to claim
+        owner (str): ID of the claiming process
+        lease_ttl (float): Seconds the lease lasts unless renewed
+        whole_chat: Function of a chat id telling whether all due
+            deliveries of the chat are claimed together once one of them
+            is, even beyond `limit`. None claims up to `limit` only.
+
+    Returns:
+        list: (listing_id, chat_id, message, attempts, digest_entry,
+            is_realtor, kind) tuples
+    """
+    now = time.time()
+    columns = "listing_id, chat_id, message, attempts, digest_entry, is_realtor, kind"
+    due = "((state = 'pending' AND next_attempt_at <= ?) OR (state = 'sending' AND lease_expires_at < ?))"
+    conn = get_connection()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(
+            f"SELECT {columns} FROM outbox WHERE {due} ORDER BY next_attempt_at, listing_id LIMIT ?",
+            (now, now, limit)
+        ).fetchall()
+        chat_ids = sorted({row[1] for row in rows if whole_chat(row[1])}) if whole_chat else []
+        if chat_ids:
+            claimed = {(row[0], row[1], row[6]) for row in rows}
+            for chunk in _chunks(chat_ids, MAX_QUERY_PARAMS - 2):
+                placeholders = ','.join('?' * len(chunk))
+                rows.extend(
+                    row for row in conn.execute(
+                        f"SELECT {columns} FROM outbox WHERE {due} AND chat_id IN ({placeholders}) "
+                        "ORDER BY next_attempt_at, listing_id",
+                        (now, now, *chunk)
+                    )
+                    if (row[0], row[1], row[6]) not in claimed
+                )
+        conn.executemany(
+            "UPDATE outbox SET state = 'sending', lease_owner = ?, lease_expires_at = ? "
+            "WHERE listing_id = ? AND chat_id = ? AND kind = ?",
+            ((owner, now + lease_ttl, row[0], row[1], row[6]) for row in rows)
+        )
+    return rows
+
+
+def renew_delivery_leases(owner, lease_ttl):
+    """
+    Extend the leases of deliveries this process is still sending.
+
+    Args:
+        owner (str): ID of the process
+        lease_ttl (float): Seconds from now the leases last
+
+    Returns:
+        int: Number of renewed leases
+    """
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute(
+            "UPDATE outbox SET lease_expires_at = ? WHERE state = 'sending' AND lease_owner = ?",
+            (time.time() + lease_ttl, owner)
+        )
+    return cursor.rowcount
+
+
+@timed('db')
+def complete_deliveries(sent, failed):
+    """
+    Record the outcome of claimed deliveries in one transaction.
+
+    Args:
+        sent (list): (listing_id, chat_id, kind) tuples delivered successfully
+        failed (list): (listing_id, chat_id, kind, error, retry_at) tuples,
+            a retry_at of None gives the delivery up for good
+    """
+    now = time.time()
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            "UPDATE outbox SET state = 'sent', sent_at = ?, attempts = attempts + 1, lease_owner = NULL "
+            "WHERE listing_id = ? AND chat_id = ? AND kind = ?",
+            ((now, listing_id, chat_id, kind) for listing_id, chat_id, kind in sent)
+        )
+        conn.executemany(
+            "UPDATE outbox SET state = ?, next_attempt_at = ?, last_error = ?, attempts = attempts + 1, "
+            "lease_owner = NULL "
+            "WHERE listing_id = ? AND chat_id = ? AND kind = ?",
+            (
+                ('pending' if retry_at is not None else 'failed', retry_at or now, error, listing_id, chat_id, kind)
+                for listing_id, chat_id, kind, error, retry_at in failed
+            )
+        )
+
+
+def release_inflight_deliveries():
+    """
+    Return deliveries left in 'sending' by a crashed process to the queue.
+
+    Deliveries leased by a live process stay with it.
+
+    Returns:
+        int: Number of released deliveries
+    """
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute(
+            "UPDATE outbox SET state = 'pending', lease_owner = NULL "
+            "WHERE state = 'sending' AND (lease_expires_at IS NULL OR lease_expires_at < ?)",
+            (time.time(),)
+        )
+    return cursor.rowcount
+
+
+def acquire_lease(name, owner, lease_ttl):
+    """
+    Take or renew a named lease, e.g. on a search profile.
+
+    The lease is granted if it is free, expired or already held by
+    `owner`, in a single upsert.
+
+    Args:
+        name (str): Lease name
+        owner (str): ID of the process
+        lease_ttl (float): Seconds from now the lease lasts
 
-    cursor.execute("UPDATE listings SET sent = 1 WHERE id = ?", (listing_id,))
+    Returns:
+        bool: True if `owner` holds the lease now
+    """
+    now = time.time()
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute(
+            "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+            (name, owner, now + lease_ttl, now)
+        )
+    return cursor.rowcount == 1
+
+
+def release_lease(name, owner):
+    """Give up a lease if `owner` holds it"""
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+
+def outbox_depth():
+    """Number of deliveries waiting to be sent"""
+    cursor = get_connection().execute("SELECT COUNT(*) FROM outbox WHERE state IN ('pending', 'sending')")
+    return cursor.fetchone()[0]
+
+
+def iter_sent_listing_ids():
+    """Yield the ids of all sent listings in ascending order"""
+    cursor = get_connection().execute("SELECT id FROM listings WHERE sent = 1 ORDER BY id")
+    while True:
+        rows = cursor.fetchmany(10000)
+        if not rows:
+            break
+        for row in rows:
+            yield row[0]
+
+
+@timed('db')
+def load_listing_snapshots(listing_ids):
+    """
+    Load the stored snapshots of listings.
+
+    Args:
+        listing_ids (list): Listing IDs
+
+    Returns:
+        dict: Listing ID to (content_hash, price, is_realtor) for the
+            listings that have a snapshot
+    """
+    listing_ids = list(dict.fromkeys(listing_ids))
+    snapshots = {}
+    conn = get_connection()
+    for chunk in _chunks(listing_ids):
+        placeholders = ','.join('?' * len(chunk))
+        rows = conn.execute(
+            f"SELECT listing_id, content_hash, price, is_realtor FROM listing_snapshots "
+            f"WHERE listing_id IN ({placeholders})",
+            chunk
+        )
+        snapshots.update((row[0], row[1:]) for row in rows)
+    return snapshots
+
+
+@timed('db')
+def save_listing_snapshots(snapshots):
+    """
+    Store the first snapshot of listings, existing snapshots are kept.
+
+    Args:
+        snapshots (list): (listing_id, content_hash, price,
+            last_refresh_time, is_realtor) tuples
+    """
+    if not snapshots:
+        return
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO listing_snapshots (listing_id, content_hash, price, last_refresh_time, is_realtor) "
+            "VALUES (?, ?, ?, ?, ?)",
+            snapshots
+        )
+
+
+@timed('db')
+def update_listing_snapshots(changes):
+    """
+    Replace snapshots of changed listings and record price changes.
+
+    A snapshot is only replaced if it still has the old hash, so when two
+    processes notice the same change only one of them records it.
+
+    Args:
+        changes (list): (snapshot, old_hash, old_price) tuples, snapshot as
+            in save_listing_snapshots
+
+    Returns:
+        list: The changes that were recorded
+    """
+    now = time.time()
+    recorded = []
+    conn = get_connection()
+    with conn:
+        for snapshot, old_hash, old_price in changes:
+            listing_id, content_hash, price, last_refresh_time, _ = snapshot
+            cursor = conn.execute(
+                "UPDATE listing_snapshots SET content_hash = ?, price = ?, last_refresh_time = ? "
+                "WHERE listing_id = ? AND content_hash = ?",
+                (content_hash, price, last_refresh_time, listing_id, old_hash)
+            )
+            if cursor.rowcount != 1:
+                continue
+            if price != old_price:
+                conn.execute(
+                    "INSERT INTO price_history (listing_id, old_price, new_price, changed_at) VALUES (?, ?, ?, ?)",
+                    (listing_id, old_price, price, now)
+                )
+            recorded.append((snapshot, old_hash, old_price))
+    return recorded
+
+
+@timed('db')
+def save_listing_fingerprints(fingerprints):
+    """
+    Store the fingerprints of handled listings.
+
+    Args:
+        fingerprints (list): (listing_id, simhash, duplicate_of) tuples,
+            simhash signed, duplicate_of None for originals
+    """
+    if not fingerprints:
+        return
+    now = time.time()
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO listing_fingerprints (listing_id, simhash, duplicate_of, created_at) "
+            "VALUES (?, ?, ?, ?)",
+            ((listing_id, simhash, duplicate_of, now) for listing_id, simhash, duplicate_of in fingerprints)
+        )
+
+
+def iter_listing_fingerprints(since=None):
+    """
+    Yield stored fingerprints in the order they were stored.
+
+    Args:
+        since (float): Only fingerprints stored after this time, None for all
+
+    Yields:
+        tuple: (listing_id, simhash, duplicate_of, created_at)
+    """
+    cursor = get_connection().execute(
+        "SELECT listing_id, simhash, duplicate_of, created_at FROM listing_fingerprints "
+        "WHERE created_at > ? ORDER BY created_at",
+        (-1.0 if since is None else since,)
+    )
+    while True:
+        rows = cursor.fetchmany(10000)
+        if not rows:
+            break
+        yield from rows
+
+
+@timed('db')
+def load_repost_chats(original_ids):
+    """
+    Load the chats that got a listing or one of its reposts.
+
+    Args:
+        original_ids (list): IDs of original listings
+
+    Returns:
+        dict: Original listing ID to the set of chat ids that got it or a
+            repost of it, for originals that went to any chat
+    """
+    original_ids = list(dict.fromkeys(original_ids))
+    chats = {}
+    conn = get_connection()
+    for chunk in _chunks(original_ids, MAX_QUERY_PARAMS // 2):
+        placeholders = ','.join('?' * len(chunk))
+        rows = conn.execute(
+            f"SELECT COALESCE(f.duplicate_of, f.listing_id), o.chat_id FROM listing_fingerprints f "
+            f"JOIN outbox o ON o.listing_id = f.listing_id AND o.kind = 'listing' "
+            f"WHERE f.listing_id IN ({placeholders}) OR f.duplicate_of IN ({placeholders})",
+            [*chunk, *chunk]
+        )
+        for original_id, chat_id in rows:
+            chats.setdefault(original_id, set()).add(chat_id)
+    return chats
+
+
+@timed('db')
+def load_watermark(profile):
+    """
+    Load the crawl watermark of a search profile.
+
+    Returns:
+        tuple: (last_listing_id, last_created_time) or None if never crawled
+    """
+    cursor = get_connection().execute(
+        "SELECT last_listing_id, last_created_time FROM crawl_state WHERE profile = ?",
+        (profile,)
+    )
+    return cursor.fetchone()
+
+
+@timed('db')
+def save_watermark(profile, listing_id, created_time):
+    """Store the newest listing seen by a search profile"""
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "INSERT INTO crawl_state (profile, last_listing_id, last_created_time) VALUES (?, ?, ?) "
+            "ON CONFLICT(profile) DO UPDATE SET last_listing_id = excluded.last_listing_id, "
+            "last_created_time = excluded.last_created_time",
+            (profile, listing_id, created_time)
+        )
+
+
+@timed('db')
+def load_user_profile(user_key):
+    """Load cached OLX user profile fields, or None if the user is unknown"""
+    cursor = get_connection().execute(
+        "SELECT is_business, business_checked_at, listings_count, count_checked_at "
+        "FROM user_profiles WHERE user_key = ?",
+        (str(user_key),)
+    )
+    return cursor.fetchone()
+
+
+@timed('db')
+def save_user_business_flag(user_key, is_business, checked_at):
+    """Store the business flag of an OLX user"""
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "INSERT INTO user_profiles (user_key, is_business, business_checked_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_key) DO UPDATE SET is_business = excluded.is_business, "
+            "business_checked_at = excluded.business_checked_at",
+            (str(user_key), int(is_business), checked_at)
+        )
+
+
+@timed('db')
+def save_user_listings_count(user_key, listings_count, checked_at):
+    """Store the real estate listings count of an OLX user"""
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "INSERT INTO user_profiles (user_key, listings_count, count_checked_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_key) DO UPDATE SET listings_count = excluded.listings_count, "
+            "count_checked_at = excluded.count_checked_at",
+            (str(user_key), listings_count, checked_at)
+        )
+
+
+REPUTATION_COLUMNS = (
+    'listings_seen', 'realtor_listings', 'keyword_listings', 'checked_listings', 'first_seen', 'last_seen',
+    'score', 'weight', 'scored_at', 'keywords'
+)
+
+
+def _reputation_row(row):
+    if row is None:
+        return None
+    row = dict(zip(REPUTATION_COLUMNS, row))
+    row['keywords'] = json.loads(row['keywords'])
+    return row
+
+
+@timed('db')
+def load_user_reputation(user_key):
+    """Load the reputation row of an OLX user as a dict, or None if the user is unknown"""
+    cursor = get_connection().execute(
+        f"SELECT {', '.join(REPUTATION_COLUMNS)} FROM user_reputation WHERE user_key = ?",
+        (str(user_key),)
+    )
+    return _reputation_row(cursor.fetchone())
+
+
+@timed('db')
+def update_user_reputation(observations, merge):
+    """
+    Fold listing verdicts into the reputation of their owners.
+
+    Rows are read and written in one write transaction, so updates from
+    several processes are never lost.
+
+    Args:
+        observations (list): Tuples starting with the user key, in the
+            order they were made
+        merge: Function of (row or None, observation) returning the new row
+
+    Returns:
+        dict: User key to its updated row
+    """
+    rows = {}
+    conn = get_connection()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for observation in observations:
+            user_key = observation[0]
+            if user_key not in rows:
+                rows[user_key] = _reputation_row(conn.execute(
+                    f"SELECT {', '.join(REPUTATION_COLUMNS)} FROM user_reputation WHERE user_key = ?",
+                    (user_key,)
+                ).fetchone())
+            rows[user_key] = merge(rows[user_key], observation)
+        conn.executemany(
+            f"INSERT OR REPLACE INTO user_reputation (user_key, {', '.join(REPUTATION_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * (len(REPUTATION_COLUMNS) + 1))})",
+            (
+                (user_key, *(row[column] for column in REPUTATION_COLUMNS[:-1]), json.dumps(row['keywords'], ensure_ascii=False))
+                for user_key, row in rows.items()
+            )
+        )
+    return rows
+
+
+def load_subscriptions():
+    """
+    Load all chat subscriptions.
+
+    Returns:
+        list: (chat_id, min_price, max_price, districts, realtors, profiles)
+            tuples, districts and profiles as JSON lists
+    """
+    cursor = get_connection().execute(
+        "SELECT chat_id, min_price, max_price, districts, realtors, profiles FROM subscriptions ORDER BY chat_id"
+    )
+    return cursor.fetchall()
+
+
+def subscriptions_version():
+    """Number of subscriptions and time of the latest change, to notice edits"""
+    return get_connection().execute("SELECT COUNT(*), MAX(updated_at) FROM subscriptions").fetchone()
+
+
+def save_subscription(chat_id, min_price, max_price, districts, realtors, profiles):
+    """Create or replace the subscription of a chat"""
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO subscriptions "
+            "(chat_id, min_price, max_price, districts, realtors, profiles, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (str(chat_id), min_price, max_price, districts, realtors, profiles, time.time())
+        )
+
+
+def delete_subscription(chat_id):
+    """
+    Delete the subscription of a chat.
+
+    Returns:
+        bool: True if the chat had one
+    """
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute("DELETE FROM subscriptions WHERE chat_id = ?", (str(chat_id),))
+    return cursor.rowcount > 0
+
+
+@timed('db')
+def touch_listings(listing_ids, min_age=24 * 3600):
+    """
+    Record that handled listings still show up on crawled pages, so
+    retention keeps them while they do.
+
+    Args:
+        listing_ids (list): Listing IDs
+        min_age (float): Seconds since the last record before it is renewed,
+            keeps the writes to about one per listing and day
+    """
+    listing_ids = list(dict.fromkeys(listing_ids))
+    if not listing_ids:
+        return
+    now = time.time()
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            "UPDATE listings SET last_seen_at = ? WHERE id = ? AND last_seen_at < ?",
+            ((now, listing_id, now - min_age) for listing_id in listing_ids)
+        )
+
+
+def _attach_archive(conn):
+    if any(row[1] == 'archive' for row in conn.execute("PRAGMA database_list")):
+        return
+    conn.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_PATH,))
+    conn.execute('''CREATE TABLE IF NOT EXISTS archive.listings (
+        id INTEGER PRIMARY KEY,
+        sent INTEGER,
+        first_seen_at REAL,
+        last_seen_at REAL,
+        sent_at REAL,
+        price INTEGER,
+        duplicate_of INTEGER,
+        archived_at REAL NOT NULL
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS archive.price_history (
+        listing_id INTEGER NOT NULL,
+        old_price INTEGER,
+        new_price INTEGER,
+        changed_at REAL NOT NULL
+    )''')
     conn.commit()
-    print(f"Listing with ID {listing_id} marked as sent.")
-    conn.close() 
\ No newline at end of file
+
+
+# Rows of these tables go with their listing
+LISTING_TABLES = ('price_history', 'listing_snapshots', 'listing_fingerprints', 'listing_targets', 'outbox')
+
+
+@timed('db')
+def purge_listings(cutoff, batch_size):
+    """
+    Delete one batch of listings not seen on crawled pages since `cutoff`,
+    with their snapshots, price history, fingerprints, targets and
+    deliveries. With DATABASE_ARCHIVE_PATH set, listings and price history
+    are copied there first.
+
+    Args:
+        cutoff (float): Timestamp, listings last seen before it are deleted
+        batch_size (int): Maximum number of listings deleted
+
+    Returns:
+        int: Number of listings deleted
+    """
+    conn = get_connection()
+    if ARCHIVE_PATH:
+        _attach_archive(conn)
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        listing_ids = [row[0] for row in conn.execute(
+            "SELECT id FROM listings WHERE last_seen_at < ? ORDER BY last_seen_at LIMIT ?", (cutoff, batch_size)
+        )]
+        if not listing_ids:
+            return 0
+        for chunk in _chunks(listing_ids):
+            placeholders = ','.join('?' * len(chunk))
+            if ARCHIVE_PATH:
+                conn.execute(
+                    f"INSERT OR REPLACE INTO archive.listings "
+                    f"SELECT l.id, l.sent, l.first_seen_at, l.last_seen_at, l.sent_at, s.price, f.duplicate_of, ? "
+                    f"FROM listings l LEFT JOIN listing_snapshots s ON s.listing_id = l.id "
+                    f"LEFT JOIN listing_fingerprints f ON f.listing_id = l.id WHERE l.id IN ({placeholders})",
+                    [time.time(), *chunk]
+                )
+                conn.execute(
+                    f"INSERT INTO archive.price_history SELECT listing_id, old_price, new_price, changed_at "
+                    f"FROM price_history WHERE listing_id IN ({placeholders})",
+                    chunk
+                )
+            for table in LISTING_TABLES:
+                conn.execute(f"DELETE FROM {table} WHERE listing_id IN ({placeholders})", chunk)
+            conn.execute(f"DELETE FROM listings WHERE id IN ({placeholders})", chunk)
+    return len(listing_ids)
+
+
+@timed('db')
+def purge_outbox(cutoff, batch_size):
+    """
+    Delete one batch of sent or failed deliveries queued before `cutoff`.
+
+    Returns:
+        int: Number of deliveries deleted
+    """
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute(
+            "DELETE FROM outbox WHERE rowid IN ("
+            "    SELECT rowid FROM outbox WHERE state IN ('sent', 'failed') AND created_at < ? LIMIT ?"
+            ")",
+            (cutoff, batch_size)
+        )
+    return cursor.rowcount
+
+
+@timed('db')
+def purge_listing_targets(since, cutoff, batch_size):
+    """
+    Delete one batch of listing targets of listings last seen between
+    `since` and `cutoff`. Once a listing is off the crawled pages no
+    process queues it for more chats.
+
+    Args:
+        since (float): Timestamp up to which targets were purged before
+        cutoff (float): Timestamp up to which targets are purged now
+        batch_size (int): Maximum number of targets deleted
+
+    Returns:
+        int: Number of targets deleted
+    """
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute(
+            "DELETE FROM listing_targets WHERE rowid IN ("
+            "    SELECT t.rowid FROM listings l JOIN listing_targets t ON t.listing_id = l.id "
+            "    WHERE l.last_seen_at >= ? AND l.last_seen_at < ? LIMIT ?"
+            ")",
+            (since, cutoff, batch_size)
+        )
+    return cursor.rowcount
+
+
+@timed('db')
+def purge_users(cutoff, batch_size):
+    """
+    Delete one batch of cached OLX user profiles last checked, and user
+    reputations last seen, before `cutoff`.
+
+    Returns:
+        int: Number of rows deleted
+    """
+    conn = get_connection()
+    with conn:
+        deleted = conn.execute(
+            "DELETE FROM user_reputation WHERE rowid IN ("
+            "    SELECT rowid FROM user_reputation WHERE last_seen < ? LIMIT ?"
+            ")",
+            (cutoff, batch_size)
+        ).rowcount
+        deleted += conn.execute(
+            "DELETE FROM user_profiles WHERE rowid IN ("
+            "    SELECT rowid FROM user_profiles "
+            "    WHERE MAX(COALESCE(business_checked_at, 0), COALESCE(count_checked_at, 0)) < ? LIMIT ?"
+            ")",
+            (cutoff, batch_size)
+        ).rowcount
+    return deleted
+
+
+def incremental_vacuum(pages):
+    """
+    Return up to `pages` free pages of the database file to the file system.
+
+    Args:
+        pages (int): Pages to free, 0 only counts them
+
+    Returns:
+        int: Free pages left in the file
+    """
+    conn = get_connection()
+    # SQLite frees the whole free list for 0, so that is never passed on.
+    # The pragma frees one page per step and execute() steps it only once,
+    # executescript() runs it to completion.
+    if pages > 0:
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+    return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def database_size():
+    """Size of the database file in bytes, without the write-ahead log"""
+    conn = get_connection()
+    return conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
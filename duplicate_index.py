@@ -0,0 +1,278 @@
+import os
+import re
+import time
+import hashlib
+import logging
+from array import array
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Differing fingerprint bits up to which two listings count as the same flat
+MAX_DISTANCE = int(os.getenv('DUPLICATE_MAX_DISTANCE', '3'))
+# Number of recently added fingerprints kept in dicts before merging into the sorted bands
+MERGE_THRESHOLD = int(os.getenv('DUPLICATE_INDEX_MERGE_THRESHOLD', '4096'))
+
+BITS = 64
+MASK = (1 << BITS) - 1
+# Bits of a band key below the band value, they hold the position of the entry
+POSITION_BITS = 40
+
+# Total weight of each group of features, so a long description does not
+# outweigh the title and a missing one shifts the fingerprint little
+TITLE_WEIGHT = 4.0
+DESCRIPTION_WEIGHT = 2.0
+PRICE_WEIGHT = 2.0
+DISTRICT_WEIGHT = 1.0
+USER_WEIGHT = 1.5
+# Prices within a step share at least one of the two bucket features
+PRICE_STEP = 1000
+
+_WORD = re.compile(r'\w{2,}')
+
+
+def _token_hash(token):
+    return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def listing_features(listing_data):
+    """
+    Weighted features of a parsed listing for its fingerprint.
+
+    Args:
+        listing_data (Listing): Parsed listing data
+
+    Returns:
+        list: (feature, weight) tuples
+    """
+    features = []
+
+    def add_group(tokens, weight):
+        tokens = set(tokens)
+        features.extend((token, weight / len(tokens)) for token in tokens)
+
+    title_words = _WORD.findall((listing_data.title or '').lower())
+    if title_words:
+        add_group((f"t:{word}" for word in title_words), TITLE_WEIGHT)
+    description_words = _WORD.findall((listing_data.description or '').lower())
+    if description_words:
+        add_group((f"d:{word}" for word in description_words), DESCRIPTION_WEIGHT)
+    try:
+        price = float(listing_data.price)
+    except (TypeError, ValueError):
+        price = None
+    if price is not None:
+        add_group([f"p:{int(price // PRICE_STEP)}", f"p~{int((price + PRICE_STEP / 2) // PRICE_STEP)}"], PRICE_WEIGHT)
+    if listing_data.district_name:
+        add_group([f"r:{listing_data.district_name.lower()}"], DISTRICT_WEIGHT)
+    if listing_data.user_id:
+        add_group([f"u:{listing_data.user_id}"], USER_WEIGHT)
+    return features
+
+
+def simhash(features):
+    """
+    64-bit SimHash of weighted features.
+
+    Similar feature sets give fingerprints that differ in few bits.
+
+    Args:
+        features (list): (feature, weight) tuples
+
+    Returns:
+        int: Unsigned 64-bit fingerprint
+    """
+    totals = [0.0] * BITS
+    for feature, weight in features:
+        value = _token_hash(feature)
+        for bit in range(BITS):
+            if value >> bit & 1:
+                totals[bit] += weight
+            else:
+                totals[bit] -= weight
+    fingerprint = 0
+    for bit, total in enumerate(totals):
+        if total > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def listing_fingerprint(listing_data):
+    """Fingerprint of a parsed listing"""
+    return simhash(listing_features(listing_data))
+
+
+def to_signed(fingerprint):
+    """Store an unsigned 64-bit fingerprint in an SQLite INTEGER"""
+    return fingerprint - (1 << BITS) if fingerprint >> (BITS - 1) else fingerprint
+
+
+def to_unsigned(value):
+    """Read back a fingerprint stored by to_signed"""
+    return value & MASK
+
+
+def _hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class DuplicateIndex:
+    """
+    Near-duplicate index of listing fingerprints, locality-sensitive hashed.
+
+    Fingerprints are split into MAX_DISTANCE + 1 bands. Two fingerprints
+    that differ in at most MAX_DISTANCE bits agree completely on at least
+    one band, so only entries sharing a band value with the query are
+    compared. Every band is a sorted array of 64-bit keys, the band value
+    above the position of the entry, searched by bisection. Fingerprints
+    and ids take 8 bytes each, keys 8 bytes per band. Newly added entries
+    go to small per-band dicts merged into the arrays once they grow past
+    MERGE_THRESHOLD.
+    """
+
+    def __init__(self, max_distance=MAX_DISTANCE, merge_threshold=MERGE_THRESHOLD):
+        self.max_distance = max_distance
+        self.merge_threshold = merge_threshold
+        bands = max_distance + 1
+        widths = [BITS // bands + (1 if band < BITS % bands else 0) for band in range(bands)]
+        self._bands = []
+        shift = 0
+        for width in widths:
+            self._bands.append((shift, (1 << width) - 1))
+            shift += width
+        self._clear()
+
+    def _clear(self):
+        self._fingerprints = array('Q')
+        self._ids = array('q')
+        self._originals = array('q')
+        self._keys = [array('Q') for _ in self._bands]
+        self._recent = [{} for _ in self._bands]
+        self._recent_count = 0
+        # Listings added by this process since the last sync
+        self._local = set()
+        self.synced_at = 0.0
+
+    def load(self, rows):
+        """
+        Replace the index contents with stored fingerprints.
+
+        Args:
+            rows: Iterable of (listing_id, simhash, duplicate_of, created_at)
+                rows as yielded by database.iter_listing_fingerprints
+        """
+        self._clear()
+        started = time.perf_counter()
+        for listing_id, fingerprint, original_id, created_at in rows:
+            self._append(listing_id, to_unsigned(fingerprint), original_id)
+            self.synced_at = max(self.synced_at, created_at)
+        for band, (shift, mask) in enumerate(self._bands):
+            self._keys[band] = array('Q', sorted(
+                (fingerprint >> shift & mask) << POSITION_BITS | position
+                for position, fingerprint in enumerate(self._fingerprints)
+            ))
+        logger.info(
+            f"Loaded {len(self._ids)} listing fingerprints in {time.perf_counter() - started:.2f}s, "
+            f"{self.memory_usage() // 1024} KiB"
+        )
+
+    def sync(self, rows):
+        """
+        Add fingerprints stored since the last load or sync, e.g. by other
+        processes. Listings added by this process are skipped.
+
+        Args:
+            rows: Iterable of rows as in load, stored after synced_at
+        """
+        if not self.synced_at and not self._ids:
+            return self.load(rows)
+        added = 0
+        for listing_id, fingerprint, original_id, created_at in rows:
+            self.synced_at = max(self.synced_at, created_at)
+            if listing_id in self._local:
+                continue
+            self.add(listing_id, to_unsigned(fingerprint), original_id)
+            added += 1
+        self._local.clear()
+        if added:
+            logger.info(f"Added {added} listing fingerprints stored by other processes")
+
+    def find(self, fingerprint):
+        """
+        Find the original of a near-duplicate.
+
+        Args:
+            fingerprint (int): Fingerprint of a new listing
+
+        Returns:
+            int: Listing id of the closest earlier listing's original, None
+                if no listing is within MAX_DISTANCE bits
+        """
+        best = None
+        best_distance = self.max_distance + 1
+        for position in self._candidates(fingerprint):
+            distance = _hamming(fingerprint, self._fingerprints[position])
+            if distance < best_distance:
+                best, best_distance = position, distance
+        if best is None:
+            return None
+        original = self._originals[best]
+        return self._ids[best] if original < 0 else original
+
+    def add(self, listing_id, fingerprint, original_id=None):
+        """
+        Add a listing.
+
+        Args:
+            listing_id (int): Listing ID
+            fingerprint (int): Its fingerprint
+            original_id (int): Listing it duplicates, None for an original
+        """
+        position = self._append(listing_id, fingerprint, original_id)
+        self._local.add(listing_id)
+        for band, (shift, mask) in enumerate(self._bands):
+            self._recent[band].setdefault(fingerprint >> shift & mask, []).append(position)
+        self._recent_count += 1
+        if self._recent_count >= self.merge_threshold:
+            self._merge()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def memory_usage(self):
+        """Approximate number of bytes held by the index."""
+        arrays = [self._fingerprints, self._ids, self._originals, *self._keys]
+        return sum(a.itemsize * len(a) for a in arrays) + 100 * len(self._bands) * self._recent_count
+
+    def _append(self, listing_id, fingerprint, original_id):
+        self._fingerprints.append(fingerprint)
+        self._ids.append(listing_id)
+        self._originals.append(-1 if original_id is None else original_id)
+        return len(self._ids) - 1
+
+    def _candidates(self, fingerprint):
+        seen = set()
+        for band, (shift, mask) in enumerate(self._bands):
+            value = fingerprint >> shift & mask
+            keys = self._keys[band]
+            index = bisect_left(keys, value << POSITION_BITS)
+            position_mask = (1 << POSITION_BITS) - 1
+            while index < len(keys) and keys[index] >> POSITION_BITS == value:
+                seen.add(keys[index] & position_mask)
+                index += 1
+            seen.update(self._recent[band].get(value, ()))
+        return seen
+
+    def _merge(self):
+        for band in range(len(self._bands)):
+            recent = [
+                value << POSITION_BITS | position
+                for value, positions in self._recent[band].items()
+                for position in positions
+            ]
+            self._keys[band] = array('Q', sorted(self._keys[band] + array('Q', recent)))
+            self._recent[band] = {}
+        self._recent_count = 0
+
+
+duplicate_index = DuplicateIndex()
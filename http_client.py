@@ -0,0 +1,366 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from urllib.parse import urlsplit
+
+import httpx
+
+from metrics import OLX_CIRCUIT_OPEN, OLX_HEDGED_REQUESTS, OLX_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+OLX_BASE_URL = os.getenv('OLX_BASE_URL', 'https://www.olx.ua').rstrip('/')
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+# Maximum number of pooled keep-alive connections to olx.ua
+POOL_SIZE = int(os.getenv('OLX_POOL_SIZE', '20'))
+# Seconds a single OLX request may take, also capped by the cycle deadline
+REQUEST_TIMEOUT = float(os.getenv('OLX_TIMEOUT', '10'))
+# Seconds all OLX requests of one fetch cycle may take together
+CYCLE_DEADLINE = float(os.getenv('OLX_CYCLE_DEADLINE', '120'))
+# Failed requests in a row that open the circuit of an endpoint, and
+# seconds it stays open before a single probe request is let through
+BREAKER_THRESHOLD = int(os.getenv('OLX_BREAKER_THRESHOLD', '5'))
+BREAKER_RESET = float(os.getenv('OLX_BREAKER_RESET', '30'))
+# Seconds before a slow user lookup is sent a second time, 0 disables hedging
+HEDGE_DELAY = float(os.getenv('OLX_HEDGE_DELAY', '0'))
+
+_session = None
+_async_client = None
+_deadline = ContextVar('olx_deadline', default=None)
+
+
+class OlxUnavailable(Exception):
+    """Request refused without touching the network: open circuit or spent deadline."""
+
+
+class _AsyncOlxUnavailable(OlxUnavailable, httpx.TransportError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Fails fast on an OLX endpoint that keeps failing.
+
+    After `threshold` failures in a row the circuit opens and requests are
+    refused for `reset_timeout` seconds. Then one probe request is let
+    through: success closes the circuit, failure opens it again. A probe
+    that ends without an answer of the endpoint, cancelled or cut short by
+    the cycle deadline, lets the next request probe instead.
+    """
+
+    def __init__(self, endpoint, threshold=BREAKER_THRESHOLD, reset_timeout=BREAKER_RESET):
+        self.endpoint = endpoint
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Check whether a request may be sent now.
+
+        Returns:
+            bool: False while the circuit is open
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self._probing and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        """Close the circuit after a successful request."""
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info(f"OLX endpoint '{self.endpoint}' recovered, circuit closed")
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+        OLX_CIRCUIT_OPEN.labels(self.endpoint).set(0)
+
+    def record_failure(self):
+        """Count a failed request, opening the circuit at the threshold."""
+        with self._lock:
+            self.failures += 1
+            if not self._probing and self.failures < self.threshold:
+                return
+            if self.opened_at is None or self._probing:
+                logger.warning(f"OLX endpoint '{self.endpoint}' failing, circuit open for {self.reset_timeout:.0f} seconds")
+            self.opened_at = time.monotonic()
+            self._probing = False
+        OLX_CIRCUIT_OPEN.labels(self.endpoint).set(1)
+
+    def release_probe(self):
+        """Free the probe slot after a request that says nothing about the endpoint."""
+        with self._lock:
+            self._probing = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(endpoint):
+    """Get the circuit breaker of an OLX endpoint, creating it on first use."""
+    breaker = _breakers.get(endpoint)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(endpoint, CircuitBreaker(endpoint))
+    return breaker
+
+
+@contextmanager
+def deadline_scope(seconds=CYCLE_DEADLINE):
+    """
+    Give all OLX requests made inside the block a shared time budget.
+
+    The budget follows the context into tasks and threads started inside
+    the block. Requests still running when it is spent time out, later
+    ones fail right away. Nested scopes never extend an outer budget.
+
+    Args:
+        seconds (float): Budget in seconds
+    """
+    deadline = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time():
+    """Seconds left of the current deadline, None outside deadline_scope()"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _request_timeout(timeout, endpoint, unavailable):
+    # Refuses the request or returns its timeout capped by the deadline,
+    # and whether the cap cut it short
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        OLX_REQUESTS.labels(endpoint, 'deadline').inc()
+        raise unavailable(f"Cycle deadline spent, skipping OLX '{endpoint}' request")
+    if not get_breaker(endpoint).allow():
+        OLX_REQUESTS.labels(endpoint, 'circuit_open').inc()
+        raise unavailable(f"Circuit of OLX endpoint '{endpoint}' is open")
+    if remaining is None or remaining >= timeout:
+        return timeout, False
+    return remaining, True
+
+
+def _record_outcome(endpoint, status, cut_short=False):
+    # Called in a finally for every request let through, so a probe
+    # always frees its slot
+    OLX_REQUESTS.labels(endpoint, status).inc()
+    breaker = get_breaker(endpoint)
+    if status == 'cancelled' or (status == 'error' and cut_short):
+        # Cancelled, or timed out on the cycle deadline: not the endpoint's fault
+        breaker.release_probe()
+    elif status == 'error' or status == 429 or status >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+
+def olx_url(path):
+    """
+    Build an absolute OLX URL from a path.
+
+    Args:
+        path (str): Path starting with '/'
+
+    Returns:
+        str: Absolute URL
+    """
+    return f"{OLX_BASE_URL}{path}"
+
+
+def olx_endpoint(path, query=''):
+    """
+    Name the OLX API endpoint of a request for metrics.
+
+    Args:
+        path (str): URL path
+        query (str): URL query string
+
+    Returns:
+        str: 'graphql', 'users', 'user_offers', 'offer' or 'other'
+    """
+    parts = [part for part in path.split('/') if part]
+    if parts[-1:] == ['graphql']:
+        return 'graphql'
+    if parts[:3] == ['api', 'v1', 'users']:
+        return 'users'
+    if parts[:3] == ['api', 'v1', 'offers']:
+        return 'offer' if len(parts) > 3 else 'user_offers' if 'user_id=' in query else 'offers'
+    return 'other'
+
+
+def _counting_adapter(**kwargs):
+    """
+    Transport adapter for the requests session counting requests per
+    endpoint and status.
+
+    Applies the request timeout, the cycle deadline and the circuit
+    breaker of the endpoint. requests is imported here, only the
+    synchronous code paths need it.
+    """
+    import requests
+
+    class _SyncOlxUnavailable(OlxUnavailable, requests.exceptions.ConnectionError):
+        pass
+
+    class _CountingAdapter(requests.adapters.HTTPAdapter):
+        def send(self, request, timeout=None, **kwargs):
+            url = urlsplit(request.url)
+            endpoint = olx_endpoint(url.path, url.query)
+            timeout, cut_short = _request_timeout(timeout or REQUEST_TIMEOUT, endpoint, _SyncOlxUnavailable)
+            status = 'cancelled'
+            try:
+                response = super().send(request, timeout=timeout, **kwargs)
+                status = response.status_code
+                return response
+            except Exception:
+                status = 'error'
+                raise
+            finally:
+                _record_outcome(endpoint, status, cut_short)
+
+    return _CountingAdapter(**kwargs)
+
+
+class _CountingTransport(httpx.AsyncBaseTransport):
+    """
+    Async transport wrapper counting requests per endpoint and status.
+
+    Applies the cycle deadline and the circuit breaker of the endpoint,
+    the request timeout is set on the client.
+    """
+
+    def __init__(self, transport):
+        self._transport = transport
+
+    async def handle_async_request(self, request):
+        endpoint = olx_endpoint(request.url.path, request.url.query.decode())
+        timeouts = request.extensions.get('timeout', {})
+        cap, cut_short = _request_timeout(REQUEST_TIMEOUT, endpoint, _AsyncOlxUnavailable)
+        request.extensions['timeout'] = {
+            name: cap if value is None else min(value, cap) for name, value in timeouts.items()
+        } or {'connect': cap, 'read': cap, 'write': cap, 'pool': cap}
+        status = 'cancelled'
+        try:
+            response = await self._transport.handle_async_request(request)
+            status = response.status_code
+            return response
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            _record_outcome(endpoint, status, cut_short)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def get_session():
+    """
+    Get the shared requests session used by the synchronous code paths.
+
+    The session keeps connections to olx.ua alive between calls instead of
+    opening a new one for every request.
+
+    Returns:
+        requests.Session: Shared session
+    """
+    global _session
+    if _session is None:
+        import requests
+
+        _session = requests.Session()
+        _session.headers.update(DEFAULT_HEADERS)
+        adapter = _counting_adapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        _session.mount('https://', adapter)
+        _session.mount('http://', adapter)
+    return _session
+
+
+def get_async_client():
+    """
+    Get the shared async HTTP client with a keep-alive connection pool.
+
+    Returns:
+        httpx.AsyncClient: Shared client
+    """
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        limits = httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE)
+        transport = _CountingTransport(httpx.AsyncHTTPTransport(limits=limits))
+        _async_client = httpx.AsyncClient(
+            headers=DEFAULT_HEADERS, transport=transport, timeout=httpx.Timeout(REQUEST_TIMEOUT)
+        )
+    return _async_client
+
+
+async def hedged_get(client, url, delay=HEDGE_DELAY):
+    """
+    GET an idempotent URL, sending it a second time if the first is slow.
+
+    When no response arrived after `delay` seconds a second request is
+    started and whichever answers first wins, the other one is cancelled.
+    Only when both fail the error of the first one is raised.
+    No second request is sent while the endpoint's circuit is not closed.
+
+    Args:
+        client (httpx.AsyncClient): Shared HTTP client
+        url (str): Absolute URL
+        delay (float): Seconds to wait before hedging, 0 sends one request
+
+    Returns:
+        httpx.Response: First response
+    """
+    if not delay:
+        return await client.get(url)
+
+    first = asyncio.ensure_future(client.get(url))
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    url_parts = urlsplit(url)
+    endpoint = olx_endpoint(url_parts.path, url_parts.query)
+    if done or get_breaker(endpoint).opened_at is not None:
+        return await first
+
+    second = asyncio.ensure_future(client.get(url))
+    pending = {first, second}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    OLX_HEDGED_REQUESTS.labels(endpoint, 'second' if task is second else 'first').inc()
+                    return task.result()
+        return first.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def close_async_client():
+    """Close the shared async HTTP client if it was created."""
+    global _async_client
+    if _async_client is not None and not _async_client.is_closed:
+        await _async_client.aclose()
+    _async_client = None
@@ -0,0 +1,206 @@
+import os
+import re
+import json
+import logging
+from multiprocessing import Pool
+
+logger = logging.getLogger(__name__)
+
+REALTOR_KEYWORDS_FILE = os.getenv('REALTOR_KEYWORDS_FILE', 'realtor_keywords.json')
+
+# Keywords that might indicate a realtor listing
+DEFAULT_REALTOR_KEYWORDS = [
+    'рієлтор', 'ріелтор', 'ріелторська', 'рієлторська',
+    'агентство', 'агент', 'агентка',
+    'брокер', 'брокерська',
+    'посередник', 'посередництво',
+    'агентство нерухомості', 'агент нерухомості',
+    'офіс нерухомості', 'компанія нерухомості',
+    'професійний', 'професійна',
+    'квартира під ключ', 'квартири під ключ',
+    'пропозиція від агентства', 'пропозиція від агента',
+    'здійснюємо показ', 'проводимо показ',
+    'допоможемо підібрати', 'допоможемо знайти',
+    'великий вибір', 'широкий вибір',
+    'гарантуємо', 'гарантуємо якість',
+    'офіційний договір', 'офіційна угода',
+    'професійна консультація', 'консультація спеціаліста'
+]
+
+# Keywords that might indicate a private listing
+DEFAULT_PRIVATE_KEYWORDS = [
+    'оренда від власника', 'оренда від господаря',
+    'продаж від власника', 'продаж від господаря',
+    'без посередників', 'без рієлторів',
+    'без комісії', 'без додаткових витрат',
+    'без агентства', 'без агентів',
+    'прямий контакт', 'контакт з власником',
+    'здає власник', 'продає власник',
+    'орендодавець', 'власник квартири',
+    'господар квартири', 'господар оселі'
+]
+
+
+class KeywordMatcher:
+    """
+    Counts realtor and private keyword hits in one pass over a text.
+
+    All keywords are compiled into a single prefix-tree shaped regex, so
+    the regex engine skips positions that cannot start any keyword. Each
+    match is the longest keyword starting at its position and the search
+    resumes right after the match start, so overlapping keywords are not
+    missed. Keywords contained in a match (for example 'агент' inside
+    'агентство нерухомості') are added from a table precomputed at
+    construction. A keyword therefore counts exactly when it occurs anywhere
+    in the text, like a plain `keyword in text` check.
+    """
+
+    def __init__(self, realtor_keywords, private_keywords):
+        """
+        Args:
+            realtor_keywords (dict): Realtor keyword to weight
+            private_keywords (dict): Private keyword to weight
+        """
+        self.realtor_weights = {keyword.lower(): weight for keyword, weight in realtor_keywords.items()}
+        self.private_weights = {keyword.lower(): weight for keyword, weight in private_keywords.items()}
+
+        keywords = sorted(set(self.realtor_weights) | set(self.private_weights))
+        self._pattern = re.compile(_trie_pattern(keywords)) if keywords else None
+        self._contained = {
+            keyword: frozenset(other for other in keywords if other in keyword)
+            for keyword in keywords
+        }
+
+    def matches(self, text):
+        """
+        Find all distinct keywords occurring in a text.
+
+        Args:
+            text (str): Listing description
+
+        Returns:
+            set: Matched keywords
+        """
+        if not text or self._pattern is None:
+            return set()
+        text = text.lower()
+        search = self._pattern.search
+        found = set()
+        position = 0
+        while True:
+            match = search(text, position)
+            if match is None:
+                return found
+            found |= self._contained[match.group()]
+            position = match.start() + 1
+
+    def score(self, text):
+        """
+        Score a text against both keyword sets.
+
+        Args:
+            text (str): Listing description
+
+        Returns:
+            tuple: (realtor score, private score)
+        """
+        found = self.matches(text)
+        realtor_score = sum(self.realtor_weights.get(keyword, 0) for keyword in found)
+        private_score = sum(self.private_weights.get(keyword, 0) for keyword in found)
+        return realtor_score, private_score
+
+    def classify(self, text):
+        """
+        Check whether a text reads like a realtor listing.
+
+        Returns:
+            bool: True if realtor keywords outweigh private ones
+        """
+        realtor_score, private_score = self.score(text)
+        return realtor_score > private_score
+
+    def classify_many(self, descriptions, processes=None, chunk_size=1000):
+        """
+        Classify many descriptions, e.g. to backfill an archive.
+
+        Args:
+            descriptions (iterable): Listing descriptions
+            processes (int): Worker processes to spread the work over,
+                classified in this process if None
+            chunk_size (int): Descriptions handed to a worker at once
+
+        Returns:
+            list: Realtor verdict for every description, in order
+        """
+        if not processes or processes < 2:
+            return [self.classify(description) for description in descriptions]
+        descriptions = list(descriptions)
+        chunks = [descriptions[i:i + chunk_size] for i in range(0, len(descriptions), chunk_size)]
+        with Pool(processes, initializer=_init_worker, initargs=(self,)) as pool:
+            results = pool.map(_classify_chunk, chunks)
+        return [verdict for chunk in results for verdict in chunk]
+
+
+def _trie_pattern(keywords):
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # Optional groups are greedy, so the longest keyword wins
+        return '(?:' + body + ')?' if '' in node else body
+
+    return build(trie)
+
+
+_worker_matcher = None
+
+
+def _init_worker(matcher):
+    global _worker_matcher
+    _worker_matcher = matcher
+
+
+def _classify_chunk(descriptions):
+    return [_worker_matcher.classify(description) for description in descriptions]
+
+
+def _weights(keywords):
+    if isinstance(keywords, dict):
+        return {keyword: float(weight) for keyword, weight in keywords.items()}
+    return {keyword: 1 for keyword in keywords}
+
+
+def load_keyword_matcher(path=REALTOR_KEYWORDS_FILE):
+    """
+    Build a matcher from a JSON config file.
+
+    The file holds "realtor" and "private" entries, each either a list of
+    keywords (weight 1) or an object mapping keywords to weights. Missing
+    entries fall back to the built-in keyword lists.
+
+    Args:
+        path (str): Path of the JSON file
+
+    Returns:
+        KeywordMatcher: Compiled matcher
+    """
+    config = {}
+    if path and os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            config = json.load(f)
+        logger.info(f"Loaded realtor keywords from {path}")
+    return KeywordMatcher(
+        _weights(config.get('realtor', DEFAULT_REALTOR_KEYWORDS)),
+        _weights(config.get('private', DEFAULT_PRIVATE_KEYWORDS))
+    )
+
+
+keyword_matcher = load_keyword_matcher()
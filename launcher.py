@@ -0,0 +1,126 @@
+"""
+Run several bot workers on one database, search profiles sharded across them.
+
+    python launcher.py --workers 4
+
+Every worker is a separate process running main.py with WORKER_SHARD set to
+its "index/count". Workers coordinate through leases in the SQLite database,
+see leases.py, so each listing is queued and sent exactly once. A worker
+that exits is started again with a growing delay.
+"""
+import os
+import time
+import signal
+import logging
+import argparse
+import multiprocessing
+
+from dotenv import load_dotenv
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Restart delays grow up to this many seconds for a worker that keeps failing
+MAX_RESTART_DELAY = 60
+# A worker running this long before it exits starts over with the shortest delay
+STABLE_RUNTIME = 300
+
+
+def default_workers():
+    """One worker per search profile, at most one per CPU core"""
+    from search_profiles import load_search_profiles
+    return max(1, min(os.cpu_count() or 1, len(load_search_profiles([]))))
+
+
+def run_worker(index, count, metrics_port):
+    """
+    Entry point of a worker process.
+
+    Args:
+        index (int): Shard of the worker
+        count (int): Number of workers
+        metrics_port (int): Metrics port of the worker, 0 disables it
+    """
+    # Settings are read when the modules are imported, so set them first
+    os.environ['WORKER_SHARD'] = f"{index}/{count}"
+    os.environ['METRICS_PORT'] = str(metrics_port)
+    import main
+    main.main()
+
+
+class Launcher:
+    """Starts the worker processes and restarts those that exit."""
+
+    def __init__(self, workers, metrics_port):
+        self.workers = workers
+        self.metrics_port = metrics_port
+        self._context = multiprocessing.get_context('spawn')
+        self._processes = {}
+        self._restarts = {}
+        self._stopping = False
+
+    def start(self, index):
+        port = self.metrics_port + index if self.metrics_port else 0
+        process = self._context.Process(
+            target=run_worker, args=(index, self.workers, port), name=f"worker-{index}"
+        )
+        process.start()
+        self._processes[index] = (process, time.monotonic())
+        logger.info(f"Started worker {index}/{self.workers} with pid {process.pid}")
+
+    def run(self):
+        """Run the workers until SIGINT or SIGTERM."""
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        for index in range(self.workers):
+            self.start(index)
+
+        restart_at = {}
+        while not self._stopping:
+            time.sleep(1)
+            now = time.monotonic()
+            for index, (process, started) in list(self._processes.items()):
+                if process.is_alive() or index in restart_at:
+                    continue
+                restarts = 0 if now - started >= STABLE_RUNTIME else self._restarts.get(index, 0) + 1
+                self._restarts[index] = restarts
+                delay = min(MAX_RESTART_DELAY, 2 ** restarts)
+                logger.warning(f"Worker {index} exited with code {process.exitcode}, restarting in {delay} seconds")
+                restart_at[index] = now + delay
+            for index, when in list(restart_at.items()):
+                if now >= when and not self._stopping:
+                    del restart_at[index]
+                    self.start(index)
+        self.shutdown()
+
+    def shutdown(self):
+        """Stop all workers, killing those that do not exit in time."""
+        # SIGINT lets a worker finish its batch and release its leases
+        for process, _ in self._processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGINT)
+        for process, _ in self._processes.values():
+            process.join(30)
+            if process.is_alive():
+                process.kill()
+        logger.info("All workers stopped")
+
+    def _request_stop(self, signum, frame):
+        self._stopping = True
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, help='worker processes, by default one per search profile up to the CPU count')
+    parser.add_argument('--metrics-port', type=int, default=int(os.getenv('METRICS_PORT', '9108')),
+                        help='metrics port of the first worker, the others use the following ports, 0 disables')
+    args = parser.parse_args(argv)
+    Launcher(args.workers or default_workers(), args.metrics_port).run()
+
+
+if __name__ == '__main__':
+    main()
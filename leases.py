@@ -0,0 +1,158 @@
+import os
+import time
+import uuid
+import socket
+import logging
+import asyncio
+
+from database import acquire_lease, release_lease, renew_delivery_leases, renew_listing_claims
+
+logger = logging.getLogger(__name__)
+
+# Unique per process, so a restarted process never inherits stale claims
+INSTANCE_ID = os.getenv('WORKER_ID') or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+# Seconds a lease or claim lasts without a heartbeat, and how long a dead
+# process blocks its profiles and deliveries
+LEASE_TTL = float(os.getenv('LEASE_TTL', '120'))
+# "index/count" of this process among the workers started by launcher.py
+WORKER_SHARD = os.getenv('WORKER_SHARD', '0/1')
+
+
+def parse_shard(value):
+    """
+    Parse a worker shard.
+
+    Args:
+        value (str): Shard as "index/count", e.g. "0/4"
+
+    Returns:
+        tuple: (index, count)
+    """
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ValueError(f"WORKER_SHARD must look like 'index/count', got {value!r}")
+    if not 0 <= index < count:
+        raise ValueError(f"WORKER_SHARD index must be in [0, {count}), got {index}")
+    return index, count
+
+
+def shard_of(name, names, count):
+    """
+    Shard of a search profile.
+
+    Profiles are dealt out round-robin in name order, every process loads
+    the same profiles and arrives at the same split.
+
+    Args:
+        name (str): Profile name
+        names (list): Names of all profiles
+        count (int): Number of shards
+
+    Returns:
+        int: Shard index
+    """
+    return sorted(names).index(name) % count
+
+
+class LeaseKeeper:
+    """
+    Holds the leases of one process in the shared SQLite database.
+
+    Every search profile belongs to one shard. A process leases the
+    profiles of its own shard for as long as it runs, and takes over the
+    profiles of other shards only once LEASE_TTL has passed since its
+    start, leasing them for one cycle at a time. The outbox is leased the
+    same way, so only one process talks to Telegram and the rate limits
+    hold. A heartbeat renews every lease, listing claim and delivery lease
+    of the process every third of LEASE_TTL, a process that dies loses
+    them all once they expire.
+    """
+
+    def __init__(self, owner=INSTANCE_ID, lease_ttl=LEASE_TTL, shard=WORKER_SHARD):
+        self.owner = owner
+        self.lease_ttl = lease_ttl
+        self.shard_index, self.shard_count = parse_shard(shard)
+        self._held = set()
+        self._owned = set()
+        self._started = time.monotonic()
+        self._stop = None
+        self._stopping = False
+
+    def assign(self, profile_names):
+        """
+        Pick the search profiles of this process's shard.
+
+        Args:
+            profile_names (list): Names of all search profiles
+        """
+        self._owned = {
+            name for name in profile_names
+            if shard_of(name, profile_names, self.shard_count) == self.shard_index
+        }
+        logger.info(f"Worker {self.owner} runs shard {self.shard_index}/{self.shard_count}: {sorted(self._owned)}")
+
+    def owns(self, profile_name):
+        """Check whether a search profile belongs to the shard of this process."""
+        return profile_name in self._owned
+
+    def may_take_over(self):
+        """Check whether owners of other shards had time to take their leases."""
+        return time.monotonic() - self._started >= self.lease_ttl
+
+    def acquire(self, name):
+        """
+        Take or renew a lease.
+
+        Args:
+            name (str): Lease name
+
+        Returns:
+            bool: True if this process holds the lease now
+        """
+        if acquire_lease(name, self.owner, self.lease_ttl):
+            self._held.add(name)
+            return True
+        self._held.discard(name)
+        return False
+
+    def release(self, name):
+        """Give up a lease."""
+        self._held.discard(name)
+        release_lease(name, self.owner)
+
+    def heartbeat(self):
+        """Renew all leases and claims of this process once."""
+        for name in list(self._held):
+            if not acquire_lease(name, self.owner, self.lease_ttl):
+                logger.warning(f"Lost lease '{name}' to another process")
+                self._held.discard(name)
+        renew_listing_claims(self.owner, self.lease_ttl)
+        renew_delivery_leases(self.owner, self.lease_ttl)
+
+    async def run(self):
+        """Send heartbeats until stop() is called, then release all leases."""
+        self._stop = asyncio.Event()
+        try:
+            # stop() may come before the task first runs
+            while not self._stopping:
+                try:
+                    await asyncio.wait_for(self._stop.wait(), self.lease_ttl / 3)
+                except asyncio.TimeoutError:
+                    pass
+                try:
+                    self.heartbeat()
+                except Exception as e:
+                    logger.error(f"Error renewing leases: {e}")
+        finally:
+            for name in list(self._held):
+                self.release(name)
+
+    def stop(self):
+        """Stop the heartbeat."""
+        self._stopping = True
+        if self._stop is not None:
+            self._stop.set()
+
+
+lease_keeper = LeaseKeeper()
@@ -0,0 +1,29 @@
+from dataclasses import dataclass
+
+
+@dataclass(slots=True)
+class Listing:
+    """
+    Parsed listing as the parser builds it and the formatter and the
+    outbox read it.
+
+    A slotted record takes about a third of the memory of the dict with
+    the same fields and reads its fields without hashing their names,
+    which adds up on pages of hundreds of listings and on backfills.
+    """
+
+    id: int
+    user_id: int | None
+    district_name: str
+    owner_name: str
+    # As the API sent it
+    price: int | str
+    title: str
+    phone_number: bool
+    url: str
+    is_realtor: bool
+    decided_by: str
+    listings_count: int | None
+    description: str
+    created_time: str
+    last_refresh_time: str
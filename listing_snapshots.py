@@ -0,0 +1,119 @@
+import json
+import hashlib
+import logging
+
+from database import load_listing_snapshots, save_listing_snapshots, update_listing_snapshots
+
+logger = logging.getLogger(__name__)
+
+# Fields of a search result that make up the content of a listing
+CONTENT_FIELDS = ('title', 'params', 'location', 'contact', 'last_refresh_time')
+
+
+def listing_price(listing):
+    """
+    Price of a raw listing.
+
+    Args:
+        listing (dict): Raw listing data from the API
+
+    Returns:
+        Price value or None if the listing has none
+    """
+    for param in listing.get('params') or []:
+        if param.get('key') == 'price':
+            return (param.get('value') or {}).get('value')
+    return None
+
+
+def content_hash(listing):
+    """
+    Hash of the content of a raw listing.
+
+    Args:
+        listing (dict): Raw listing data from the API
+
+    Returns:
+        int: Signed 64-bit hash, fits an SQLite INTEGER
+    """
+    content = json.dumps([listing.get(field) for field in CONTENT_FIELDS], sort_keys=True, ensure_ascii=False)
+    digest = hashlib.blake2b(content.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def take_snapshot(listing, is_realtor=None):
+    """
+    Build the snapshot row of a raw listing.
+
+    Args:
+        listing (dict): Raw listing data from the API
+        is_realtor (bool): Verdict of the listing, None if unknown
+
+    Returns:
+        tuple: (listing_id, content_hash, price, last_refresh_time, is_realtor)
+    """
+    return (
+        listing['id'],
+        content_hash(listing),
+        listing_price(listing),
+        listing.get('last_refresh_time'),
+        None if is_realtor is None else int(bool(is_realtor))
+    )
+
+
+def track_changes(listings, handled_ids):
+    """
+    Compare crawled listings with their snapshots and record what changed.
+
+    Listings with an unchanged snapshot need no further work. Changed ones
+    get a new snapshot and, if their price moved, a price history row.
+    Handled listings without a snapshot yet, e.g. sent before snapshots
+    existed, get one without being reported.
+
+    Args:
+        listings (list): Raw listings found by a cycle
+        handled_ids: Container of the ids of listings known to be sent
+
+    Returns:
+        tuple: (set of ids of listings that have a snapshot,
+                list of price change dicts with 'id', 'title',
+                'district_name', 'url', 'old_price', 'new_price' and
+                'is_realtor')
+    """
+    listings = {listing['id']: listing for listing in listings if listing.get('id')}
+    snapshots = load_listing_snapshots(list(listings))
+
+    changes = []
+    first_snapshots = []
+    for listing_id, listing in listings.items():
+        stored = snapshots.get(listing_id)
+        if stored is None:
+            if listing_id in handled_ids:
+                first_snapshots.append(take_snapshot(listing))
+            continue
+        old_hash, old_price, is_realtor = stored
+        snapshot = take_snapshot(listing, is_realtor)
+        if snapshot[1] != old_hash:
+            changes.append((snapshot, old_hash, old_price))
+
+    save_listing_snapshots(first_snapshots)
+    recorded = update_listing_snapshots(changes)
+    if recorded:
+        logger.info(f"{len(recorded)} sent listings changed since they were last crawled")
+
+    price_changes = []
+    for snapshot, _, old_price in recorded:
+        listing_id, _, price, _, is_realtor = snapshot
+        if price is None or old_price is None or price == old_price:
+            continue
+        listing = listings[listing_id]
+        price_changes.append({
+            'id': listing_id,
+            'title': listing.get('title', ''),
+            'district_name': ((listing.get('location') or {}).get('district') or {}).get('name', 'Unknown'),
+            'url': listing.get('url', ''),
+            'old_price': old_price,
+            'new_price': price,
+            'is_realtor': bool(is_realtor)
+        })
+    return set(snapshots) | {snapshot[0] for snapshot in first_snapshots}, price_changes
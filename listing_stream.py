@@ -0,0 +1,258 @@
+import re
+import json
+import codecs
+
+# Keys leading from the top of a GraphQL search response to its listings
+LISTINGS_PATH = ('data', 'clientCompatibleListings', 'data')
+# Bytes read at a time from responses and files
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class ListingStream:
+    """
+    Incremental decoder of a GraphQL search response.
+
+    Fed the body chunk by chunk as it arrives, it returns every raw
+    listing of `data.clientCompatibleListings.data` as soon as its
+    closing brace is in, so neither the whole body nor the whole decoded
+    response is ever held. Listings are decoded by the C scanner of the
+    json module. The envelope around them is walked key by key and values
+    off the path are skipped. A value cut off by the end of a chunk is
+    tried again once the text after it has doubled, so a large listing
+    split over many chunks is still decoded in linear time.
+
+    A response without the path, e.g. a ListingError or GraphQL errors
+    with null data, has no listings. What follows the listings is not
+    decoded.
+    """
+
+    def __init__(self, path=LISTINGS_PATH):
+        self.path = path
+        self.done = False
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._index = 0
+        # Text that arrived while waiting for the buffer to reach _wanted
+        self._pending = []
+        self._pending_size = 0
+        self._wanted = 0
+        self._state = 'start'
+        self._depth = 0
+        self._key = None
+
+    def feed(self, chunk, final=False):
+        """
+        Decode the next chunk of the body.
+
+        Args:
+            chunk (bytes): Next bytes of the body
+            final (bool): True for the last chunk
+
+        Returns:
+            list: Raw listings completed by this chunk
+
+        Raises:
+            ValueError: The body is not a JSON object or ends too early
+        """
+        if self.done:
+            return []
+        text = self._utf8.decode(chunk, final)
+        if self._pending_size + len(text) < self._wanted and not final:
+            self._pending.append(text)
+            self._pending_size += len(text)
+            return []
+        self._buffer = ''.join([self._buffer[self._index:], *self._pending, text])
+        self._index = 0
+        self._pending = []
+        self._pending_size = 0
+        self._wanted = 0
+        listings = []
+        while not self.done:
+            if self._state == 'listings' and not self._scan_listings(listings, final):
+                self._wanted = len(self._buffer) - self._index
+                break
+            self._index = _WHITESPACE.match(self._buffer, self._index).end()
+            if self._index == len(self._buffer):
+                if final:
+                    raise json.JSONDecodeError("Response ends too early", self._buffer, self._index)
+                break
+            if not self._step(listings, final):
+                self._wanted = len(self._buffer) - self._index
+                break
+        return listings
+
+    def close(self):
+        """
+        Finish decoding after the last chunk.
+
+        Returns:
+            list: Raw listings completed by the end of the body
+        """
+        return self.feed(b'', final=True)
+
+    def _scan_listings(self, listings, final):
+        # Fast path over the listings array. The complete listings in the
+        # buffer are decoded as one array, so they share their key strings
+        # as in json.loads, a listing left over one by one. Returns False
+        # at a listing that may not be complete yet, errors and the end of
+        # the array are left to _step.
+        buffer = self._buffer
+        length = len(buffer)
+        match = _WHITESPACE.match
+        index = match(buffer, self._index).end()
+        if index < length and buffer[index] == ',':
+            index = match(buffer, index + 1).end()
+        cut = _batch_end(buffer, index)
+        if cut:
+            try:
+                listings.extend(self._decoder.decode(f"[{buffer[index:cut]}]"))
+                index = cut
+            except json.JSONDecodeError:
+                pass
+        scan = self._decoder.raw_decode
+        try:
+            while True:
+                index = match(buffer, index).end()
+                if index < length and buffer[index] == ',':
+                    index = match(buffer, index + 1).end()
+                if index >= length or buffer[index] == ']':
+                    return True
+                try:
+                    listing, end = scan(buffer, index)
+                except json.JSONDecodeError:
+                    return final
+                # Numbers and literals only end for sure before a delimiter
+                if end == length and buffer[index] not in '{["' and not final:
+                    return False
+                listings.append(listing)
+                index = end
+        finally:
+            self._index = index
+
+    def _step(self, listings, final):
+        char = self._buffer[self._index]
+        state = self._state
+        if state == 'start':
+            if char != '{':
+                raise json.JSONDecodeError("Response is not a JSON object", self._buffer, self._index)
+            self._index += 1
+            self._state = 'key'
+        elif state == 'key':
+            if char == ',':
+                self._index += 1
+            elif char == '}':
+                # The object on the path ended without the rest of the path
+                self.done = True
+            elif char != '"':
+                raise json.JSONDecodeError("Expecting property name", self._buffer, self._index)
+            else:
+                complete, self._key = self._decode(final)
+                if not complete:
+                    return False
+                self._state = 'colon'
+        elif state == 'colon':
+            if char != ':':
+                raise json.JSONDecodeError("Expecting ':'", self._buffer, self._index)
+            self._index += 1
+            self._state = 'value'
+        elif state == 'value':
+            if self._key != self.path[self._depth]:
+                complete, _ = self._decode(final)
+                if not complete:
+                    return False
+                self._state = 'key'
+            elif self._depth == len(self.path) - 1:
+                if char != '[':
+                    self.done = True
+                else:
+                    self._index += 1
+                    self._state = 'listings'
+            elif char == '{':
+                self._index += 1
+                self._depth += 1
+                self._state = 'key'
+            else:
+                self.done = True
+        elif state == 'listings':
+            if char == ',':
+                self._index += 1
+            elif char == ']':
+                self.done = True
+            else:
+                complete, listing = self._decode(final)
+                if not complete:
+                    return False
+                listings.append(listing)
+        return True
+
+    def _decode(self, final):
+        # (False, None) while the value at the index may not be complete yet
+        try:
+            value, end = self._decoder.raw_decode(self._buffer, self._index)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return False, None
+        # A number or literal running to the end of the text may go on
+        if end == len(self._buffer) and not final and self._buffer[self._index] not in '{["':
+            return False, None
+        self._index = end
+        return True, value
+
+
+def _batch_end(text, start):
+    """
+    End of the last complete array element in text[start:], the position
+    after the last closing brace before which the braces since `start`
+    are balanced. 0 if there is none. A wrong guess, e.g. from braces in
+    strings, only makes decoding the batch fail.
+    """
+    end = len(text)
+    braces = text.count('{', start, end) - text.count('}', start, end)
+    while True:
+        cut = text.rfind('}', start, end)
+        if cut < 0:
+            return 0
+        braces += text.count('}', cut + 1, end) - text.count('{', cut + 1, end)
+        if braces == 0:
+            return cut + 1
+        # Without the closing brace itself
+        braces += 1
+        end = cut
+
+
+def iter_listings(chunks, path=LISTINGS_PATH):
+    """
+    Yield the raw listings of a GraphQL search response read in chunks,
+    e.g. from requests' iter_content() or an archived response file.
+
+    Args:
+        chunks: Iterable of bytes
+        path (tuple): Keys leading to the listings
+
+    Yields:
+        dict: Raw listings in response order
+    """
+    stream = ListingStream(path)
+    # Read to the end even after the listings, so the connection is reused
+    for chunk in chunks:
+        yield from stream.feed(chunk)
+    yield from stream.close()
+
+
+async def aiter_listings(chunks, path=LISTINGS_PATH):
+    """
+    Async counterpart of iter_listings, e.g. for httpx' aiter_bytes().
+
+    Yields:
+        dict: Raw listings in response order
+    """
+    stream = ListingStream(path)
+    async for chunk in chunks:
+        for listing in stream.feed(chunk):
+            yield listing
+    for listing in stream.close():
+        yield listing
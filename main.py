@@ -1,20 +1,53 @@
 import os
 import logging
-import schedule
-import time
-import requests
+import asyncio
 import json
+from datetime import datetime
+from functools import partial
 
+import httpx
 from dotenv import load_dotenv
 
-from parser import process_listings, print_listing_info
+from http_client import close_async_client, deadline_scope, get_async_client, olx_url
+from parser import process_listings, process_listings_async, print_listing_info, create_user_resolver
 from database import (
-    connect_db,
     create_table_if_not_exists,
-    save_listing_to_db,
-    mark_listing_as_sent
+    claim_listings,
+    release_listing_claims,
+    add_listing_targets,
+    enqueue_listings,
+    enqueue_updates,
+    deliver_to_targets,
+    save_listing_snapshots,
+    save_listing_fingerprints,
+    iter_listing_fingerprints,
+    load_repost_chats,
+    touch_listings,
+    load_watermark,
+    save_watermark,
+    iter_sent_listing_ids
 )
-from bot import send_listing_to_chats_sync
+from bot import get_sender
+from chat_settings import drops_realtors, wants_price_drops
+from duplicate_index import duplicate_index, listing_fingerprint, to_signed
+from leases import lease_keeper
+from listing_stream import aiter_listings
+from listing_snapshots import take_snapshot, track_changes
+from message_formatter import (
+    format_digest_entry,
+    format_price_drop_entry,
+    format_price_drop_message,
+    format_telegram_message,
+    is_maybe_realtor
+)
+from metrics import DUPLICATE_LISTINGS, NEW_LISTINGS, dump_cycle, mark_cycle_finished, start_metrics_server, timed
+from outbox import OUTBOX_LEASE, OutboxWorker
+from retention import RETENTION_LEASE, RetentionWorker
+from scheduler import Scheduler
+from search_profiles import load_search_profiles, build_search_parameters, merge_profile_listings
+from seen_index import seen_index
+from subscriptions import subscription_router
+from user_cache import user_cache
 
 # Configure logging
 logging.basicConfig(
@@ -25,117 +58,476 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 CHAT_IDS = [chat_id.strip() for chat_id in os.getenv('TELEGRAM_CHAT_IDS', '').split(',') if chat_id.strip()]
+# 'async' enriches a whole page concurrently, 'sync' enriches listings one by one
+ENRICH_MODE = os.getenv('ENRICH_MODE', 'async')
+# Number of listings requested per page and maximum pages crawled per cycle
+PAGE_SIZE = int(os.getenv('OLX_PAGE_SIZE', '20'))
+MAX_PAGES = int(os.getenv('OLX_MAX_PAGES', '5'))
+# Seconds a one-shot run waits for its messages to be delivered
+DELIVERY_TIMEOUT = float(os.getenv('ONCE_DELIVERY_TIMEOUT', '300'))
+SEARCH_PROFILES = load_search_profiles(CHAT_IDS)
+
+outbox_worker = OutboxWorker(get_sender())
+
+# User resolver shared by the cycles running at the same moment
+_resolver = None
+_resolver_users = 0
+
+LISTINGS_QUERY = """
+query ListingSearchQuery($searchParameters: [SearchParameter!]) {
+    clientCompatibleListings(searchParameters: $searchParameters) {
+        __typename
+        ... on ListingSuccess {
+            data {
+                id
+                location {
+                    district {
+                        name
+                    }
+                }
+                contact {
+                    name
+                    phone
+                }
+                user {
+                    id
+                    uuid
+                }
+                params {
+                    key
+                    value {
+                        ... on PriceParam {
+                            value
+                            currency
+                        }
+                    }
+                }
+                title
+                url
+                created_time
+                last_refresh_time
+            }
+        }
+    }
+}
+"""
 
 
 def process_new_listings():
-    """Process new listings and send notifications."""
+    """Run one fetch cycle over all search profiles and queue notifications."""
     try:
-        listings_data = get_listings_data()
-        
-        listings = process_listings(listings_data)
-        
-        for listing in listings:
-            print_listing_info(listing)
-            
-            sent = save_listing_to_db(listing['id'])
-            if sent == 0:
-                send_listing_to_chats_sync(listing, CHAT_IDS)
-                mark_listing_as_sent(listing['id'])
-                
+        asyncio.run(_run_cycle_once(SEARCH_PROFILES))
     except Exception as e:
         logger.error(f"Error processing listings: {e}")
 
 
-def get_listings_data():
-    """Get listings data from OLX API"""
+async def _run_cycle_once(profiles):
     try:
-        url = "https://www.olx.ua/apigateway/graphql"
+        with deadline_scope():
+            return await run_cycle(profiles)
+    finally:
+        await close_async_client()
+
+
+@timed('cycle')
+async def run_cycle(profiles):
+    """
+    Fetch, enrich and store new listings of some profiles and queue their
+    notifications for the outbox worker.
+    
+    Args:
+        profiles (list): Search profiles to crawl
         
-        query = """
-        query ListingSearchQuery($searchParameters: [SearchParameter!]) {
-            clientCompatibleListings(searchParameters: $searchParameters) {
-                __typename
-                ... on ListingSuccess {
-                    data {
-                        id
-                        location {
-                            district {
-                                name
-                            }
-                        }
-                        contact {
-                            name
-                            phone
-                        }
-                        user {
-                            id
-                            uuid
-                        }
-                        params {
-                            key
-                            value {
-                                ... on PriceParam {
-                                    value
-                                    currency
-                                }
-                            }
-                        }
-                        title
-                        url
-                    }
-                }
-            }
-        }
-        """
+    Returns:
+        dict: Number of new listings per profile name, None if its fetch failed
+    """
+    watermarks = {profile['name']: load_watermark(profile['name']) for profile in profiles}
+    raw_listings, targets, crawl_results, already_seen, page_listings, page_targets = await crawl_profiles(
+        profiles, watermarks
+    )
+    
+    # Realtor verdicts are only known after enrichment, so these filters
+    # apply when messages are queued rather than when chats are routed
+    target_chats = {chat_id for chat_ids in page_targets.values() for chat_id in chat_ids}
+    drop_realtor_chats = {
+        chat_id for chat_id in target_chats
+        if drops_realtors(chat_id) or subscription_router.drops_realtors(chat_id)
+    }
+    drop_maybe_chats = {chat_id for chat_id in target_chats if subscription_router.drops_maybe_realtors(chat_id)}
+    
+    # Listings with a snapshot were handled before, by this or another
+    # process: they are only checked for changes, never enriched again
+    snapshot_ids, price_changes = track_changes(page_listings, seen_index)
+    touch_listings(snapshot_ids)
+    queue_price_drops(price_changes, page_targets, drop_realtor_chats)
+    
+    # Listings at or behind the watermark that no process queued, e.g.
+    # dropped by a failed lookup, are new again while they are crawled
+    raw_ids = {listing['id'] for listing in raw_listings}
+    retried = [
+        listing for listing in page_listings
+        if listing['id'] not in raw_ids and listing['id'] not in snapshot_ids and listing['id'] not in seen_index
+    ]
+    if retried:
+        logger.info(f"Retrying {len(retried)} listings that were not queued before")
+        raw_listings = raw_listings + retried
+        targets.update((listing['id'], page_targets[listing['id']]) for listing in retried)
+    
+    # Recorded before claiming, so whichever process queues a listing,
+    # now or later, also queues it for these chats
+    add_listing_targets([
+        (listing_id, chat_id, chat_id in drop_realtor_chats, chat_id in drop_maybe_chats)
+        for listing_id, chat_ids in targets.items()
+        for chat_id in chat_ids
+    ] + [
+        (listing_id, chat_id, chat_id in drop_realtor_chats, chat_id in drop_maybe_chats)
+        for profile in profiles
+        for listing_id in already_seen[profile['name']]
+        for chat_id in page_targets.get(listing_id, [])
+    ])
+    
+    # Only listings claimed by this process are enriched and queued here
+    claimed_ids = claim_listings(
+        [listing['id'] for listing in raw_listings if listing['id'] not in snapshot_ids],
+        lease_keeper.owner,
+        lease_keeper.lease_ttl
+    )
+    
+    # Listings dropped on the way, e.g. by a failed lookup, are not kept
+    # from other processes by the heartbeat and are retried next cycle
+    queued_ids = set()
+    try:
+        # A listing found by several profiles is enriched and stored once
+        listings = await enrich_listings(_as_response([listing for listing in raw_listings if listing['id'] in claimed_ids]))
+        logger.info(f"User cache stats: {user_cache.stats()}")
         
-        variables = {
-            "searchParameters": [
-                {"key": "offset", "value": "0"},
-                {"key": "limit", "value": "20"},
-                {"key": "query", "value": "оренда 2 кімнатна"},
-                {"key": "category_id", "value": "1760"},
-                {"key": "region_id", "value": "5"},
-                {"key": "city_id", "value": "176"},
-                {"key": "currency", "value": "UAH"},
-                {"key": "sort_by", "value": "created_at:desc"},
-                {"key": "filter_enum_number_of_rooms_string[0]", "value": "dvuhkomnatnye"},
-                {"key": "filter_float_price:to", "value": "10000"}
+        # Reposts only go to chats that did not get the original
+        originals = find_reposts(listings)
+        repost_chats = load_repost_chats(set(originals.values()))
+        
+        deliveries = []
+        skipped_ids = []
+        for listing in listings:
+            print_listing_info(listing)
+            
+            maybe_realtor = is_maybe_realtor(listing)
+            chat_ids = [
+                chat_id for chat_id in targets[listing.id]
+                if not (listing.is_realtor and chat_id in drop_realtor_chats)
+                and not (maybe_realtor and chat_id in drop_maybe_chats)
             ]
-        }
+            original_id = originals.get(listing.id, listing.id)
+            if original_id != listing.id:
+                got_original = repost_chats.get(original_id, set())
+                chat_ids = [chat_id for chat_id in chat_ids if str(chat_id) not in got_original]
+                DUPLICATE_LISTINGS.labels('sent' if chat_ids else 'suppressed').inc()
+                logger.info(f"Listing {listing.id} is a repost of {original_id}, new for {len(chat_ids)} chats")
+            repost_chats.setdefault(original_id, set()).update(str(chat_id) for chat_id in chat_ids)
+            if not chat_ids:
+                skipped_ids.append(listing.id)
+                continue
+            message = format_telegram_message(listing)
+            digest_entry = format_digest_entry(listing)
+            deliveries.extend(
+                (listing.id, chat_id, message, digest_entry, listing.is_realtor, maybe_realtor)
+                for chat_id in chat_ids
+            )
         
-        # Request body
-        body = {
-            "query": query,
-            "variables": variables
-        }
+        # Delivery happens in the outbox worker, the cycle only queues messages
+        queued_ids = enqueue_listings(deliveries, skipped_ids, owner=lease_keeper.owner)
+    finally:
+        release_listing_claims(claimed_ids - queued_ids, lease_keeper.owner)
+    
+    raw_by_id = {listing['id']: listing for listing in raw_listings}
+    save_listing_snapshots([
+        take_snapshot(raw_by_id[listing.id], listing.is_realtor)
+        for listing in listings
+        if listing.id in queued_ids
+    ])
+    # Listings queued by another profile or process still go to these chats
+    deliver_to_targets(
+        [listing['id'] for listing in raw_listings if listing['id'] not in claimed_ids]
+        + [listing_id for profile in profiles for listing_id in already_seen[profile['name']]]
+    )
+    seen_index.add_many(queued_ids | (snapshot_ids & set(raw_by_id)))
+    outbox_worker.update_depth()
+    outbox_worker.wake()
+    
+    counts = {}
+    for profile in profiles:
+        name = profile['name']
+        new_count, watermark = crawl_results[name]
+        if watermark:
+            save_watermark(name, *watermark)
+        counts[name] = new_count
+        if new_count is not None:
+            NEW_LISTINGS.labels(name).inc(new_count)
+            mark_cycle_finished(name)
+    dump_cycle({'new_listings': counts, 'enriched': len(listings), 'queued_messages': len(deliveries)})
+    return counts
+
+
+def find_reposts(listings):
+    """
+    Look up enriched listings in the duplicate index and store their
+    fingerprints, linking reposts to their original listing.
+    
+    Args:
+        listings (list): Parsed listings claimed by this cycle
         
-        # Headers
-        headers = {
-            "Content-Type": "application/json",
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        }
+    Returns:
+        dict: Listing id of each repost to the id of its original
+    """
+    duplicate_index.sync(iter_listing_fingerprints(duplicate_index.synced_at))
+    originals = {}
+    fingerprints = []
+    for listing in listings:
+        fingerprint = listing_fingerprint(listing)
+        original_id = duplicate_index.find(fingerprint)
+        # A relisting under the same id is not a repost
+        if original_id == listing.id:
+            continue
+        if original_id is not None:
+            originals[listing.id] = original_id
+        duplicate_index.add(listing.id, fingerprint, original_id)
+        fingerprints.append((listing.id, to_signed(fingerprint), original_id))
+    # Stored before queueing, so copies to listing_targets skip chats that got the original
+    save_listing_fingerprints(fingerprints)
+    return originals
+
+
+def queue_price_drops(price_changes, targets, drop_realtor_chats):
+    """
+    Queue price drop notifications for the chats that asked for them.
+    
+    Args:
+        price_changes (list): Price changes found by track_changes
+        targets (dict): Listing id to the chat ids of the profiles that found it
+        drop_realtor_chats (set): Chats that get no realtor listings
         
-        # print("\n=== API Request ===")
-        # print(f"URL: {url}")
-        # print(f"Body: {json.dumps(body, indent=2, ensure_ascii=False)}")
+    Returns:
+        int: Number of notifications queued
+    """
+    deliveries = []
+    for change in price_changes:
+        if change['new_price'] >= change['old_price']:
+            continue
+        message = format_price_drop_message(change)
+        digest_entry = format_price_drop_entry(change)
+        deliveries.extend(
+            (change['id'], chat_id, f"price:{change['new_price']}", message, digest_entry, change['is_realtor'])
+            for chat_id in targets.get(change['id'], [])
+            if wants_price_drops(chat_id) and not (change['is_realtor'] and chat_id in drop_realtor_chats)
+        )
+    queued = enqueue_updates(deliveries)
+    if queued:
+        logger.info(f"Queued {queued} price drop notifications")
+    return queued
+
+
+async def run_profile_cycle(profile):
+    """
+    Run one fetch cycle of a single profile for the scheduler.
+    
+    The cycle runs only while this process holds the lease of the profile.
+    Profiles of other shards are leased for a single cycle, so their own
+    worker gets them back once it is up again.
+    
+    Returns:
+        int: Number of new listings found, None if another process holds
+            the profile
+    """
+    name = profile['name']
+    lease = f"profile:{name}"
+    owned = lease_keeper.owns(name)
+    if not owned and not lease_keeper.may_take_over():
+        return None
+    if not lease_keeper.acquire(lease):
+        return None
+    try:
+        # OLX requests of the cycle share one time budget
+        with deadline_scope():
+            new_count = (await run_cycle([profile]))[name]
+    finally:
+        if not owned:
+            lease_keeper.release(lease)
+    if new_count is None:
+        raise RuntimeError(f"Fetching listings for profile '{name}' failed")
+    return new_count
+
+
+@timed('enrich')
+async def enrich_listings(listings_data):
+    """
+    Parse and enrich raw listings using the configured enrichment mode.
+    
+    Args:
+        listings_data (dict): Raw API response data
         
-        response = requests.post(url, json=body, headers=headers)
+    Returns:
+        list: Parsed Listing records
+    """
+    if not listings_data:
+        return []
+    if ENRICH_MODE == 'sync':
+        return await asyncio.to_thread(process_listings, listings_data)
+    
+    # Profiles polled at the same time share in-flight user lookups
+    global _resolver, _resolver_users
+    if _resolver is None:
+        _resolver = create_user_resolver()
+    _resolver_users += 1
+    try:
+        return await process_listings_async(listings_data, resolver=_resolver)
+    finally:
+        _resolver_users -= 1
+        if _resolver_users == 0:
+            _resolver = None
+
+
+def _parse_time(value):
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def _is_past_watermark(listing, watermark):
+    last_listing_id, last_created_time = watermark
+    if listing.get('id') == last_listing_id:
+        return True
+    created = _parse_time(listing.get('created_time'))
+    last_created = _parse_time(last_created_time)
+    return created is not None and last_created is not None and created < last_created
+
+
+def _as_response(listings):
+    return {"data": {"clientCompatibleListings": {"data": listings}}}
+
+
+async def crawl_profiles(profiles, watermarks):
+    """
+    Crawl search profiles concurrently on the shared HTTP client.
+    
+    Args:
+        profiles (list): Search profiles
+        watermarks (dict): Stored watermark of each profile by name
         
-        # print("\n=== API Response ===")
-        # print(f"Status Code: {response.status_code}")
-        # print(f"Headers: {response.headers}")
-        # print("\nResponse Body:")
-        # print(response.text)
+    Returns:
+        tuple: (unique new raw listings,
+                dict of listing id to target chat ids,
+                dict of profile name to (new listings count or None, new watermark),
+                dict of profile name to ids it found that were already handled,
+                unique raw listings on all crawled pages, new or not,
+                dict of their ids to target chat ids)
+    """
+    client = get_async_client()
+    results = await asyncio.gather(
+        *(crawl_new_listings(client, profile, watermarks.get(profile['name'])) for profile in profiles)
+    )
+    
+    # Chats get the listings of their profiles that their subscriptions admit
+    subscription_router.refresh()
+    route = subscription_router.route
+    listings, targets = merge_profile_listings(profiles, [listings or [] for listings, _, _, _ in results], route)
+    page_listings, page_targets = merge_profile_listings(
+        profiles, [(listings or []) + known for listings, _, _, known in results], route
+    )
+    crawl_results = {}
+    already_seen = {}
+    for profile, (profile_listings, seen_ids, watermark, _) in zip(profiles, results):
+        crawl_results[profile['name']] = (None if profile_listings is None else len(profile_listings), watermark)
+        already_seen[profile['name']] = seen_ids
+    return listings, targets, crawl_results, already_seen, page_listings, page_targets
+
+
+async def crawl_new_listings(client, profile, watermark):
+    """
+    Fetch listings created since the last crawl of a profile.
+    
+    Pages through the newest-first results until a page reaches the stored
+    watermark, a short page is returned or the page budget is spent. On the
+    first crawl only one page is fetched. Listings already in the seen index
+    are dropped before they reach parsing or enrichment.
+    
+    Args:
+        client (httpx.AsyncClient): Shared HTTP client
+        profile (dict): Search profile
+        watermark (tuple): Stored (listing_id, created_time) or None
         
-        data = response.json()
+    Returns:
+        tuple: (new raw listings or None on error,
+                ids newer than the watermark that are already in the seen index,
+                new watermark as (listing_id, created_time) or None,
+                raw listings on the crawled pages that were not new)
+    """
+    new_listings = []
+    seen_ids = []
+    known_listings = []
+    newest = None
+    
+    for page in range(MAX_PAGES):
+        listings = await fetch_listings_page(client, profile, offset=page * PAGE_SIZE, limit=PAGE_SIZE)
+        if listings is None:
+            if page == 0:
+                return None, [], None, []
+            break
         
-        if not isinstance(data, dict):
-            print("Error: Response is not a dictionary")
-            return None
+        seen = []
+        for listing in listings:
+            created = _parse_time(listing.get('created_time'))
+            if created is not None and (newest is None or created > newest[0]):
+                newest = (created, listing.get('id'), listing.get('created_time'))
             
-        return data
+            past_watermark = bool(watermark and _is_past_watermark(listing, watermark))
+            in_index = listing.get('id') in seen_index
+            seen.append(past_watermark or in_index)
+            if in_index and not past_watermark:
+                seen_ids.append(listing.get('id'))
+            elif not past_watermark:
+                new_listings.append(listing)
+            if past_watermark or in_index:
+                known_listings.append(listing)
         
-    except requests.exceptions.RequestException as e:
+        # Promoted listings may be old and show up first, so only the last
+        # listing of a page tells whether older pages can hold new ones
+        reached_watermark = bool(seen) and seen[-1]
+        if watermark is None or reached_watermark or len(listings) < PAGE_SIZE:
+            break
+    
+    logger.info(f"Crawled {len(new_listings)} new listings for profile '{profile['name']}'")
+    new_watermark = None
+    if newest:
+        last_created = _parse_time(watermark[1]) if watermark else None
+        if last_created is None or newest[0] > last_created:
+            new_watermark = (newest[1], newest[2])
+    return new_listings, seen_ids, new_watermark, known_listings
+
+
+def _build_request_body(profile, offset, limit):
+    return {
+        "query": LISTINGS_QUERY,
+        "variables": {"searchParameters": build_search_parameters(profile, offset, limit)}
+    }
+
+
+@timed('fetch')
+async def fetch_listings_page(client, profile, offset=0, limit=PAGE_SIZE):
+    """
+    Get one page of a profile's listings from OLX API.
+    
+    The response is decoded listing by listing while it arrives, the
+    whole body is never held.
+    
+    Returns:
+        list: Raw listings of the page, None on error
+    """
+    try:
+        body = _build_request_body(profile, offset, limit)
+        async with client.stream("POST", olx_url("/apigateway/graphql"), json=body) as response:
+            return [listing async for listing in aiter_listings(response.aiter_bytes())]
+        
+    except httpx.HTTPError as e:
         print(f"Network error: {e}")
         return None
     except json.JSONDecodeError as e:
@@ -146,26 +538,91 @@ def get_listings_data():
         return None
 
 
-def main():
-    """Main function to run the bot."""
+async def run_bot():
+    """Run the outbox worker and the per-profile polling loops."""
+    logger.info("Initializing database...")
+    create_table_if_not_exists()
+    seen_index.load(iter_sent_listing_ids())
+    duplicate_index.load(iter_listing_fingerprints())
+    logger.info("Database initialized successfully")
+    
+    metrics_server = start_metrics_server()
+    heartbeat = asyncio.create_task(lease_keeper.run())
+    worker = asyncio.create_task(outbox_worker.run())
+    retention_worker = RetentionWorker()
+    retention = asyncio.create_task(retention_worker.run())
+    
+    lease_keeper.assign([profile['name'] for profile in SEARCH_PROFILES])
+    scheduler = Scheduler()
+    for profile in SEARCH_PROFILES:
+        scheduler.add(profile['name'], partial(run_profile_cycle, profile))
+    logger.info(f"Scheduler started for {len(SEARCH_PROFILES)} search profiles")
+    
     try:
-        logger.info("Initializing database...")
-        create_table_if_not_exists()
-        logger.info("Database initialized successfully")
-        
-        schedule.every(5).minutes.do(process_new_listings)
-        logger.info("Scheduler started. Running every 5 minutes...")
+        await scheduler.run()
+    finally:
+        retention_worker.stop()
+        outbox_worker.stop()
+        await worker
+        await retention
+        lease_keeper.stop()
+        await heartbeat
+        await close_async_client()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+
+
+async def run_once(sender=None, delivery_timeout=DELIVERY_TIMEOUT, retention=True):
+    """
+    Run one fetch cycle over all search profiles, deliver the messages it
+    queued and return, for cron jobs and containers started per run.
+
+    Profiles and the outbox held by a running bot are left to it.
+
+    Args:
+        sender: Sender of the messages, the shared Telegram sender if None
+        delivery_timeout (float): Seconds to wait for the outbox to drain
+        retention (bool): Also apply the retention policy
+
+    Returns:
+        bool: True if every profile was fetched and no delivery is left
+    """
+    create_table_if_not_exists()
+    seen_index.load(iter_sent_listing_ids())
+    duplicate_index.load(iter_listing_fingerprints())
+    heartbeat = asyncio.create_task(lease_keeper.run())
+    try:
+        profiles = [profile for profile in SEARCH_PROFILES if lease_keeper.acquire(f"profile:{profile['name']}")]
+        if len(profiles) < len(SEARCH_PROFILES):
+            logger.info(f"{len(SEARCH_PROFILES) - len(profiles)} search profiles are run by another process")
+        counts = await _run_cycle_once(profiles) if profiles else {}
+        success = all(count is not None for count in counts.values())
         
-        logger.info("Running initial check...")
-        process_new_listings()
+        if lease_keeper.acquire(OUTBOX_LEASE):
+            left = await OutboxWorker(sender or get_sender()).drain(delivery_timeout)
+            if left:
+                logger.warning(f"{left} deliveries are left for the next run")
+                success = False
+        else:
+            logger.info("Outbox is drained by another process")
         
-        while True:
-            schedule.run_pending()
-            time.sleep(1)
-            
+        if retention and lease_keeper.acquire(RETENTION_LEASE):
+            await RetentionWorker().run_once()
+        return success
+    finally:
+        lease_keeper.stop()
+        await heartbeat
+
+
+def main():
+    """Main function to run the bot."""
+    try:
+        asyncio.run(run_bot())
+    except KeyboardInterrupt:
+        logger.info("Stopped")
     except Exception as e:
         logger.error(f"Fatal error: {e}")
         raise
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
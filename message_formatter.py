@@ -1,9 +1,62 @@
+# Telegram limit of a message text, counted in UTF-16 code units
+MESSAGE_LIMIT = 4096
+
+DIGEST_SEPARATOR = "\n\n"
+
+# Private owners with this many real estate listings may still be realtors
+MAYBE_REALTOR_LISTINGS = 5
+
+
+def telegram_length(text):
+    """
+    Length of a text as Telegram counts it for the message limit.
+    
+    Args:
+        text (str): Message text
+        
+    Returns:
+        int: Number of UTF-16 code units
+    """
+    return len(text.encode('utf-16-le')) // 2
+
+
+def is_maybe_realtor(listing_data):
+    """
+    Check whether a listing not flagged as realtor may still be one.
+    
+    Args:
+        listing_data (Listing): Parsed listing data
+        
+    Returns:
+        bool: True for the "maybe realtor" status
+    """
+    return not listing_data.is_realtor and (listing_data.listings_count or 0) >= MAYBE_REALTOR_LISTINGS
+
+
+def realtor_status(listing_data):
+    """
+    Realtor status line of a listing.
+    
+    Args:
+        listing_data (Listing): Parsed listing data
+        
+    Returns:
+        str: Status with its colour marker
+    """
+    if listing_data.is_realtor:
+        return "🔴 Рієлтор"
+    elif is_maybe_realtor(listing_data):
+        return f"🟡 МОЖЛИВО НЕ РІЄЛТОР ({MAYBE_REALTOR_LISTINGS}+ оголошень)"
+    else:
+        return "🟢 МОЖЛИВО Без рієлтора"
+
+
 def format_telegram_message(listing_data):
     """
     Format listing data for Telegram message.
     
     Args:
-        listing_data (dict): Parsed listing data
+        listing_data (Listing): Parsed listing data
         
     Returns:
         str: Formatted message string
@@ -11,22 +64,137 @@ def format_telegram_message(listing_data):
     if not listing_data:
         return "Invalid listing data"
         
-    if listing_data['is_realtor']:
-        realtor_status = "🔴 Рієлтор"
-    elif listing_data['listings_count'] >= 5:
-        realtor_status = "🟡 МОЖЛИВО НЕ РІЄЛТОР (5+ оголошень)"
-    else:
-        realtor_status = "🟢 МОЖЛИВО Без рієлтора"
+    # Not looked up when cheaper checks already decided the listing
+    listings_count = listing_data.listings_count
+    if listings_count is None:
+        listings_count = "не перевірялась"
     
     return (
         f"🏠 ВСТВАВАЙ НОВА ХАТА\n\n"
-        f"{realtor_status}\n"
-        f"📌 {listing_data['title']}\n"
-        f"💰 Ціна: {listing_data['price']} UAH\n"
-        f"👤 Власник: {listing_data['owner_name']}\n"
-        f"📱 Телефон: {'Доступний' if listing_data['phone_number'] else 'Не доступний'}\n"
-        f"📊 Кількість оголошень: {listing_data['listings_count']}\n"
-        f"📅 Дата створення: {listing_data['created_time']}\n"
-        f"🔄 Дата останнього оновлення: {listing_data['last_refresh_time']}\n"
-        f"🔗 URL: {listing_data['url']}"
-    ) 
\ No newline at end of file
+        f"{realtor_status(listing_data)}\n"
+        f"📌 {listing_data.title}\n"
+        f"💰 Ціна: {listing_data.price} UAH\n"
+        f"👤 Власник: {listing_data.owner_name}\n"
+        f"📱 Телефон: {'Доступний' if listing_data.phone_number else 'Не доступний'}\n"
+        f"📊 Кількість оголошень: {listings_count}\n"
+        f"📅 Дата створення: {listing_data.created_time}\n"
+        f"🔄 Дата останнього оновлення: {listing_data.last_refresh_time}\n"
+        f"🔗 URL: {listing_data.url}"
+    )
+
+
+def format_digest_entry(listing_data):
+    """
+    Format a listing as a short entry of a digest message.
+    
+    Args:
+        listing_data (Listing): Parsed listing data
+        
+    Returns:
+        str: Entry text
+    """
+    marker = realtor_status(listing_data).split(" ", 1)[0]
+    return (
+        f"{marker} {listing_data.title}\n"
+        f"💰 {listing_data.price} UAH · 📍 {listing_data.district_name}\n"
+        f"🔗 {listing_data.url}"
+    )
+
+
+def format_price_drop_message(change):
+    """
+    Format a notification about a sent listing that got cheaper.
+    
+    Args:
+        change (dict): Price change with 'title', 'district_name', 'url',
+            'old_price' and 'new_price'
+        
+    Returns:
+        str: Formatted message string
+    """
+    return (
+        f"📉 ЦІНА ВПАЛА\n\n"
+        f"📌 {change['title']}\n"
+        f"💰 Ціна: {change['old_price']} → {change['new_price']} UAH\n"
+        f"📍 Район: {change['district_name']}\n"
+        f"🔗 URL: {change['url']}"
+    )
+
+
+def format_price_drop_entry(change):
+    """
+    Format a price drop as a short entry of a digest message.
+    
+    Args:
+        change (dict): Price change as in format_price_drop_message
+        
+    Returns:
+        str: Entry text
+    """
+    return (
+        f"📉 {change['title']}\n"
+        f"💰 {change['old_price']} → {change['new_price']} UAH · 📍 {change['district_name']}\n"
+        f"🔗 {change['url']}"
+    )
+
+
+def _digest_header(count, part, parts):
+    header = f"🏠 ВСТВАВАЙ НОВІ ХАТИ: {count}"
+    if parts > 1:
+        header += f" ({part}/{parts})"
+    return header
+
+
+def _truncate(text, limit):
+    if telegram_length(text) <= limit:
+        return text
+    # Cut by code points until it fits, then mark the cut
+    while telegram_length(text) > limit - 1:
+        text = text[:-max(1, (telegram_length(text) - limit + 1) // 2)]
+    return text + "…"
+
+
+def format_digest_messages(entries, limit=MESSAGE_LIMIT):
+    """
+    Pack digest entries into as few messages as the Telegram limit allows.
+    
+    Entries keep their order and are never split between messages. An entry
+    too long for a message on its own is truncated.
+    
+    Args:
+        entries (list): Entry texts in delivery order
+        limit (int): Maximum message length in UTF-16 code units
+        
+    Returns:
+        list: (message text, indexes of the entries it holds) tuples
+    """
+    if not entries:
+        return []
+    
+    # Room for the longest header any part can get
+    budget = limit - telegram_length(_digest_header(len(entries), len(entries), len(entries))) - len(DIGEST_SEPARATOR)
+    separator_length = len(DIGEST_SEPARATOR)
+    
+    chunks = []
+    current = []
+    used = 0
+    for index, entry in enumerate(entries):
+        entry = _truncate(entry, budget)
+        length = telegram_length(entry)
+        needed = length if not current else used + separator_length + length
+        if current and needed > budget:
+            chunks.append(current)
+            current = []
+            needed = length
+        current.append((index, entry))
+        used = needed
+    chunks.append(current)
+    
+    return [
+        (
+            _digest_header(len(entries), part, len(chunks)) + DIGEST_SEPARATOR
+            + DIGEST_SEPARATOR.join(entry for _, entry in chunk),
+            [index for index, _ in chunk]
+        )
+        for part, chunk in enumerate(chunks, 1)
+    ]
@@ -0,0 +1,444 @@
+import os
+import json
+import math
+import time
+import logging
+import asyncio
+import threading
+from functools import wraps
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger(__name__)
+
+# Local address of the /metrics endpoint, port 0 disables it
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+# JSON lines file receiving a metrics snapshot after every cycle, off if empty
+METRICS_DUMP_FILE = os.getenv('METRICS_DUMP_FILE', '')
+
+PREFIX = 'rieltor_zlo_'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_metrics = []
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = (f'{name}="{_escape(value)}"' for name, value in labels.items())
+    return '{' + ','.join(pairs) + '}'
+
+
+class _Metric:
+    """Base of all metrics: a family of children, one per label combination."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def labels(self, *values):
+        """
+        Get the child for a label combination, creating it on first use.
+
+        Args:
+            *values: Label values in the order of labelnames
+
+        Returns:
+            Child metric
+        """
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def samples(self):
+        """
+        Yield the current samples of every child.
+
+        Returns:
+            iterator: (sample name suffix, labels dict, value) tuples
+        """
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in children:
+            labels = dict(zip(self.labelnames, key))
+            yield from child.samples(labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+    def _new_child(self):
+        raise NotImplementedError
+
+
+class _CounterChild:
+    def __init__(self, lock):
+        self._lock = lock
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        """Increase the counter by a non-negative amount."""
+        with self._lock:
+            self.value += amount
+
+    def samples(self, labels):
+        yield '', labels, self.value
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, name it with a _total suffix."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1):
+        """Increase the unlabelled counter."""
+        self.labels().inc(amount)
+
+    def _new_child(self):
+        return _CounterChild(self._lock)
+
+
+class _GaugeChild:
+    def __init__(self, lock):
+        self._lock = lock
+        self.value = 0.0
+        self._function = None
+
+    def set(self, value):
+        """Set the gauge to a value."""
+        with self._lock:
+            self.value = value
+
+    def set_function(self, function):
+        """Read the value from a callable at collection time instead."""
+        self._function = function
+
+    def samples(self, labels):
+        if self._function is None:
+            yield '', labels, self.value
+            return
+        try:
+            yield '', labels, self._function()
+        except Exception as e:
+            logger.error(f"Error collecting gauge: {e}")
+
+
+class Gauge(_Metric):
+    """Value that can go up and down."""
+
+    kind = 'gauge'
+
+    def set(self, value):
+        """Set the unlabelled gauge."""
+        self.labels().set(value)
+
+    def set_function(self, function):
+        """Collect the unlabelled gauge from a callable."""
+        self.labels().set_function(function)
+
+    def _new_child(self):
+        return _GaugeChild(self._lock)
+
+
+class _HistogramChild:
+    def __init__(self, lock, buckets):
+        self._lock = lock
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Record one observation."""
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def time(self):
+        """Context manager observing the seconds spent in its block."""
+        return _Timer(self)
+
+    def samples(self, labels):
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            yield '_bucket', dict(labels, le=_format_value(bound)), cumulative
+        yield '_bucket', dict(labels, le='+Inf'), count
+        yield '_sum', labels, total
+        yield '_count', labels, count
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value):
+        """Record one observation of the unlabelled histogram."""
+        self.labels().observe(value)
+
+    def time(self):
+        """Time a block with the unlabelled histogram."""
+        return self.labels().time()
+
+    def _new_child(self):
+        return _HistogramChild(self._lock, self.buckets)
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self._histogram = histogram
+        self._started = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self._histogram.observe(time.perf_counter() - self._started)
+        return False
+
+
+STAGE_SECONDS = Histogram(
+    'stage_duration_seconds',
+    'Time spent in a stage of the fetch cycle',
+    ['stage']
+)
+OLX_REQUESTS = Counter(
+    'olx_requests_total',
+    'Requests to the OLX API by endpoint and HTTP status, "error" if no response arrived, '
+    '"cancelled" if abandoned, "circuit_open" or "deadline" if refused without sending',
+    ['endpoint', 'status']
+)
+OLX_CIRCUIT_OPEN = Gauge(
+    'olx_circuit_open',
+    '1 while the circuit breaker of an OLX endpoint refuses requests',
+    ['endpoint']
+)
+OLX_HEDGED_REQUESTS = Counter(
+    'olx_hedged_requests_total',
+    'Slow OLX lookups sent twice, by endpoint and which request answered first',
+    ['endpoint', 'winner']
+)
+USER_CACHE_LOOKUPS = Counter(
+    'user_cache_lookups_total',
+    'User cache lookups by cached field and result',
+    ['field', 'result']
+)
+CLASSIFICATIONS = Counter(
+    'classifications_total',
+    'Classified listings by deciding tier and verdict',
+    ['tier', 'verdict']
+)
+TELEGRAM_MESSAGES = Counter(
+    'telegram_messages_total',
+    'Telegram send attempts by outcome',
+    ['result']
+)
+TELEGRAM_RETRIES = Counter(
+    'telegram_retries_total',
+    'Telegram sends repeated after an error, by reason',
+    ['reason']
+)
+TELEGRAM_RETRY_AFTER_SECONDS = Counter(
+    'telegram_retry_after_seconds_total',
+    'Seconds all sends were paused on RetryAfter responses from Telegram'
+)
+OUTBOX_DELIVERIES = Counter(
+    'outbox_deliveries_total',
+    'Outbox delivery outcomes: sent, retry scheduled or failed for good',
+    ['result']
+)
+OUTBOX_DEPTH = Gauge(
+    'outbox_depth',
+    'Deliveries waiting in the outbox'
+)
+NEW_LISTINGS = Counter(
+    'new_listings_total',
+    'New listings found by search profile',
+    ['profile']
+)
+DUPLICATE_LISTINGS = Counter(
+    'duplicate_listings_total',
+    'New listings recognised as reposts of an earlier listing, by whether some chats still got them',
+    ['result']
+)
+RETENTION_DELETED = Counter(
+    'retention_deleted_rows_total',
+    'Rows removed by the retention policy, by table',
+    ['table']
+)
+DATABASE_SIZE = Gauge(
+    'database_size_bytes',
+    'Size of the SQLite database file without the write-ahead log'
+)
+CYCLE_LAG = Gauge(
+    'cycle_lag_seconds',
+    'Seconds since the last successful cycle of a search profile',
+    ['profile']
+)
+
+
+def timed(stage):
+    """
+    Decorator observing the run time of a function in STAGE_SECONDS.
+
+    Works for plain and async functions.
+
+    Args:
+        stage (str): Stage label
+    """
+    histogram = STAGE_SECONDS.labels(stage)
+
+    def decorator(function):
+        if asyncio.iscoroutinefunction(function):
+            @wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with histogram.time():
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with histogram.time():
+                return function(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def mark_cycle_finished(profile_name):
+    """Restart the cycle lag gauge of a profile."""
+    finished_at = time.time()
+    CYCLE_LAG.labels(profile_name).set_function(lambda: time.time() - finished_at)
+
+
+def render():
+    """
+    Render all metrics in the Prometheus text exposition format.
+
+    Returns:
+        str: Exposition text
+    """
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def snapshot():
+    """
+    Collect all metrics into a JSON serializable dict.
+
+    Returns:
+        dict: Metric name to a list of {'labels', 'value'} samples, histograms
+            keyed by sample name (_bucket, _sum, _count)
+    """
+    result = {}
+    for metric in _metrics:
+        samples = [
+            {'sample': metric.name + suffix, 'labels': labels, 'value': value}
+            for suffix, labels, value in metric.samples()
+        ]
+        if samples:
+            result[metric.name] = samples
+    return result
+
+
+def dump_cycle(cycle_info, path=METRICS_DUMP_FILE):
+    """
+    Append a metrics snapshot to the JSON lines dump file, if configured.
+
+    Args:
+        cycle_info (dict): Details of the finished cycle stored alongside
+        path (str): Dump file, nothing is written if empty
+    """
+    if not path:
+        return
+    record = {'time': time.time(), 'cycle': cycle_info, 'metrics': snapshot()}
+    try:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    except OSError as e:
+        logger.error(f"Error writing metrics dump to {path}: {e}")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = render().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path == '/metrics.json':
+            body = json.dumps(snapshot(), ensure_ascii=False).encode('utf-8')
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """
+    Serve /metrics and /metrics.json from a daemon thread.
+
+    Args:
+        host (str): Address to listen on
+        port (int): Port to listen on, the server is not started if 0
+
+    Returns:
+        ThreadingHTTPServer: Running server, None if disabled or the port is taken
+    """
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.error(f"Metrics endpoint not started on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
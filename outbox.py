@@ -0,0 +1,186 @@
+import os
+import time
+import logging
+import asyncio
+
+from chat_settings import uses_digest
+from database import claim_due_deliveries, complete_deliveries, release_inflight_deliveries, outbox_depth
+from leases import lease_keeper
+from message_formatter import format_digest_messages
+from metrics import OUTBOX_DELIVERIES, OUTBOX_DEPTH
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '50'))
+POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '2'))
+MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))
+RETRY_BASE_DELAY = float(os.getenv('OUTBOX_RETRY_DELAY', '5'))
+RETRY_MAX_DELAY = float(os.getenv('OUTBOX_RETRY_MAX_DELAY', '900'))
+OUTBOX_LEASE = 'outbox'
+
+
+def retry_delay(attempts):
+    """
+    Delay before the next delivery attempt.
+
+    Args:
+        attempts (int): Attempts made so far, including the failed one
+
+    Returns:
+        float: Seconds to wait
+    """
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempts - 1))
+
+
+class OutboxWorker:
+    """
+    Drains the SQLite outbox through the Telegram sender.
+
+    Deliveries are claimed in batches and sent concurrently. Each outcome
+    is committed as soon as Telegram answers, so a restart resends nothing
+    that was recorded as sent. Failed deliveries are retried with
+    exponential backoff until MAX_ATTEMPTS is reached.
+
+    With several processes on one database only the holder of the outbox
+    lease drains it. Claimed deliveries are leased to the process, a
+    process that dies mid-batch leaves them to the next one once the
+    lease expires.
+    """
+
+    def __init__(self, sender, batch_size=BATCH_SIZE, poll_interval=POLL_INTERVAL, max_attempts=MAX_ATTEMPTS,
+                 leases=lease_keeper):
+        self.sender = sender
+        self.leases = leases
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._wake = None
+        self._loop = None
+        self._stopping = False
+
+    async def drain_once(self):
+        """
+        Send one batch of due deliveries.
+
+        Chats in digest mode get all their due deliveries at once, packed
+        into as few messages as possible, realtor listings last. So a batch
+        holds more than batch_size deliveries when digests reach past it.
+
+        Returns:
+            int: Number of deliveries attempted
+        """
+        deliveries = claim_due_deliveries(self.batch_size, self.leases.owner, self.leases.lease_ttl, uses_digest)
+        singles = []
+        digests = {}
+        for delivery in deliveries:
+            if uses_digest(delivery[1]):
+                digests.setdefault(delivery[1], []).append(delivery)
+            else:
+                singles.append(delivery)
+        if deliveries:
+            await asyncio.gather(
+                *(self._deliver([delivery], delivery[2]) for delivery in singles),
+                *(self._deliver_digest(chat_deliveries) for chat_deliveries in digests.values())
+            )
+            self.update_depth()
+        return len(deliveries)
+
+    def update_depth(self):
+        """
+        Count the waiting deliveries into the outbox depth gauge. Called
+        when the outbox changes, so scrapes never query the database.
+
+        Returns:
+            int: Deliveries waiting to be sent
+        """
+        depth = outbox_depth()
+        OUTBOX_DEPTH.set(depth)
+        return depth
+
+    async def _deliver_digest(self, deliveries):
+        if len(deliveries) == 1:
+            await self._deliver(deliveries, deliveries[0][2])
+            return
+        # Stable sort, so listings keep their queue order within each group
+        deliveries = sorted(deliveries, key=lambda delivery: delivery[5])
+        entries = [digest_entry or message for _, _, message, _, digest_entry, _, _ in deliveries]
+        # Parts go out in order, one after another
+        for text, indexes in format_digest_messages(entries):
+            await self._deliver([deliveries[index] for index in indexes], text)
+
+    async def _deliver(self, deliveries, text):
+        chat_id = deliveries[0][1]
+        try:
+            success = await self.sender.send_message(chat_id, text, max_retries=1)
+            error = None if success else 'send failed'
+        except Exception as e:
+            success = False
+            error = str(e)
+
+        # Recorded right away so a crash later in the batch cannot resend it
+        if success:
+            complete_deliveries([(delivery[0], chat_id, delivery[6]) for delivery in deliveries], [])
+            OUTBOX_DELIVERIES.labels('sent').inc(len(deliveries))
+            logger.info(f"Message for listings {', '.join(str(delivery[0]) for delivery in deliveries)} sent to chat {chat_id}")
+            return
+
+        failed = []
+        for listing_id, _, _, attempts, _, _, kind in deliveries:
+            attempts += 1
+            retry_at = time.time() + retry_delay(attempts) if attempts < self.max_attempts else None
+            if retry_at is None:
+                logger.error(f"Giving up on listing {listing_id} for chat {chat_id} after {attempts} attempts")
+            OUTBOX_DELIVERIES.labels('retry' if retry_at else 'failed').inc()
+            failed.append((listing_id, chat_id, kind, error, retry_at))
+        complete_deliveries([], failed)
+
+    async def run(self):
+        """Drain the outbox until stop() is called."""
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        released = release_inflight_deliveries()
+        if released:
+            logger.warning(f"Requeued {released} deliveries interrupted by a previous run")
+        logger.info(f"Outbox worker started, {self.update_depth()} deliveries pending")
+
+        while not self._stopping:
+            try:
+                if self.leases.acquire(OUTBOX_LEASE) and await self.drain_once():
+                    continue
+            except Exception as e:
+                logger.error(f"Error draining outbox: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def drain(self, timeout):
+        """
+        Send due deliveries until none are left or `timeout` seconds have
+        passed, for runs that exit afterwards.
+
+        Args:
+            timeout (float): Seconds to keep sending
+
+        Returns:
+            int: Deliveries still waiting, including retries due later
+        """
+        released = release_inflight_deliveries()
+        if released:
+            logger.warning(f"Requeued {released} deliveries interrupted by a previous run")
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and await self.drain_once():
+            pass
+        return self.update_depth()
+
+    def wake(self):
+        """Make the worker check the outbox now. Safe to call from any thread."""
+        if self._loop is not None and self._wake is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def stop(self):
+        """Stop the worker after the current batch. Safe to call from any thread."""
+        self._stopping = True
+        self.wake()
+
@@ -1,32 +1,58 @@
 import json
-import requests
 import logging
 import os
+import asyncio
+from collections import Counter
 from dotenv import load_dotenv
 
-from realtor_detector import is_realtor_listing, get_user_real_estate_listings_count, is_business_user
+from http_client import get_async_client
+from listing_record import Listing
+from realtor_detector import classify_listing
+from user_resolver import UserResolver
+from user_reputation import user_reputation
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of user lookups in flight at once in async mode
+ENRICH_CONCURRENCY = int(os.getenv('ENRICH_CONCURRENCY', '10'))
 
-def parse_listing_data(listing):
+
+def parse_listing_data(listing, verdict=None):
     """
     Extract relevant data from a single listing.
     
     Args:
         listing (dict): Raw listing data from the API
+        verdict (dict): Classification result, classified here if None
         
     Returns:
-        dict: Parsed listing data with standardized fields
+        Listing: Parsed listing data with standardized fields
     """
     try:
-        logger.debug(f"Processing listing {listing.get('id', 'unknown')}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Processing listing {listing.get('id', 'unknown')}")
         
-        user = listing.get('user', {})
-        user_uuid = user.get('uuid')
-        listings_count = get_user_real_estate_listings_count(user_uuid) if user_uuid else 0
-        is_business = is_business_user(user_uuid) if user_uuid else False
+        if verdict is None:
+            verdict = classify_listing(listing)
         
+        return build_listing_record(listing, verdict)
+    except Exception as e:
+        logger.error(f"Error parsing listing data: {str(e)}")
+        return None
+
+
+def build_listing_record(listing, verdict):
+    """
+    Build the parsed listing record from raw listing data and its classification.
+    
+    Args:
+        listing (dict): Raw listing data from the API
+        verdict (dict): Classification result of the listing
+        
+    Returns:
+        Listing: Parsed listing data or None if required fields are missing
+    """
+    try:
         location = listing.get('location', {})
         district = location.get('district', {})
         district_name = district.get('name', 'Unknown')
@@ -44,19 +70,23 @@ def parse_listing_data(listing):
                 break
         
         listing_id = listing.get('id')
+        user_id = (listing.get('user') or {}).get('id')
         title = listing.get('title', '')
         url = listing.get('url', '')
-        description = listing.get('description', '')
+        description = verdict['description'] or listing.get('description', '')
         created_time = listing.get('created_time', '')
         last_refresh_time = listing.get('last_refresh_time', '')
         
-        # Log extracted values for debugging
-        logger.debug(f"Extracted values for listing {listing_id}:")
-        logger.debug(f"  District: {district_name}")
-        logger.debug(f"  Owner: {owner_name}")
-        logger.debug(f"  Price: {price}")
-        logger.debug(f"  Title: {title}")
-        logger.debug(f"  URL: {url}")
+        # Log extracted values for debugging, formatted only when enabled
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f"Extracted values for listing {listing_id}:\n"
+                f"  District: {district_name}\n"
+                f"  Owner: {owner_name}\n"
+                f"  Price: {price}\n"
+                f"  Title: {title}\n"
+                f"  URL: {url}"
+            )
         
         if not all([listing_id, district_name, owner_name, price, title, url]):
             missing_fields = []
@@ -69,24 +99,95 @@ def parse_listing_data(listing):
             logger.warning(f"Missing required fields in listing {listing_id}: {', '.join(missing_fields)}")
             return None
             
-        return {
-            'id': listing_id,
-            'district_name': district_name,
-            'owner_name': owner_name,
-            'price': price,
-            'title': title,
-            'phone_number': phone_number,
-            'url': url,
-            'is_realtor': is_business or is_realtor_listing(listing),
-            'listings_count': listings_count,
-            'description': description,
-            'created_time': created_time,
-            'last_refresh_time': last_refresh_time
-        }
+        return Listing(
+            id=listing_id,
+            user_id=user_id,
+            district_name=district_name,
+            owner_name=owner_name,
+            price=price,
+            title=title,
+            phone_number=phone_number,
+            url=url,
+            is_realtor=verdict['is_realtor'],
+            decided_by=verdict['decided_by'],
+            listings_count=verdict['listings_count'],
+            description=description,
+            created_time=created_time,
+            last_refresh_time=last_refresh_time
+        )
     except Exception as e:
         logger.error(f"Error parsing listing data: {str(e)}")
         return None
 
+
+def extract_listings(data):
+    """
+    Extract the list of raw listings from a GraphQL API response.
+    
+    Args:
+        data (dict): Raw API response data
+        
+    Returns:
+        list: Raw listing dictionaries
+    """
+    return data.get("data", {}).get("clientCompatibleListings", {}).get("data", [])
+
+
+def create_user_resolver(concurrency=None):
+    """
+    Create a per-cycle user resolver on the shared async HTTP client.
+    
+    Args:
+        concurrency (int): Maximum number of concurrent requests
+        
+    Returns:
+        UserResolver: Resolver to share between all pages of a cycle
+    """
+    return UserResolver(get_async_client(), asyncio.Semaphore(concurrency or ENRICH_CONCURRENCY))
+
+
+async def process_listings_async(data, concurrency=None, resolver=None):
+    """
+    Process raw listings data from the API, enriching all listings concurrently.
+    
+    Listings are classified concurrently through the shared keep-alive
+    connection pool, with at most `concurrency` requests in flight at once.
+    Every distinct user is looked up at most once. Results keep the order
+    of the listings in the response.
+    
+    Args:
+        data (dict): Raw API response data
+        concurrency (int): Maximum number of concurrent requests
+        resolver (UserResolver): Per-cycle resolver, created if None
+        
+    Returns:
+        list: Parsed Listing records
+    """
+    try:
+        listings = extract_listings(data)
+        if not listings:
+            return []
+        
+        if resolver is None:
+            resolver = create_user_resolver(concurrency)
+        verdicts = await resolver.classify_page(listings)
+        
+        parsed_listings = []
+        for listing, verdict in zip(listings, verdicts):
+            parsed = parse_listing_data(listing, verdict)
+            if parsed:
+                parsed_listings.append(parsed)
+            else:
+                print(f"Failed to parse listing {listing.get('id', 'unknown')}")
+        log_decision_tiers(parsed_listings)
+        user_reputation.record(parsed_listings)
+        return parsed_listings
+        
+    except Exception as e:
+        print(f"Error processing listings: {str(e)}")
+        return []
+
+
 def process_listings(data):
     """
     Process raw listings data from the API.
@@ -95,7 +196,7 @@ def process_listings(data):
         data (dict): Raw API response data
         
     Returns:
-        list: List of parsed listing dictionaries
+        list: Parsed Listing records
     """
     try:
         # print("\n=== Raw Response Body ===")
@@ -104,7 +205,7 @@ def process_listings(data):
         # print(f"Raw data structure: {json.dumps(data, indent=2, ensure_ascii=False)}")
         
         # Extract listings from the nested data structure
-        listings = data.get("data", {}).get("clientCompatibleListings", {}).get("data", [])
+        listings = extract_listings(data)
         # print(f"\nFound {len(listings)} listings in response")
         
         if not listings:
@@ -128,6 +229,8 @@ def process_listings(data):
                 print(f"Error parsing listing {listing.get('id', 'unknown')}: {str(e)}")
                 continue
                 
+        log_decision_tiers(parsed_listings)
+        user_reputation.record(parsed_listings)
         # print(f"\n=== Processing complete ===")
         # print(f"Successfully processed {len(parsed_listings)} out of {len(listings)} listings")
         return parsed_listings
@@ -136,12 +239,24 @@ def process_listings(data):
         print(f"Error processing listings: {str(e)}")
         return []
 
+def log_decision_tiers(parsed_listings):
+    """
+    Log how many listings each classification tier decided.
+    
+    Args:
+        parsed_listings (list): Parsed Listing records
+    """
+    if parsed_listings:
+        tiers = Counter(listing.decided_by for listing in parsed_listings)
+        logger.info(f"Classified {len(parsed_listings)} listings by tier: {dict(tiers)}")
+
+
 def print_listing_info(listing_data):
     """
     Print formatted listing information to console.
     
     Args:
-        listing_data (dict): Parsed listing data
+        listing_data (Listing): Parsed listing data
     """
     if not listing_data:
         print("Invalid listing data")
@@ -1,8 +1,50 @@
-import requests
 import logging
 
+from http_client import get_session, hedged_get, olx_url
+from keyword_matcher import keyword_matcher
+from metrics import CLASSIFICATIONS, timed
+from user_cache import user_cache
+from user_reputation import TIER_REPUTATION, user_reputation
+
 logger = logging.getLogger(__name__)
 
+# Tiers of classify_listing, recorded with every verdict
+TIER_BUSINESS = 'business'
+TIER_KEYWORDS = 'keywords'
+TIER_LISTINGS_COUNT = 'listings_count'
+
+
+def user_offers_url(user_id):
+    """Build the OLX offers URL listing the latest offers of a user."""
+    return olx_url(f"/api/v1/offers/?offset=0&limit=10&category_id=0&sort_by=created_at%3Adesc&query=&user_id={user_id}")
+
+
+def user_url(user_id):
+    """Build the OLX user profile URL."""
+    return olx_url(f"/api/v1/users/{user_id}/")
+
+
+def listing_details_url(listing_id):
+    """Build the OLX offer URL with the full listing details."""
+    return olx_url(f"/api/v1/offers/{listing_id}/")
+
+
+def count_real_estate_offers(data):
+    """
+    Count real estate offers in an OLX offers API response.
+    
+    Args:
+        data (dict): Decoded offers API response
+        
+    Returns:
+        int: Number of real estate offers
+    """
+    real_estate_count = 0
+    for listing in data.get('data', []):
+        if listing.get('category', {}).get('type') == 'real_estate':
+            real_estate_count += 1
+    return real_estate_count
+
 
 def get_user_real_estate_listings_count(user_id):
     """
@@ -12,28 +54,27 @@ def get_user_real_estate_listings_count(user_id):
         user_id (str): OLX user UUID
         
     Returns:
-        int: Number of real estate listings or 0 if error
+        int: Number of real estate listings, on error the last known count
+            even if expired, None if there is none
     """
+    cached = user_cache.get_listings_count(user_id)
+    if cached is not None:
+        return cached
+
     try:
-        url = f"https://www.olx.ua/api/v1/offers/?offset=0&limit=10&category_id=0&sort_by=created_at%3Adesc&query=&user_id={user_id}"
-        response = requests.get(url)
+        response = get_session().get(user_offers_url(user_id))
         
         if response.status_code == 200:
-            data = response.json()
-            real_estate_count = 0
-            for listing in data.get('data', []):
-                if listing.get('category', {}).get('type') == 'real_estate':
-                    real_estate_count += 1
-
+            real_estate_count = count_real_estate_offers(response.json())
+            user_cache.set_listings_count(user_id, real_estate_count)
             logger.info(f"User {user_id} has {real_estate_count} real estate listings")
             return real_estate_count
         else:
             logger.error(f"Failed to get user listings. Status code: {response.status_code}")
-            return 0
         
     except Exception as e:
         logger.error(f"Error checking real estate listings count for user {user_id}: {e}")
-        return 0
+    return user_cache.get_listings_count(user_id, stale=True)
 
 
 def is_business_user(user_id):
@@ -44,86 +85,231 @@ def is_business_user(user_id):
         user_id (int): OLX user ID
         
     Returns:
-        bool: True if user is a business account, False otherwise
+        bool: True if user is a business account, False otherwise. On error
+            the last known flag even if expired, False if there is none.
+    """
+    cached = user_cache.get_business(user_id)
+    if cached is not None:
+        return cached
+
+    try:
+        response = get_session().get(user_url(user_id))
+        
+        if response.status_code == 200:
+            is_business = response.json().get('data', {}).get('is_business', False)
+            user_cache.set_business(user_id, is_business)
+            logger.info(f"User {user_id} is business: {is_business}")
+            return is_business
+        else:
+            logger.error(f"Failed to get user data. Status code: {response.status_code}")
+    except Exception as e:
+        logger.error(f"Error checking business status for user {user_id}: {e}")
+    return bool(user_cache.get_business(user_id, stale=True))
+
+
+async def get_user_real_estate_listings_count_async(client, user_id):
+    """
+    Async variant of get_user_real_estate_listings_count.
+    
+    Args:
+        client (httpx.AsyncClient): Shared HTTP client
+        user_id (str): OLX user UUID
+        
+    Returns:
+        int: Number of real estate listings, on error the last known count
+            even if expired, None if there is none
+    """
+    cached = user_cache.get_listings_count(user_id)
+    if cached is not None:
+        return cached
+
+    try:
+        response = await hedged_get(client, user_offers_url(user_id))
+        
+        if response.status_code == 200:
+            real_estate_count = count_real_estate_offers(response.json())
+            user_cache.set_listings_count(user_id, real_estate_count)
+            logger.info(f"User {user_id} has {real_estate_count} real estate listings")
+            return real_estate_count
+        else:
+            logger.error(f"Failed to get user listings. Status code: {response.status_code}")
+        
+    except Exception as e:
+        logger.error(f"Error checking real estate listings count for user {user_id}: {e}")
+    return user_cache.get_listings_count(user_id, stale=True)
+
+
+async def is_business_user_async(client, user_id):
+    """
+    Async variant of is_business_user.
+    
+    Args:
+        client (httpx.AsyncClient): Shared HTTP client
+        user_id (int): OLX user ID
+        
+    Returns:
+        bool: True if user is a business account, False otherwise. On error
+            the last known flag even if expired, False if there is none.
     """
+    cached = user_cache.get_business(user_id)
+    if cached is not None:
+        return cached
+
     try:
-        url = f"https://www.olx.ua/api/v1/users/{user_id}/"
-        response = requests.get(url)
+        response = await hedged_get(client, user_url(user_id))
         
         if response.status_code == 200:
-            data = response.json()
-            is_business = data.get('data', {}).get('is_business', False)
+            is_business = response.json().get('data', {}).get('is_business', False)
+            user_cache.set_business(user_id, is_business)
             logger.info(f"User {user_id} is business: {is_business}")
             return is_business
         else:
             logger.error(f"Failed to get user data. Status code: {response.status_code}")
-            return False
     except Exception as e:
         logger.error(f"Error checking business status for user {user_id}: {e}")
-        return False
+    return bool(user_cache.get_business(user_id, stale=True))
+
+
+def get_listing_description(listing_id):
+    """
+    Fetch the description of a listing, which search results do not include.
+    
+    Args:
+        listing_id (int): OLX listing ID
+        
+    Returns:
+        str: Listing description or empty string if error
+    """
+    try:
+        response = get_session().get(listing_details_url(listing_id))
+        
+        if response.status_code == 200:
+            return response.json().get('data', {}).get('description') or ''
+        else:
+            logger.error(f"Failed to get listing {listing_id}. Status code: {response.status_code}")
+            return ''
+    except Exception as e:
+        logger.error(f"Error fetching description of listing {listing_id}: {e}")
+        return ''
+
+
+async def get_listing_description_async(client, listing_id):
+    """
+    Async variant of get_listing_description.
+    
+    Args:
+        client (httpx.AsyncClient): Shared HTTP client
+        listing_id (int): OLX listing ID
+        
+    Returns:
+        str: Listing description or empty string if error
+    """
+    try:
+        response = await client.get(listing_details_url(listing_id))
+        
+        if response.status_code == 200:
+            return response.json().get('data', {}).get('description') or ''
+        else:
+            logger.error(f"Failed to get listing {listing_id}. Status code: {response.status_code}")
+            return ''
+    except Exception as e:
+        logger.error(f"Error fetching description of listing {listing_id}: {e}")
+        return ''
+
+
+def keywords_suggest_realtor(listing, description):
+    """
+    Score the title and description of a listing against the keyword lists.
+    
+    Args:
+        listing (dict): Raw listing data
+        description (str): Listing description
+        
+    Returns:
+        bool: True if realtor keywords outweigh private ones
+    """
+    return keyword_matcher.classify(f"{listing.get('title') or ''}\n{description or ''}")
 
 
-def is_realtor_listing(listing):
+def classification(is_realtor, decided_by, listings_count=None, description=''):
     """
-    Analyze listing description and user type to determine if it's from a realtor.
+    Build the result of classify_listing.
     
     Args:
-        listing (dict): Listing data including description
+        is_realtor (bool): Realtor verdict
+        decided_by (str): Tier that decided the verdict
+        listings_count (int): Listings count of the owner, None if not looked up
+        description (str): Listing description, empty if not fetched
         
     Returns:
-        bool: True if listing appears to be from a realtor, False otherwise
+        dict: Classification result
+    """
+    CLASSIFICATIONS.labels(decided_by, 'realtor' if is_realtor else 'private').inc()
+    return {
+        'is_realtor': is_realtor,
+        'decided_by': decided_by,
+        'listings_count': listings_count,
+        'description': description
+    }
+
+
+@timed('classify')
+def classify_listing(listing):
     """
-    # First check if user is a business account
-    user_id = listing.get('user', {}).get('id')
+    Decide whether a listing is from a realtor, running the cheapest checks first.
+    
+    Tiers, each run only when the previous ones left the verdict open:
+    
+    0. Reputation of the owner, one indexed lookup. A known user with a
+       fresh confident score needs no network checks at all.
+    1. Business flag of the owner, usually answered by the user cache.
+       A business account is a realtor.
+    2. Keywords in the title and the description, the description fetched
+       only now. Unless realtor keywords outweigh private ones the listing
+       is private whatever the owner's other listings are.
+    3. Real estate listings count of the owner. Two or more mean a private
+       owner with several flats rather than a realtor. If OLX cannot tell
+       and no count is cached, the keyword verdict stands.
+    
+    The count cannot change a private verdict of tiers 0 and 2, but it is
+    still looked up for them, mostly from the user cache: private owners
+    with many listings are shown as possible realtors and left out of
+    subscriptions that want none. Realtor verdicts do without it.
+    
+    Failed lookups never block the verdict: they fall back to expired
+    cached values or leave the tier to the keywords.
+    
+    Args:
+        listing (dict): Raw listing data
+        
+    Returns:
+        dict: Classification result, see classification()
+    """
+    user = listing.get('user') or {}
+    user_id, user_uuid = user.get('id'), user.get('uuid')
+    
+    known = user_reputation.verdict(listing)
+    if known:
+        return classification(True, TIER_REPUTATION)
+    if known is not None:
+        listings_count = get_user_real_estate_listings_count(user_uuid) if user_uuid else None
+        return classification(False, TIER_REPUTATION, listings_count)
+    
     if user_id and is_business_user(user_id):
-        return True
-        
-    # Check if user has too many listings (5 or more)
-    user_uuid = listing.get('user', {}).get('uuid')
-    if user_uuid:
-        listings_count = get_user_real_estate_listings_count(user_uuid)
-        if listings_count >= 2:
-            logger.info(f"User {user_uuid} has {listings_count} listings - likely not a realtor")
-            return False
-        
-    # If not a business account and not too many listings, check description keywords
-    # Keywords that might indicate a realtor listing
-    realtor_keywords = [
-        'рієлтор', 'ріелтор', 'ріелторська', 'рієлторська',
-        'агентство', 'агент', 'агентка',
-        'брокер', 'брокерська',
-        'посередник', 'посередництво',
-        'агентство нерухомості', 'агент нерухомості',
-        'офіс нерухомості', 'компанія нерухомості',
-        'професійний', 'професійна',
-        'квартира під ключ', 'квартири під ключ',
-        'пропозиція від агентства', 'пропозиція від агента',
-        'здійснюємо показ', 'проводимо показ',
-        'допоможемо підібрати', 'допоможемо знайти',
-        'великий вибір', 'широкий вибір',
-        'гарантуємо', 'гарантуємо якість',
-        'офіційний договір', 'офіційна угода',
-        'професійна консультація', 'консультація спеціаліста'
-    ]
-    
-    # Keywords that might indicate a private listing
-    private_keywords = [
-        'оренда від власника', 'оренда від господаря',
-        'продаж від власника', 'продаж від господаря',
-        'без посередників', 'без рієлторів',
-        'без комісії', 'без додаткових витрат',
-        'без агентства', 'без агентів',
-        'прямий контакт', 'контакт з власником',
-        'здає власник', 'продає власник',
-        'орендодавець', 'власник квартири',
-        'господар квартири', 'господар оселі'
-    ]
-    
-    description = listing.get('description', '').lower()
-    
-    # Count matches for each category
-    realtor_matches = sum(1 for keyword in realtor_keywords if keyword in description)
-    private_matches = sum(1 for keyword in private_keywords if keyword in description)
-    
-    # If there are more realtor keyword matches than private ones, consider it a realtor listing
-    return realtor_matches > private_matches 
\ No newline at end of file
+        return classification(True, TIER_BUSINESS)
+    
+    description = listing.get('description')
+    if not description and listing.get('id'):
+        description = get_listing_description(listing['id'])
+    if not keywords_suggest_realtor(listing, description):
+        listings_count = get_user_real_estate_listings_count(user_uuid) if user_uuid else None
+        return classification(False, TIER_KEYWORDS, listings_count, description)
+    
+    if not user_uuid:
+        return classification(True, TIER_KEYWORDS, description=description)
+    listings_count = get_user_real_estate_listings_count(user_uuid)
+    if listings_count is None:
+        return classification(True, TIER_KEYWORDS, description=description)
+    if listings_count >= 2:
+        logger.info(f"User {user_uuid} has {listings_count} listings - likely not a realtor")
+    return classification(listings_count < 2, TIER_LISTINGS_COUNT, listings_count, description)
@@ -0,0 +1,129 @@
+import os
+import time
+import logging
+import asyncio
+
+from database import (
+    database_size,
+    incremental_vacuum,
+    purge_listing_targets,
+    purge_listings,
+    purge_outbox,
+    purge_users
+)
+from leases import lease_keeper
+from metrics import DATABASE_SIZE, RETENTION_DELETED
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 3600
+# Ages after which rows are removed, 0 keeps them forever
+LISTING_RETENTION = float(os.getenv('LISTING_RETENTION_DAYS', '365')) * DAY
+OUTBOX_RETENTION = float(os.getenv('OUTBOX_RETENTION_DAYS', '30')) * DAY
+USER_RETENTION = float(os.getenv('USER_RETENTION_DAYS', '180')) * DAY
+# Seconds between retention runs, rows removed per transaction and pause between transactions
+INTERVAL = float(os.getenv('RETENTION_INTERVAL', '3600'))
+BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '500'))
+BATCH_PAUSE = float(os.getenv('RETENTION_BATCH_PAUSE', '0.05'))
+# Free pages returned to the file system per step of the incremental vacuum
+VACUUM_STEP = int(os.getenv('VACUUM_STEP_PAGES', '1000'))
+RETENTION_LEASE = 'retention'
+
+
+class RetentionWorker:
+    """
+    Keeps the database small: removes old rows and returns freed pages to
+    the file system.
+
+    Every run deletes rows past their retention age in short transactions
+    of BATCH_SIZE rows, run in a thread with a pause in between, so fetch
+    cycles and the outbox keep their turn at the write lock. Then
+    incremental vacuum shrinks the file VACUUM_STEP pages at a time.
+
+    - Listings not seen on crawled pages for LISTING_RETENTION go with
+      their snapshots, price history, fingerprints, targets and deliveries.
+    - Sent and failed deliveries older than OUTBOX_RETENTION, and targets
+      of listings off the pages for as long, are no longer needed.
+    - Cached user profiles and reputations go after USER_RETENTION.
+
+    With several processes only the holder of the retention lease runs it.
+    """
+
+    def __init__(self, interval=INTERVAL, batch_size=BATCH_SIZE, leases=lease_keeper):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.leases = leases
+        self._targets_purged_until = 0.0
+        self._stop = None
+
+    async def run_once(self):
+        """
+        Apply the retention policy once.
+
+        Returns:
+            dict: Number of rows deleted per table
+        """
+        now = time.time()
+        deleted = {}
+        if LISTING_RETENTION:
+            deleted['listings'] = await self._purge(purge_listings, now - LISTING_RETENTION, self.batch_size)
+        if OUTBOX_RETENTION:
+            cutoff = now - OUTBOX_RETENTION
+            deleted['outbox'] = await self._purge(purge_outbox, cutoff, self.batch_size)
+            deleted['listing_targets'] = await self._purge(
+                purge_listing_targets, self._targets_purged_until, cutoff, self.batch_size
+            )
+            self._targets_purged_until = cutoff
+        if USER_RETENTION:
+            deleted['users'] = await self._purge(purge_users, now - USER_RETENTION, self.batch_size)
+
+        free_pages = await asyncio.to_thread(incremental_vacuum, 0)
+        while free_pages and not self._stopping():
+            left = await asyncio.to_thread(incremental_vacuum, VACUUM_STEP)
+            if left >= free_pages:
+                # Not in incremental auto-vacuum mode, the pages stay until the switch
+                break
+            free_pages = left
+            await asyncio.sleep(BATCH_PAUSE)
+        for table, count in deleted.items():
+            if count:
+                RETENTION_DELETED.labels(table).inc(count)
+        size = await asyncio.to_thread(database_size)
+        DATABASE_SIZE.set(size)
+        if any(deleted.values()):
+            logger.info(f"Retention removed {deleted}, database is {size // 1024} KiB")
+        return deleted
+
+    async def _purge(self, purge, *args):
+        total = 0
+        while not self._stopping():
+            deleted = await asyncio.to_thread(purge, *args)
+            total += deleted
+            if deleted < self.batch_size:
+                break
+            await asyncio.sleep(BATCH_PAUSE)
+        return total
+
+    async def run(self):
+        """Apply the retention policy every `interval` seconds until stop() is called."""
+        self._stop = asyncio.Event()
+        while not self._stop.is_set():
+            try:
+                if self.leases.acquire(RETENTION_LEASE):
+                    await self.run_once()
+                else:
+                    DATABASE_SIZE.set(await asyncio.to_thread(database_size))
+            except Exception as e:
+                logger.error(f"Error applying retention: {e}")
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self):
+        """Stop the worker after the current batch."""
+        if self._stop is not None:
+            self._stop.set()
+
+    def _stopping(self):
+        return self._stop is not None and self._stop.is_set()
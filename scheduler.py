@@ -0,0 +1,133 @@
+import os
+import time
+import random
+import logging
+import asyncio
+
+logger = logging.getLogger(__name__)
+
+MIN_INTERVAL = float(os.getenv('POLL_MIN_INTERVAL', '60'))
+MAX_INTERVAL = float(os.getenv('POLL_MAX_INTERVAL', '900'))
+INITIAL_INTERVAL = float(os.getenv('POLL_INITIAL_INTERVAL', '300'))
+# New listings a cycle should find on average, well below one search page
+TARGET_NEW_PER_CYCLE = float(os.getenv('POLL_TARGET_NEW_PER_CYCLE', '5'))
+JITTER = float(os.getenv('POLL_JITTER', '0.1'))
+SMOOTHING = 0.3
+
+
+class AdaptiveInterval:
+    """
+    Picks the delay before the next polling cycle of one search profile.
+
+    Keeps an exponentially smoothed rate of new listings per second and
+    aims for TARGET_NEW_PER_CYCLE new listings per cycle: busy hours poll
+    often, quiet nights rarely. Consecutive errors back off exponentially
+    from the current delay. Every delay gets random jitter and stays within
+    [min_interval, max_interval].
+    """
+
+    def __init__(self, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, initial_interval=INITIAL_INTERVAL,
+                 target_new=TARGET_NEW_PER_CYCLE, jitter=JITTER, smoothing=SMOOTHING):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_new = target_new
+        self.jitter = jitter
+        self.smoothing = smoothing
+        self.rate = None
+        self.errors = 0
+        self.interval = self._clamp(initial_interval)
+
+    def record_success(self, new_count, elapsed):
+        """
+        Update the rate estimate after a successful cycle.
+
+        Args:
+            new_count (int): New listings found by the cycle
+            elapsed (float): Seconds since the previous cycle started, None
+                for the first cycle
+        """
+        self.errors = 0
+        if elapsed:
+            rate = new_count / elapsed
+            self.rate = rate if self.rate is None else self.smoothing * rate + (1 - self.smoothing) * self.rate
+        if self.rate is not None:
+            self.interval = self._clamp(self.target_new / self.rate if self.rate > 0 else self.max_interval)
+
+    def record_error(self):
+        """Register a failed cycle."""
+        self.errors += 1
+
+    def next_delay(self):
+        """
+        Get the delay before the next cycle.
+
+        Returns:
+            float: Seconds to wait
+        """
+        delay = self.interval
+        if self.errors:
+            delay = max(delay, self.min_interval) * 2 ** self.errors
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return self._clamp(delay)
+
+    def _clamp(self, delay):
+        return max(self.min_interval, min(self.max_interval, delay))
+
+
+class Scheduler:
+    """
+    Runs every registered job on its own adaptive timer on one event loop.
+
+    A job is an async callable returning the number of new listings it
+    found, or None if it skipped the run, e.g. because another process
+    holds its profile. Skipped runs leave the interval untouched. The
+    next run of a job is scheduled only after the previous one finished,
+    so runs of the same job never overlap.
+    """
+
+    def __init__(self):
+        self._jobs = []
+        self._stop = None
+
+    def add(self, name, job, interval=None):
+        """
+        Register a job.
+
+        Args:
+            name (str): Name used in logs
+            job: Async callable returning the number of new listings, None
+                if it skipped the run
+            interval (AdaptiveInterval): Delay policy, default one if None
+        """
+        self._jobs.append((name, job, interval or AdaptiveInterval()))
+
+    async def run(self):
+        """Run all jobs until stop() is called."""
+        self._stop = asyncio.Event()
+        await asyncio.gather(*(self._run_job(name, job, interval) for name, job, interval in self._jobs))
+
+    def stop(self):
+        """Stop scheduling new runs."""
+        if self._stop is not None:
+            self._stop.set()
+
+    async def _run_job(self, name, job, interval):
+        previous_start = None
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                new_count = await job()
+                if new_count is not None:
+                    interval.record_success(new_count, started - previous_start if previous_start else None)
+                    previous_start = started
+            except Exception as e:
+                interval.record_error()
+                logger.error(f"Cycle '{name}' failed ({interval.errors} in a row): {e}")
+                previous_start = started
+
+            delay = interval.next_delay()
+            logger.info(f"Next cycle '{name}' in {delay:.0f} seconds")
+            try:
+                await asyncio.wait_for(self._stop.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
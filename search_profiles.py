@@ -0,0 +1,119 @@
+import os
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+SEARCH_PROFILES_FILE = os.getenv('SEARCH_PROFILES_FILE', 'search_profiles.json')
+
+# Search used when no profiles file exists: 2-room rentals up to 10000 UAH
+DEFAULT_FILTERS = {
+    "query": "оренда 2 кімнатна",
+    "category_id": "1760",
+    "region_id": "5",
+    "city_id": "176",
+    "currency": "UAH",
+    "filter_enum_number_of_rooms_string[0]": "dvuhkomnatnye",
+    "filter_float_price:to": "10000"
+}
+
+
+def default_profile(chat_ids):
+    """
+    Build the built-in search profile.
+
+    Args:
+        chat_ids (list): Chats the listings are sent to
+
+    Returns:
+        dict: Search profile
+    """
+    return {'name': 'default', 'filters': dict(DEFAULT_FILTERS), 'chat_ids': list(chat_ids)}
+
+
+def load_search_profiles(default_chat_ids, path=SEARCH_PROFILES_FILE):
+    """
+    Load search profiles from a JSON file.
+
+    The file holds a list of objects with a unique "name", a "filters"
+    object of OLX search parameters and an optional "chat_ids" list.
+    Profiles without chat ids send to the default chats.
+
+    Args:
+        default_chat_ids (list): Chats used by profiles that define none
+        path (str): Path of the JSON file
+
+    Returns:
+        list: Search profiles, the built-in default one if the file is missing
+    """
+    if not path or not os.path.exists(path):
+        return [default_profile(default_chat_ids)]
+
+    with open(path, encoding='utf-8') as f:
+        raw_profiles = json.load(f)
+
+    profiles = []
+    names = set()
+    for raw in raw_profiles:
+        name = raw.get('name')
+        if not name or name in names:
+            raise ValueError(f"Search profile names must be unique and non-empty, got {name!r}")
+        names.add(name)
+        profiles.append({
+            'name': name,
+            'filters': {key: str(value) for key, value in raw.get('filters', {}).items()},
+            'chat_ids': [str(chat_id) for chat_id in raw.get('chat_ids') or default_chat_ids]
+        })
+    logger.info(f"Loaded {len(profiles)} search profiles from {path}")
+    return profiles
+
+
+def build_search_parameters(profile, offset, limit):
+    """
+    Build GraphQL search parameters for one page of a profile.
+
+    Args:
+        profile (dict): Search profile
+        offset (int): Offset of the first listing
+        limit (int): Number of listings on the page
+
+    Returns:
+        list: GraphQL SearchParameter objects
+    """
+    parameters = [
+        {"key": "offset", "value": str(offset)},
+        {"key": "limit", "value": str(limit)},
+        {"key": "sort_by", "value": "created_at:desc"}
+    ]
+    parameters.extend({"key": key, "value": value} for key, value in profile['filters'].items())
+    return parameters
+
+
+def merge_profile_listings(profiles, listings_per_profile, route=None):
+    """
+    Merge raw listings found by several profiles.
+
+    Args:
+        profiles (list): Search profiles
+        listings_per_profile (list): Raw listings of each profile, same order
+        route: Function of (listing, profile) returning the chats that get
+            the listing, all chats of the profile if None
+
+    Returns:
+        tuple: (unique raw listings in first-seen order,
+                dict of listing id to the chat ids of every matching profile)
+    """
+    listings = {}
+    targets = {}
+    added = {}
+    for profile, profile_listings in zip(profiles, listings_per_profile):
+        for listing in profile_listings:
+            listing_id = listing.get('id')
+            listings.setdefault(listing_id, listing)
+            chats = targets.setdefault(listing_id, [])
+            chat_set = added.setdefault(listing_id, set())
+            for chat_id in profile['chat_ids'] if route is None else route(listing, profile):
+                if chat_id not in chat_set:
+                    chat_set.add(chat_id)
+                    chats.append(chat_id)
+    return list(listings.values()), targets
@@ -0,0 +1,80 @@
+import os
+import logging
+from array import array
+from bisect import bisect_left
+from itertools import chain, islice
+
+logger = logging.getLogger(__name__)
+
+# Number of recently added ids kept in a set before merging into the sorted array
+MERGE_THRESHOLD = int(os.getenv('SEEN_INDEX_MERGE_THRESHOLD', '4096'))
+
+
+class SeenIndex:
+    """
+    Compact in-memory set of listing ids that were already handled.
+
+    Ids live in a sorted array of 64-bit integers (8 bytes per id) and are
+    looked up by binary search. Newly added ids go to a small set that is
+    merged into the array once it grows past MERGE_THRESHOLD.
+    """
+
+    def __init__(self, merge_threshold=MERGE_THRESHOLD):
+        self.merge_threshold = merge_threshold
+        self._ids = array('q')
+        self._recent = set()
+
+    def load(self, listing_ids):
+        """
+        Replace the index contents.
+
+        Args:
+            listing_ids: Iterable of listing IDs, ideally in ascending order
+        """
+        ids = array('q', listing_ids)
+        if any(a > b for a, b in zip(ids, islice(ids, 1, None))):
+            ids = array('q', sorted(set(ids)))
+        self._ids = ids
+        self._recent = set()
+        logger.info(f"Loaded {len(self._ids)} seen listing ids")
+
+    def add_many(self, listing_ids):
+        """Add listing ids to the index."""
+        for listing_id in listing_ids:
+            if listing_id in self:
+                continue
+            self._recent.add(listing_id)
+        if len(self._recent) >= self.merge_threshold:
+            self._merge()
+
+    def add(self, listing_id):
+        """Add a single listing id to the index."""
+        self.add_many((listing_id,))
+
+    def __contains__(self, listing_id):
+        if listing_id is None:
+            return False
+        if listing_id in self._recent:
+            return True
+        ids = self._ids
+        position = bisect_left(ids, listing_id)
+        return position < len(ids) and ids[position] == listing_id
+
+    def __len__(self):
+        return len(self._ids) + len(self._recent)
+
+    def memory_usage(self):
+        """Approximate number of bytes held by the index."""
+        return self._ids.itemsize * len(self._ids) + 64 * len(self._recent)
+
+    def _merge(self):
+        recent = sorted(self._recent)
+        if not self._ids or recent[0] > self._ids[-1]:
+            # Listing ids grow over time, so new ids usually just extend the array
+            self._ids.extend(recent)
+        else:
+            self._ids = array('q', sorted(chain(self._ids, recent)))
+        self._recent = set()
+
+
+seen_index = SeenIndex()
@@ -0,0 +1,256 @@
+"""
+Per-chat subscriptions: which listings of the search profiles a chat gets.
+
+    python subscriptions.py set 123456 --max-price 12000 --district Оболонський --realtors none
+    python subscriptions.py list
+    python subscriptions.py delete 123456
+
+A subscription holds a price range, a set of districts, the search profiles
+it follows and how it treats realtors: "any" gets every listing, "maybe"
+drops realtor listings and "none" also drops listings of owners with many
+listings. Chats of a profile without a subscription get all its listings.
+"""
+import json
+import logging
+import argparse
+from bisect import bisect_left, bisect_right
+
+from database import (
+    create_table_if_not_exists,
+    delete_subscription,
+    load_subscriptions,
+    save_subscription,
+    subscriptions_version
+)
+from listing_snapshots import listing_price
+
+logger = logging.getLogger(__name__)
+
+REALTOR_TOLERANCES = ('any', 'maybe', 'none')
+
+
+def listing_district(listing):
+    """District name of a raw listing, None if it has none"""
+    return ((listing.get('location') or {}).get('district') or {}).get('name')
+
+
+def _bits(positions):
+    bits = 0
+    for position in positions:
+        bits |= 1 << position
+    return bits
+
+
+class RoutingIndex:
+    """
+    Subscriptions compiled for matching a listing against all of them at once.
+
+    Chats are numbered and every filter value maps to a bitset of the chats
+    it admits, a Python int. Lower price bounds are sorted with the bitset
+    of all chats whose bound is at most each one, upper bounds with the
+    bitset of all chats whose bound is at least each one, so a price is two
+    bisections. Districts and profiles map to bitsets directly, plus one
+    bitset of the chats without such a filter. A listing's chats are the
+    AND of these bitsets, the cost grows with the number of distinct
+    bounds and matching chats, not with the number of subscriptions.
+    """
+
+    def __init__(self, subscriptions=()):
+        """
+        Args:
+            subscriptions: Iterable of rows as returned by load_subscriptions
+        """
+        self.chats = []
+        self.drop_realtors = set()
+        self.drop_maybe_realtors = set()
+        lower = {}
+        upper = {}
+        no_lower = []
+        no_upper = []
+        districts = {}
+        any_district = []
+        profiles = {}
+        any_profile = []
+        for chat_id, min_price, max_price, district_names, realtors, profile_names in subscriptions:
+            position = len(self.chats)
+            self.chats.append(str(chat_id))
+            if min_price is None:
+                no_lower.append(position)
+            else:
+                lower.setdefault(min_price, []).append(position)
+            if max_price is None:
+                no_upper.append(position)
+            else:
+                upper.setdefault(max_price, []).append(position)
+            district_names = json.loads(district_names)
+            for name in district_names:
+                districts.setdefault(name.lower(), []).append(position)
+            if not district_names:
+                any_district.append(position)
+            profile_names = json.loads(profile_names)
+            for name in profile_names:
+                profiles.setdefault(name, []).append(position)
+            if not profile_names:
+                any_profile.append(position)
+            if realtors != 'any':
+                self.drop_realtors.add(str(chat_id))
+            if realtors == 'none':
+                self.drop_maybe_realtors.add(str(chat_id))
+
+        self._positions = {chat_id: position for position, chat_id in enumerate(self.chats)}
+        self._all = (1 << len(self.chats)) - 1
+        self._no_price = _bits(no_lower) & _bits(no_upper)
+
+        self._lower_bounds = sorted(lower)
+        self._lower_bits = []
+        bits = _bits(no_lower)
+        for bound in self._lower_bounds:
+            bits |= _bits(lower[bound])
+            self._lower_bits.append(bits)
+        self._no_lower = _bits(no_lower)
+
+        self._upper_bounds = sorted(upper)
+        self._upper_bits = [0] * len(self._upper_bounds)
+        bits = _bits(no_upper)
+        for index in range(len(self._upper_bounds) - 1, -1, -1):
+            bits |= _bits(upper[self._upper_bounds[index]])
+            self._upper_bits[index] = bits
+        self._no_upper = _bits(no_upper)
+
+        self._districts = {name: _bits(positions) for name, positions in districts.items()}
+        self._any_district = _bits(any_district)
+        self._profiles = {name: _bits(positions) for name, positions in profiles.items()}
+        self._any_profile = _bits(any_profile)
+
+    def __len__(self):
+        return len(self.chats)
+
+    def __contains__(self, chat_id):
+        return str(chat_id) in self._positions
+
+    def match(self, price, district, profile_name):
+        """
+        Find the subscribed chats that want a listing.
+
+        Args:
+            price (float): Listing price, None if unknown
+            district (str): District name, None if unknown
+            profile_name (str): Search profile that found the listing
+
+        Returns:
+            list: Chat ids in subscription order
+        """
+        if not self.chats:
+            return []
+        bits = self._any_profile | self._profiles.get(profile_name, 0)
+        bits &= self._any_district | (self._districts.get(district.lower(), 0) if district else 0)
+        if not bits:
+            return []
+        if price is None:
+            bits &= self._no_price
+        else:
+            index = bisect_right(self._lower_bounds, price)
+            bits &= self._lower_bits[index - 1] if index else self._no_lower
+            index = bisect_left(self._upper_bounds, price)
+            bits &= self._upper_bits[index] if index < len(self._upper_bounds) else self._no_upper
+        chats = []
+        while bits:
+            lowest = bits & -bits
+            chats.append(self.chats[lowest.bit_length() - 1])
+            bits ^= lowest
+        return chats
+
+
+class SubscriptionRouter:
+    """
+    Routes listings to chats, keeping the routing index in step with the
+    `subscriptions` table.
+    """
+
+    def __init__(self):
+        self.index = RoutingIndex()
+        self._version = None
+
+    def refresh(self):
+        """Rebuild the routing index if subscriptions changed since the last call."""
+        version = subscriptions_version()
+        if version == self._version:
+            return
+        self.index = RoutingIndex(load_subscriptions())
+        self._version = version
+        logger.info(f"Loaded {len(self.index)} chat subscriptions")
+
+    def route(self, listing, profile):
+        """
+        Chats that get a listing found by a search profile.
+
+        Args:
+            listing (dict): Raw listing data from the API
+            profile (dict): Search profile
+
+        Returns:
+            list: Chat ids, the profile's chats without a subscription first
+        """
+        chats = [chat_id for chat_id in profile['chat_ids'] if chat_id not in self.index]
+        try:
+            price = float(listing_price(listing))
+        except (TypeError, ValueError):
+            price = None
+        chats.extend(self.index.match(price, listing_district(listing), profile['name']))
+        return chats
+
+    def drops_realtors(self, chat_id):
+        """Check whether a subscription drops realtor listings."""
+        return str(chat_id) in self.index.drop_realtors
+
+    def drops_maybe_realtors(self, chat_id):
+        """Check whether a subscription drops listings that may be from realtors."""
+        return str(chat_id) in self.index.drop_maybe_realtors
+
+
+subscription_router = SubscriptionRouter()
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    set_parser = commands.add_parser('set', help='create or replace the subscription of a chat')
+    set_parser.add_argument('chat_id')
+    set_parser.add_argument('--min-price', type=float)
+    set_parser.add_argument('--max-price', type=float)
+    set_parser.add_argument('--district', action='append', default=[], help='district name, repeat for several')
+    set_parser.add_argument('--profile', action='append', default=[], help='search profile name, all if none')
+    set_parser.add_argument('--realtors', choices=REALTOR_TOLERANCES, default='any')
+    commands.add_parser('list', help='show all subscriptions')
+    delete_parser = commands.add_parser('delete', help='delete the subscription of a chat')
+    delete_parser.add_argument('chat_id')
+    args = parser.parse_args(argv)
+
+    create_table_if_not_exists()
+    if args.command == 'set':
+        if args.min_price is not None and args.max_price is not None and args.min_price > args.max_price:
+            parser.error('--min-price must not exceed --max-price')
+        save_subscription(
+            args.chat_id, args.min_price, args.max_price,
+            json.dumps(args.district, ensure_ascii=False), args.realtors, json.dumps(args.profile, ensure_ascii=False)
+        )
+        logger.info(f"Saved subscription of chat {args.chat_id}")
+    elif args.command == 'delete':
+        if delete_subscription(args.chat_id):
+            logger.info(f"Deleted subscription of chat {args.chat_id}")
+        else:
+            logger.info(f"Chat {args.chat_id} has no subscription")
+    else:
+        for chat_id, min_price, max_price, districts, realtors, profiles in load_subscriptions():
+            logger.info(
+                f"{chat_id}: price {min_price or '-'}..{max_price or '-'}, "
+                f"districts {', '.join(json.loads(districts)) or 'all'}, "
+                f"profiles {', '.join(json.loads(profiles)) or 'all'}, realtors {realtors}"
+            )
+
+
+if __name__ == '__main__':
+    main()
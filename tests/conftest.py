@@ -0,0 +1,28 @@
+import os
+import sys
+import tempfile
+
+# Settings are read when the modules are imported, so they are set first
+_scratch = tempfile.mkdtemp(prefix='rieltor_zlo_tests_')
+os.environ['DATABASE_PATH'] = os.path.join(_scratch, 'database.db')
+os.environ['DATABASE_ARCHIVE_PATH'] = ''
+os.environ['REALTOR_KEYWORDS_FILE'] = ''
+os.environ['SEARCH_PROFILES_FILE'] = ''
+os.environ['CHAT_SETTINGS_FILE'] = ''
+os.environ['METRICS_DUMP_FILE'] = ''
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import database
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh database with the current schema, for this test only"""
+    database.close_db()
+    monkeypatch.setattr(database, 'DATABASE_PATH', str(tmp_path / 'database.db'))
+    database.create_table_if_not_exists()
+    yield database
+    database.close_db()
@@ -0,0 +1,103 @@
+import io
+
+import pytest
+
+import cli
+import main
+from bot import DryRunSender
+from duplicate_index import DuplicateIndex
+from leases import LeaseKeeper
+from listing_record import Listing
+from seen_index import SeenIndex
+
+PROFILE = {'name': 'test', 'chat_ids': ['100']}
+
+
+def make_raw(listing_id):
+    return {'id': listing_id, 'title': f"Квартира {listing_id}", 'url': f"https://www.olx.ua/d/{listing_id}"}
+
+
+def parse(raw):
+    return Listing(
+        id=raw['id'], user_id=raw['id'], district_name='Оболонський', owner_name='Олена', price=12000,
+        title=raw['title'], phone_number=True, url=raw['url'], is_realtor=False, decided_by='keywords',
+        listings_count=1, description=f"Опис {raw['id']} " * raw['id'], created_time='', last_refresh_time=''
+    )
+
+
+@pytest.fixture
+def bot(db, monkeypatch):
+    """A one-shot run against a fake OLX search, without network or Telegram"""
+    state = {'fetch_fails': False, 'senders': []}
+
+    async def fetch_listings_page(client, profile, offset=0, limit=main.PAGE_SIZE):
+        return None if state['fetch_fails'] else [make_raw(1), make_raw(2)]
+
+    async def enrich_listings(listings_data):
+        return [parse(listing) for listing in listings_data['data']['clientCompatibleListings']['data']]
+
+    def get_sender():
+        sender = DryRunSender(stream=io.StringIO())
+        state['senders'].append(sender)
+        return sender
+
+    monkeypatch.setenv('TELEGRAM_BOT_TOKEN', 'test-token')
+    # Dry runs point these at a temporary copy of the database
+    for name in ('DATABASE_PATH', 'DATABASE_ARCHIVE_PATH', 'METRICS_DUMP_FILE'):
+        monkeypatch.setenv(name, '')
+    monkeypatch.setattr(main, 'SEARCH_PROFILES', [PROFILE])
+    monkeypatch.setattr(main, 'seen_index', SeenIndex())
+    monkeypatch.setattr(main, 'duplicate_index', DuplicateIndex())
+    monkeypatch.setattr(main, 'lease_keeper', LeaseKeeper(owner='test', lease_ttl=60))
+    monkeypatch.setattr(main, 'fetch_listings_page', fetch_listings_page)
+    monkeypatch.setattr(main, 'enrich_listings', enrich_listings)
+    monkeypatch.setattr(main, 'get_async_client', lambda: None)
+    monkeypatch.setattr(main, 'get_sender', get_sender)
+    return state
+
+
+def test_usage_errors_exit_with_2(bot, monkeypatch):
+    for argv in (['--bogus'], ['--delivery-timeout', '5'], ['--no-retention']):
+        with pytest.raises(SystemExit) as exited:
+            cli.main(argv)
+        assert exited.value.code == 2
+    monkeypatch.delenv('TELEGRAM_BOT_TOKEN')
+    with pytest.raises(SystemExit) as exited:
+        cli.main(['--once'])
+    assert exited.value.code == 2
+
+
+def test_successful_run_exits_with_0(bot):
+    assert cli.main(['--once', '--no-retention', '--delivery-timeout', '5']) == 0
+    [sender] = bot['senders']
+    assert sender.messages == 2
+
+
+def test_dry_run_exits_with_0_without_a_token(bot, monkeypatch, capsys):
+    monkeypatch.delenv('TELEGRAM_BOT_TOKEN')
+    assert cli.main(['--dry-run']) == 0
+    assert capsys.readouterr().out.count('----- chat 100 -----') == 2
+    # The dry run prints instead of using the Telegram sender
+    assert bot['senders'] == []
+
+
+def test_failed_fetch_exits_with_1(bot):
+    bot['fetch_fails'] = True
+    assert cli.main(['--once', '--no-retention']) == 1
+
+
+def test_undelivered_messages_exit_with_1(bot, monkeypatch):
+    class FailingSender:
+        async def send_message(self, chat_id, message, max_retries=None, initial_delay=None):
+            return False
+
+    monkeypatch.setattr(main, 'get_sender', FailingSender)
+    assert cli.main(['--once', '--no-retention']) == 1
+
+
+def test_failed_run_exits_with_1(bot, monkeypatch):
+    async def run_once(*args, **kwargs):
+        raise RuntimeError('database is locked')
+
+    monkeypatch.setattr(main, 'run_once', run_once)
+    assert cli.main(['--once']) == 1
@@ -0,0 +1,120 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+from seen_index import SeenIndex
+
+PROFILE = {'name': 'test'}
+START = datetime(2024, 5, 1, 12, 0)
+
+
+def make_listing(listing_id):
+    # Newer listings have higher ids
+    return {'id': listing_id, 'created_time': (START + timedelta(minutes=listing_id)).isoformat()}
+
+
+class FakeSearch:
+    """Newest-first search results of the given listing ids"""
+
+    def __init__(self, listing_ids, fail=False):
+        self.listings = [make_listing(listing_id) for listing_id in sorted(listing_ids, reverse=True)]
+        self.fail = fail
+        self.offsets = []
+
+    async def __call__(self, client, profile, offset=0, limit=main.PAGE_SIZE):
+        self.offsets.append(offset)
+        if self.fail:
+            return None
+        return self.listings[offset:offset + limit]
+
+
+@pytest.fixture
+def search(monkeypatch):
+    monkeypatch.setattr(main, 'PAGE_SIZE', 5)
+    monkeypatch.setattr(main, 'MAX_PAGES', 4)
+    monkeypatch.setattr(main, 'seen_index', SeenIndex())
+
+    def install(listing_ids, fail=False):
+        fake = FakeSearch(listing_ids, fail)
+        monkeypatch.setattr(main, 'fetch_listings_page', fake)
+        return fake
+
+    return install
+
+
+def crawl(watermark):
+    return asyncio.run(main.crawl_new_listings(None, PROFILE, watermark))
+
+
+def ids(listings):
+    return [listing['id'] for listing in listings]
+
+
+def watermark_of(listing_id):
+    listing = make_listing(listing_id)
+    return listing['id'], listing['created_time']
+
+
+def test_first_crawl_fetches_one_page(search):
+    fake = search(range(1, 31))
+    new_listings, seen_ids, watermark, known = crawl(None)
+    assert fake.offsets == [0]
+    assert ids(new_listings) == [30, 29, 28, 27, 26]
+    assert watermark == watermark_of(30)
+    assert known == []
+
+
+def test_stops_at_the_page_that_reaches_the_watermark(search):
+    fake = search(range(1, 31))
+    new_listings, _, watermark, known = crawl(watermark_of(22))
+    assert fake.offsets == [0, 5]
+    assert ids(new_listings) == list(range(30, 22, -1))
+    assert ids(known) == [22, 21]
+    assert watermark == watermark_of(30)
+
+
+def test_stops_when_the_page_budget_is_spent(search):
+    fake = search(range(1, 101))
+    new_listings, _, watermark, _ = crawl(watermark_of(1))
+    assert fake.offsets == [0, 5, 10, 15]
+    assert len(new_listings) == 20
+    assert watermark == watermark_of(100)
+
+
+def test_stops_at_a_short_page(search):
+    fake = search(range(1, 8))
+    new_listings, _, _, _ = crawl(watermark_of(0))
+    assert fake.offsets == [0, 5]
+    assert ids(new_listings) == list(range(7, 0, -1))
+
+
+def test_promoted_old_listing_does_not_stop_the_crawl(search):
+    fake = search(range(10, 30))
+    # An old promoted listing on top of the first page
+    fake.listings.insert(0, make_listing(2))
+    new_listings, _, _, _ = crawl(watermark_of(12))
+    assert fake.offsets[:2] == [0, 5]
+    assert 2 not in ids(new_listings)
+
+
+def test_seen_listings_are_not_new(search):
+    search(range(1, 6))
+    main.seen_index.add_many([4, 5])
+    new_listings, seen_ids, _, known = crawl(None)
+    assert ids(new_listings) == [3, 2, 1]
+    assert seen_ids == [5, 4]
+    assert ids(known) == [5, 4]
+
+
+def test_watermark_is_kept_when_nothing_is_newer(search):
+    search(range(1, 6))
+    new_listings, _, watermark, _ = crawl(watermark_of(5))
+    assert new_listings == []
+    assert watermark is None
+
+
+def test_failed_first_page(search):
+    search(range(1, 6), fail=True)
+    assert crawl(watermark_of(1)) == (None, [], None, [])
@@ -0,0 +1,33 @@
+def claimed_by(db, listing_id):
+    return db.get_connection().execute("SELECT claimed_by FROM listings WHERE id = ?", (listing_id,)).fetchone()[0]
+
+
+def test_claimed_listings_are_left_to_their_owner(db):
+    assert db.claim_listings([1, 2], 'a', 60) == {1, 2}
+    assert db.claim_listings([1, 2, 3], 'b', 60) == {3}
+
+
+def test_expired_claims_can_be_taken_over(db):
+    db.claim_listings([1], 'a', -1)
+    assert db.claim_listings([1], 'b', 60) == {1}
+
+
+def test_queued_listings_are_no_longer_claimed(db):
+    db.claim_listings([1, 2], 'a', 60)
+    assert db.enqueue_listings([(1, '100', 'message', 'entry', False, False)], owner='a') == {1}
+    assert claimed_by(db, 1) is None
+    assert db.claim_listings([1], 'b', 60) == set()
+
+
+def test_listings_not_queued_are_released(db):
+    claimed = db.claim_listings([1, 2, 3], 'a', 60)
+    queued = db.enqueue_listings([], [1], owner='a')
+    assert db.release_listing_claims(claimed - queued, 'a') == 2
+    assert db.renew_listing_claims('a', 60) == 0
+    assert db.claim_listings([1, 2, 3], 'b', 60) == {2, 3}
+
+
+def test_release_leaves_claims_of_others(db):
+    db.claim_listings([1], 'a', 60)
+    assert db.release_listing_claims([1], 'b') == 0
+    assert claimed_by(db, 1) == 'a'
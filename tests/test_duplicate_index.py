@@ -0,0 +1,93 @@
+import random
+
+from duplicate_index import BITS, DuplicateIndex, listing_fingerprint, to_signed, to_unsigned
+from listing_record import Listing
+
+
+def make_listing(listing_id, title, description, price=12000, user_id=42):
+    return Listing(
+        id=listing_id, user_id=user_id, district_name='Оболонський', owner_name='Олена', price=price,
+        title=title, phone_number=True, url=f"https://www.olx.ua/d/{listing_id}", is_realtor=False,
+        decided_by='keywords', listings_count=1, description=description,
+        created_time='2024-05-01T10:00:00+03:00', last_refresh_time='2024-05-01T10:00:00+03:00'
+    )
+
+
+def flip(fingerprint, bits):
+    for bit in bits:
+        fingerprint ^= 1 << bit
+    return fingerprint
+
+
+def distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def test_finds_what_a_brute_force_scan_finds():
+    rng = random.Random(6)
+    index = DuplicateIndex(max_distance=3, merge_threshold=50)
+    fingerprints = {listing_id: rng.getrandbits(BITS) for listing_id in range(1, 400)}
+    for listing_id, fingerprint in fingerprints.items():
+        index.add(listing_id, fingerprint)
+    for _ in range(300):
+        stored = rng.choice(list(fingerprints.values()))
+        query = flip(stored, rng.sample(range(BITS), rng.randint(0, 6)))
+        closest = min(distance(query, fingerprint) for fingerprint in fingerprints.values())
+        found = index.find(query)
+        if closest > 3:
+            assert found is None
+        else:
+            assert distance(query, fingerprints[found]) == closest
+
+
+def test_within_and_beyond_max_distance():
+    index = DuplicateIndex(max_distance=3)
+    fingerprint = random.Random(7).getrandbits(BITS)
+    index.add(1, fingerprint)
+    assert index.find(flip(fingerprint, [0, 21, 42])) == 1
+    assert index.find(flip(fingerprint, [0, 1, 2, 3])) is None
+
+
+def test_reposts_point_to_the_original():
+    index = DuplicateIndex(merge_threshold=2)
+    fingerprint = random.Random(8).getrandbits(BITS)
+    index.add(1, fingerprint)
+    index.add(2, flip(fingerprint, [5]), original_id=1)
+    index.add(3, random.Random(9).getrandbits(BITS))
+    assert index.find(flip(fingerprint, [5, 6])) == 1
+
+
+def test_load_and_sync():
+    rng = random.Random(10)
+    rows = [(listing_id, to_signed(rng.getrandbits(BITS)), None, float(listing_id)) for listing_id in range(1, 20)]
+    index = DuplicateIndex()
+    index.load(rows)
+    assert len(index) == 19
+    assert index.synced_at == 19.0
+    assert index.find(to_unsigned(rows[4][1])) == 5
+
+    # Added by this process, then stored: sync skips it
+    local = rng.getrandbits(BITS)
+    index.add(100, local)
+    other = rng.getrandbits(BITS)
+    index.sync([(100, to_signed(local), None, 20.0), (101, to_signed(other), None, 21.0)])
+    assert len(index) == 21
+    assert index.synced_at == 21.0
+    assert index.find(other) == 101
+
+
+def test_signed_round_trip():
+    for fingerprint in (0, 1, (1 << 63) - 1, 1 << 63, (1 << 64) - 1):
+        signed = to_signed(fingerprint)
+        assert -(1 << 63) <= signed < 1 << 63
+        assert to_unsigned(signed) == fingerprint
+
+
+def test_repost_under_a_new_id_has_the_same_fingerprint():
+    description = 'Затишна квартира поруч з метро Оболонь, новий ремонт, вся техніка. ' * 3
+    original = make_listing(1, '1-кімнатна квартира на Оболоні', description)
+    # Only words count, not the id, the URL or punctuation
+    repost = make_listing(2, '1-кімнатна квартира на Оболоні!!', description.upper())
+    other = make_listing(3, 'Будинок у Бучі з ділянкою', 'Простора садиба, гараж і сад.', price=40000, user_id=7)
+    assert listing_fingerprint(original) == listing_fingerprint(repost)
+    assert bin(listing_fingerprint(original) ^ listing_fingerprint(other)).count('1') > 3
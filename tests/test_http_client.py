@@ -0,0 +1,200 @@
+import asyncio
+
+import httpx
+import pytest
+
+import http_client
+from http_client import CircuitBreaker, OlxUnavailable, deadline_scope, hedged_get
+
+USERS_URL = 'https://www.olx.ua/api/v1/users/1/'
+
+
+@pytest.fixture(autouse=True)
+def fresh_breakers(monkeypatch):
+    monkeypatch.setattr(http_client, '_breakers', {})
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+
+
+def test_opens_after_threshold_failures_in_a_row():
+    breaker = CircuitBreaker('test', threshold=3, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.opened_at is not None
+    assert not breaker.allow()
+
+
+def test_one_probe_after_reset_timeout():
+    breaker = CircuitBreaker('test', threshold=2, reset_timeout=0)
+    open_breaker(breaker)
+    assert breaker.allow()
+    # Only one probe at a time
+    assert not breaker.allow()
+
+
+def test_successful_probe_closes():
+    breaker = CircuitBreaker('test', threshold=2, reset_timeout=0)
+    open_breaker(breaker)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.opened_at is None
+    assert breaker.allow()
+    assert breaker.allow()
+
+
+def test_failed_probe_opens_again():
+    breaker = CircuitBreaker('test', threshold=2, reset_timeout=60)
+    open_breaker(breaker)
+    breaker.opened_at -= 60
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+
+def test_released_probe_lets_the_next_request_probe():
+    breaker = CircuitBreaker('test', threshold=2, reset_timeout=0)
+    open_breaker(breaker)
+    assert breaker.allow()
+    breaker.release_probe()
+    assert breaker.opened_at is not None
+    assert breaker.allow()
+
+
+def make_client(handler):
+    return httpx.AsyncClient(transport=http_client._CountingTransport(httpx.MockTransport(handler)))
+
+
+async def slow_handler(request):
+    # MockTransport ignores timeouts, this one honours the read timeout
+    timeout = request.extensions['timeout']['read']
+    if timeout < 1:
+        await asyncio.sleep(timeout)
+        raise httpx.ReadTimeout('slow', request=request)
+    await asyncio.sleep(1)
+    return httpx.Response(200)
+
+
+def test_probe_cut_short_by_the_deadline_does_not_keep_the_circuit_open():
+    breaker = http_client.get_breaker('users')
+    breaker.reset_timeout = 0
+    open_breaker(breaker)
+
+    async def run():
+        async with make_client(slow_handler) as client:
+            with deadline_scope(0.05):
+                with pytest.raises(httpx.ReadTimeout):
+                    await client.get(USERS_URL)
+
+    asyncio.run(run())
+    assert not breaker._probing
+    assert breaker.allow()
+
+
+def test_cancelled_probe_does_not_keep_the_circuit_open():
+    breaker = http_client.get_breaker('users')
+    breaker.reset_timeout = 0
+    open_breaker(breaker)
+
+    async def run():
+        async with make_client(slow_handler) as client:
+            task = asyncio.ensure_future(client.get(USERS_URL))
+            await asyncio.sleep(0.05)
+            assert breaker._probing
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    asyncio.run(run())
+    assert breaker.allow()
+
+
+def test_open_circuit_refuses_without_sending():
+    breaker = http_client.get_breaker('users')
+    breaker.reset_timeout = 60
+    open_breaker(breaker)
+    sent = []
+
+    async def handler(request):
+        sent.append(request)
+        return httpx.Response(200)
+
+    async def run():
+        async with make_client(handler) as client:
+            with pytest.raises(OlxUnavailable):
+                await client.get(USERS_URL)
+
+    asyncio.run(run())
+    assert sent == []
+
+
+def test_server_errors_open_and_success_closes():
+    statuses = iter([500, 503, 429, 200])
+
+    async def handler(request):
+        return httpx.Response(next(statuses))
+
+    breaker = http_client.get_breaker('users')
+    breaker.threshold = 3
+    breaker.reset_timeout = 0
+
+    async def run():
+        async with make_client(handler) as client:
+            for _ in range(3):
+                await client.get(USERS_URL)
+            assert breaker.opened_at is not None
+            await client.get(USERS_URL)
+
+    asyncio.run(run())
+    assert breaker.opened_at is None
+
+
+class FakeClient:
+    """Client whose GETs finish in the given order with a response or an error"""
+
+    def __init__(self, *outcomes, release=None):
+        self.outcomes = list(outcomes)
+        self.release = release
+
+    async def get(self, url):
+        outcome = self.outcomes.pop(0)
+        if self.release is not None:
+            await self.release.wait()
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def test_hedged_get_returns_the_response_when_both_finish_together():
+    response = httpx.Response(200)
+
+    async def run(outcomes):
+        release = asyncio.Event()
+        client = FakeClient(*outcomes, release=release)
+        task = asyncio.ensure_future(hedged_get(client, USERS_URL, delay=0.01))
+        await asyncio.sleep(0.05)
+        release.set()
+        return await task
+
+    assert asyncio.run(run([httpx.ConnectError('first'), response])) is response
+    assert asyncio.run(run([response, httpx.ConnectError('second')])) is response
+
+
+def test_hedged_get_raises_when_both_fail():
+    async def run():
+        release = asyncio.Event()
+        client = FakeClient(httpx.ConnectError('first'), httpx.ConnectError('second'), release=release)
+        task = asyncio.ensure_future(hedged_get(client, USERS_URL, delay=0.01))
+        await asyncio.sleep(0.05)
+        release.set()
+        return await task
+
+    with pytest.raises(httpx.ConnectError, match='first'):
+        asyncio.run(run())
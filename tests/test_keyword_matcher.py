@@ -0,0 +1,57 @@
+import random
+
+from keyword_matcher import DEFAULT_PRIVATE_KEYWORDS, DEFAULT_REALTOR_KEYWORDS, KeywordMatcher
+
+FILLER = ['квартира', 'затишна', 'поруч', 'метро', 'парк', 'ремонт', 'без', 'від', 'під', 'ключ', 'агенти']
+
+
+def default_matcher():
+    return KeywordMatcher(
+        {keyword: 1 for keyword in DEFAULT_REALTOR_KEYWORDS},
+        {keyword: 1 for keyword in DEFAULT_PRIVATE_KEYWORDS}
+    )
+
+
+def make_text(rng):
+    keywords = DEFAULT_REALTOR_KEYWORDS + DEFAULT_PRIVATE_KEYWORDS
+    words = [rng.choice(FILLER) for _ in range(rng.randint(0, 30))]
+    for _ in range(rng.randint(0, 4)):
+        keyword = rng.choice(keywords)
+        words.insert(rng.randint(0, len(words)), keyword.upper() if rng.random() < 0.2 else keyword)
+    # Keywords glued to each other and to other words must still count
+    return rng.choice([' ', '', ', ']).join(words)
+
+
+def test_matches_substring_checks():
+    matcher = default_matcher()
+    keywords = set(matcher.realtor_weights) | set(matcher.private_weights)
+    rng = random.Random(5)
+    for _ in range(2000):
+        text = make_text(rng)
+        assert matcher.matches(text) == {keyword for keyword in keywords if keyword in text.lower()}, text
+
+
+def test_overlapping_and_nested_keywords():
+    matcher = KeywordMatcher({'агент': 1, 'агентство': 1, 'агентство нерухомості': 1, 'ство не': 1}, {})
+    assert matcher.matches('Агентство нерухомості') == {'агент', 'агентство', 'агентство нерухомості', 'ство не'}
+    assert matcher.matches('агентка') == {'агент'}
+
+
+def test_scores_and_verdict():
+    matcher = KeywordMatcher({'агентство': 2.0, 'показ': 1.0}, {'без посередників': 2.5})
+    assert matcher.score('Агентство проводить показ') == (3.0, 0)
+    assert matcher.score('Без посередників, агентство не турбувати') == (2.0, 2.5)
+    assert matcher.classify('агентство, показ')
+    assert not matcher.classify('без посередників, агентство не турбувати')
+
+
+def test_empty_text_and_empty_matcher():
+    assert default_matcher().matches('') == set()
+    assert default_matcher().matches(None) == set()
+    assert KeywordMatcher({}, {}).matches('агентство') == set()
+
+
+def test_classify_many_keeps_the_order():
+    matcher = default_matcher()
+    texts = ['агентство нерухомості', 'здає власник', '', 'брокер']
+    assert matcher.classify_many(texts) == [matcher.classify(text) for text in texts]
@@ -0,0 +1,102 @@
+import pytest
+
+import chat_settings
+import main
+from listing_snapshots import listing_price, take_snapshot, track_changes
+
+
+def make_raw(listing_id, price, title='Квартира на Оболоні'):
+    return {
+        'id': listing_id,
+        'title': title,
+        'url': f"https://www.olx.ua/d/{listing_id}",
+        'params': [{'key': 'price', 'value': {'value': price, 'currency': 'UAH'}}],
+        'location': {'district': {'name': 'Оболонський'}},
+        'last_refresh_time': '2024-05-01T10:00:00+03:00'
+    }
+
+
+def price_history(db):
+    return db.get_connection().execute(
+        "SELECT listing_id, old_price, new_price FROM price_history ORDER BY listing_id"
+    ).fetchall()
+
+
+def test_listing_price():
+    assert listing_price(make_raw(1, 12000)) == 12000
+    assert listing_price({'params': [{'key': 'floor', 'value': {'value': 3}}]}) is None
+
+
+def test_unhandled_listings_get_no_snapshot(db):
+    snapshot_ids, price_changes = track_changes([make_raw(1, 12000)], set())
+    assert snapshot_ids == set()
+    assert price_changes == []
+    assert db.load_listing_snapshots([1]) == {}
+
+
+def test_handled_listings_without_a_snapshot_get_one_silently(db):
+    snapshot_ids, price_changes = track_changes([make_raw(1, 12000)], {1})
+    assert snapshot_ids == {1}
+    assert price_changes == []
+    assert price_history(db) == []
+
+
+def test_price_changes_are_recorded_once(db):
+    db.save_listing_snapshots([take_snapshot(make_raw(1, 12000), True), take_snapshot(make_raw(2, 9000), False)])
+    # Only the title of listing 2 changed
+    snapshot_ids, price_changes = track_changes(
+        [make_raw(1, 11000), make_raw(2, 9000, title='Квартира біля метро')], set()
+    )
+    assert snapshot_ids == {1, 2}
+    assert price_changes == [{
+        'id': 1, 'title': 'Квартира на Оболоні', 'district_name': 'Оболонський',
+        'url': 'https://www.olx.ua/d/1', 'old_price': 12000, 'new_price': 11000, 'is_realtor': True
+    }]
+    assert price_history(db) == [(1, 12000, 11000)]
+
+    # The same content again is no change
+    assert track_changes([make_raw(1, 11000)], set())[1] == []
+    assert price_history(db) == [(1, 12000, 11000)]
+
+
+def test_change_seen_by_two_processes_is_recorded_once(db):
+    db.save_listing_snapshots([take_snapshot(make_raw(1, 12000))])
+    old_hash = db.load_listing_snapshots([1])[1][0]
+    change = (take_snapshot(make_raw(1, 11000)), old_hash, 12000)
+    assert db.update_listing_snapshots([change]) == [change]
+    assert db.update_listing_snapshots([change]) == []
+    assert price_history(db) == [(1, 12000, 11000)]
+
+
+@pytest.fixture
+def price_drop_chats(monkeypatch):
+    monkeypatch.setattr(chat_settings, 'chat_settings', {
+        'default': dict(chat_settings.DEFAULT_SETTINGS),
+        'chats': {
+            '100': dict(chat_settings.DEFAULT_SETTINGS, price_drops=True),
+            '200': dict(chat_settings.DEFAULT_SETTINGS, price_drops=True)
+        }
+    })
+
+
+def price_change(listing_id, old_price, new_price, is_realtor=False):
+    return {
+        'id': listing_id, 'title': 'Квартира', 'district_name': 'Оболонський',
+        'url': f"https://www.olx.ua/d/{listing_id}", 'old_price': old_price, 'new_price': new_price,
+        'is_realtor': is_realtor
+    }
+
+
+def queued_updates(db):
+    return db.get_connection().execute(
+        "SELECT listing_id, chat_id, kind FROM outbox ORDER BY listing_id, chat_id"
+    ).fetchall()
+
+
+def test_price_drops_go_to_chats_that_want_them(db, price_drop_chats):
+    targets = {1: ['100', '200', '300'], 2: ['100', '200'], 3: ['100', '200']}
+    changes = [price_change(1, 12000, 11000), price_change(2, 9000, 9500), price_change(3, 8000, 7000, True)]
+    assert main.queue_price_drops(changes, targets, {'200'}) == 3
+    assert queued_updates(db) == [(1, '100', 'price:11000'), (1, '200', 'price:11000'), (3, '100', 'price:7000')]
+    # Queued once per new price
+    assert main.queue_price_drops(changes, targets, {'200'}) == 0
@@ -0,0 +1,110 @@
+import json
+import random
+
+import pytest
+
+from listing_stream import ListingStream, iter_listings
+
+
+def make_body(count, rng, indent=None, ensure_ascii=True):
+    listings = [
+        {
+            'id': number,
+            'title': f"Квартира {number} \"на\" {{Оболоні}} [центр]",
+            'description': 'опис 🏠 ' * rng.randint(0, 300),
+            'params': [{'key': 'price', 'value': {'value': rng.randint(5000, 30000)}}],
+            'location': {'district': {'name': 'Оболонський'}},
+            'user': {'id': rng.randint(1, 10 ** 9)},
+            'is_business': rng.random() < 0.5,
+            'photos': None,
+            'score': 12.5e3
+        }
+        for number in range(count)
+    ]
+    response = {
+        'meta': {'values': [1, 2.5e3, None, True, "a\"}]"], 'total': 123456},
+        'data': {
+            'other': {'data': [1]},
+            'clientCompatibleListings': {
+                '__typename': 'ListingSuccess',
+                'count': 98765,
+                'data': listings,
+                'metadata': {'a': 1}
+            }
+        },
+        'tail': 5
+    }
+    return json.dumps(response, indent=indent, ensure_ascii=ensure_ascii).encode('utf-8'), listings
+
+
+def chunked(body, size):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 100, 4096, 65536])
+def test_any_chunk_size_gives_the_listings_of_json_loads(size):
+    body, listings = make_body(12, random.Random(size), ensure_ascii=False)
+    assert list(iter_listings(chunked(body, size))) == listings
+    assert json.loads(body)['data']['clientCompatibleListings']['data'] == listings
+
+
+def test_random_chunk_boundaries():
+    rng = random.Random(1)
+    for _ in range(100):
+        body, listings = make_body(rng.randint(0, 20), rng, indent=rng.choice([None, 2]),
+                                   ensure_ascii=rng.random() < 0.5)
+        cuts = sorted(rng.sample(range(1, len(body)), min(len(body) - 1, rng.randint(0, 40))))
+        chunks = [body[start:end] for start, end in zip([0] + cuts, cuts + [len(body)])]
+        assert list(iter_listings(chunks)) == listings
+
+
+def test_listings_are_returned_as_soon_as_they_are_complete():
+    body, listings = make_body(3, random.Random(2))
+    stream = ListingStream()
+    end_of_first = body.index(b'}, {"id": 1') + 1
+    assert stream.feed(body[:end_of_first]) == listings[:1]
+    assert stream.feed(body[end_of_first:]) == listings[1:]
+    assert stream.close() == []
+
+
+def test_multibyte_character_split_between_chunks():
+    body = json.dumps({'data': {'clientCompatibleListings': {'data': [{'id': 1, 'title': 'Хата 🏠'}]}}},
+                      ensure_ascii=False).encode('utf-8')
+    emoji = body.index('🏠'.encode('utf-8'))
+    chunks = [body[:emoji + 1], body[emoji + 1:emoji + 3], body[emoji + 3:]]
+    assert list(iter_listings(chunks)) == [{'id': 1, 'title': 'Хата 🏠'}]
+
+
+def test_large_listing_over_many_chunks():
+    description = 'x' * 2_000_000
+    body = json.dumps({'data': {'clientCompatibleListings': {'data': [{'id': 1, 'description': description}]}}})
+    listings = list(iter_listings(chunked(body.encode(), 1024)))
+    assert listings == [{'id': 1, 'description': description}]
+
+
+@pytest.mark.parametrize('body', [
+    b'{"data": null, "errors": [{"message": "Internal error"}]}',
+    b'{"data": {"clientCompatibleListings": {"__typename": "ListingError", "message": "bad"}}}',
+    b'{"data": {"clientCompatibleListings": {"data": null}}}',
+    b'{"data": {"clientCompatibleListings": {"data": []}}}',
+    b'{}'
+])
+def test_responses_without_listings(body):
+    assert list(iter_listings(chunked(body, 5))) == []
+
+
+@pytest.mark.parametrize('body', [
+    b'',
+    b'[1, 2]',
+    b'{"data": {"clientCompatibleListings": {"data": [{"id": 1}, {"id":',
+    b'{"data" {}}',
+    b'{data: {}}'
+])
+def test_malformed_responses_raise(body):
+    with pytest.raises(ValueError):
+        list(iter_listings(chunked(body, 3)))
+
+
+def test_custom_path():
+    body = b'{"result": {"items": [{"id": 1}, {"id": 2}]}}'
+    assert list(iter_listings(chunked(body, 4), path=('result', 'items'))) == [{'id': 1}, {'id': 2}]
@@ -0,0 +1,69 @@
+import random
+
+from message_formatter import MESSAGE_LIMIT, format_digest_messages, telegram_length
+
+
+def test_telegram_length_counts_utf16_code_units():
+    assert telegram_length('хата') == 4
+    assert telegram_length('🏠') == 2
+    assert telegram_length('') == 0
+
+
+def test_no_entries_no_messages():
+    assert format_digest_messages([]) == []
+
+
+def test_short_entries_share_one_message():
+    messages = format_digest_messages(['перша', 'друга', 'третя'])
+    assert len(messages) == 1
+    text, indexes = messages[0]
+    assert indexes == [0, 1, 2]
+    assert text.index('перша') < text.index('друга') < text.index('третя')
+
+
+def test_messages_fit_the_limit_and_keep_the_order():
+    rng = random.Random(3)
+    entries = [
+        f"{number} " + rng.choice(['🏠', 'х', 'a', '€']) * rng.randint(10, 1500)
+        for number in range(80)
+    ]
+    messages = format_digest_messages(entries)
+    assert len(messages) > 1
+    for text, _ in messages:
+        assert telegram_length(text) <= MESSAGE_LIMIT
+    indexes = [index for _, chunk in messages for index in chunk]
+    assert indexes == list(range(len(entries)))
+    for text, chunk in messages:
+        positions = [text.index(entries[index]) for index in chunk]
+        assert positions == sorted(positions)
+
+
+def test_parts_are_numbered_in_the_header():
+    entries = ['x' * 3000] * 3
+    messages = format_digest_messages(entries)
+    assert [text.split('\n')[0][-5:] for text, _ in messages] == ['(1/3)', '(2/3)', '(3/3)']
+
+
+def test_astral_characters_count_twice():
+    # 3000 emoji are 6000 code units, two per message would not fit
+    entries = ['🏠' * 1500, '🏠' * 1500, '🏠' * 1500]
+    messages = format_digest_messages(entries)
+    assert [indexes for _, indexes in messages] == [[0], [1], [2]]
+    for text, _ in messages:
+        assert telegram_length(text) <= MESSAGE_LIMIT
+
+
+def test_entry_too_long_alone_is_truncated():
+    messages = format_digest_messages(['🏠' * 5000, 'коротка'])
+    first, indexes = messages[0]
+    assert indexes == [0]
+    assert first.endswith('…')
+    assert telegram_length(first) <= MESSAGE_LIMIT
+    assert messages[1][1] == [1]
+
+
+def test_smaller_limit():
+    messages = format_digest_messages(['a' * 60, 'b' * 60, 'c' * 60], limit=200)
+    for text, _ in messages:
+        assert telegram_length(text) <= 200
+    assert [index for _, indexes in messages for index in indexes] == [0, 1, 2]
@@ -0,0 +1,144 @@
+import time
+import asyncio
+
+import pytest
+
+import chat_settings
+import outbox
+from leases import LeaseKeeper
+from outbox import OutboxWorker, retry_delay
+
+
+class FakeSender:
+    """Sender that records messages and fails while `failing` is set"""
+
+    def __init__(self, failing=False):
+        self.failing = failing
+        self.sent = []
+
+    async def send_message(self, chat_id, message, max_retries=None, initial_delay=None):
+        if self.failing:
+            return False
+        self.sent.append((chat_id, message))
+        return True
+
+
+def make_worker(sender, **kwargs):
+    return OutboxWorker(sender, leases=LeaseKeeper(owner='test', lease_ttl=60), **kwargs)
+
+
+def queue(db, *listing_ids, chat_id='100'):
+    db.enqueue_listings([(listing_id, chat_id, f"listing {listing_id}", None, False, False) for listing_id in listing_ids])
+
+
+def delivery(db, listing_id, chat_id='100'):
+    return db.get_connection().execute(
+        "SELECT state, attempts, next_attempt_at FROM outbox WHERE listing_id = ? AND chat_id = ?",
+        (listing_id, chat_id)
+    ).fetchone()
+
+
+def make_due(db):
+    with db.get_connection() as conn:
+        conn.execute("UPDATE outbox SET next_attempt_at = 0 WHERE state = 'pending'")
+
+
+def drain_once(worker):
+    return asyncio.run(worker.drain_once())
+
+
+def test_retry_delay_doubles_up_to_the_maximum(monkeypatch):
+    monkeypatch.setattr(outbox, 'RETRY_BASE_DELAY', 5)
+    monkeypatch.setattr(outbox, 'RETRY_MAX_DELAY', 60)
+    assert [retry_delay(attempts) for attempts in range(1, 6)] == [5, 10, 20, 40, 60]
+
+
+def test_sent_deliveries_are_not_sent_again(db):
+    queue(db, 1, 2)
+    sender = FakeSender()
+    worker = make_worker(sender)
+    assert drain_once(worker) == 2
+    assert sorted(sender.sent) == [('100', 'listing 1'), ('100', 'listing 2')]
+    assert delivery(db, 1)[:2] == ('sent', 1)
+    assert drain_once(worker) == 0
+    assert db.outbox_depth() == 0
+
+
+def test_failed_delivery_is_retried_later(db):
+    queue(db, 1)
+    sender = FakeSender(failing=True)
+    worker = make_worker(sender)
+    before = time.time()
+    assert drain_once(worker) == 1
+    state, attempts, next_attempt_at = delivery(db, 1)
+    assert (state, attempts) == ('pending', 1)
+    assert next_attempt_at >= before + retry_delay(1)
+    # Not due yet
+    assert drain_once(worker) == 0
+
+    sender.failing = False
+    make_due(db)
+    assert drain_once(worker) == 1
+    assert delivery(db, 1)[:2] == ('sent', 2)
+    assert sender.sent == [('100', 'listing 1')]
+
+
+def test_gives_up_after_max_attempts(db):
+    queue(db, 1)
+    worker = make_worker(FakeSender(failing=True), max_attempts=3)
+    for _ in range(3):
+        make_due(db)
+        assert drain_once(worker) == 1
+    assert delivery(db, 1)[:2] == ('failed', 3)
+    make_due(db)
+    assert drain_once(worker) == 0
+    assert db.outbox_depth() == 0
+
+
+def test_deliveries_of_a_crashed_process_are_requeued(db):
+    queue(db, 1, 2)
+    # Claimed by a live process
+    assert len(db.claim_due_deliveries(1, 'alive', 60)) == 1
+    # Claimed by a process that died before recording the outcome
+    assert len(db.claim_due_deliveries(1, 'crashed', -1)) == 1
+    assert db.release_inflight_deliveries() == 1
+
+    sender = FakeSender()
+    assert drain_once(make_worker(sender)) == 1
+    assert len(sender.sent) == 1
+    assert db.outbox_depth() == 1
+
+
+def test_expired_lease_is_claimed_again(db):
+    queue(db, 1)
+    db.claim_due_deliveries(10, 'crashed', -1)
+    sender = FakeSender()
+    assert drain_once(make_worker(sender)) == 1
+    assert sender.sent == [('100', 'listing 1')]
+
+
+@pytest.mark.parametrize('failing', [False, True])
+def test_drain_returns_what_is_left(db, failing):
+    queue(db, 1, 2, 3)
+    worker = make_worker(FakeSender(failing=failing))
+    left = asyncio.run(worker.drain(5))
+    assert left == (3 if failing else 0)
+
+
+def test_digest_chats_get_all_their_due_deliveries_at_once(db, monkeypatch):
+    monkeypatch.setattr(chat_settings, 'chat_settings', {
+        'default': dict(chat_settings.DEFAULT_SETTINGS, digest=True),
+        'chats': {'0': dict(chat_settings.DEFAULT_SETTINGS)}
+    })
+    chat_ids = [str(chat_id) for chat_id in range(1, 21)]
+    db.enqueue_listings([
+        (listing_id, chat_id, f"listing {listing_id}", f"entry {listing_id}", False, False)
+        for listing_id in range(1, 11)
+        for chat_id in chat_ids + ['0']
+    ])
+    sender = FakeSender()
+    asyncio.run(make_worker(sender, batch_size=50).drain(5))
+    # One digest per chat, separate messages for the chat without digests
+    assert sorted(chat_id for chat_id, _ in sender.sent if chat_id != '0') == sorted(chat_ids)
+    assert len([chat_id for chat_id, _ in sender.sent if chat_id == '0']) == 10
+    assert db.outbox_depth() == 0
@@ -0,0 +1,56 @@
+import pytest
+
+import realtor_detector
+from realtor_detector import classify_listing
+
+
+@pytest.fixture
+def lookups(db, monkeypatch):
+    """Stand-ins for the OLX lookups, recording which ones ran"""
+    calls = []
+    answers = {'business': False, 'count': 7}
+
+    def is_business_user(user_id):
+        calls.append('business')
+        return answers['business']
+
+    def get_count(user_uuid):
+        calls.append('count')
+        return answers['count']
+
+    def get_description(listing_id):
+        calls.append('description')
+        return ''
+
+    monkeypatch.setattr(realtor_detector, 'is_business_user', is_business_user)
+    monkeypatch.setattr(realtor_detector, 'get_user_real_estate_listings_count', get_count)
+    monkeypatch.setattr(realtor_detector, 'get_listing_description', get_description)
+    return calls, answers
+
+
+def make_listing(title, description='Затишна квартира.'):
+    return {'id': 1, 'title': title, 'description': description, 'user': {'id': 42, 'uuid': 'uuid-42'}}
+
+
+def test_private_owner_keeps_the_listings_count(lookups):
+    calls, _ = lookups
+    result = classify_listing(make_listing('Квартира від власника'))
+    assert (result['is_realtor'], result['decided_by'], result['listings_count']) == (False, 'keywords', 7)
+    assert calls == ['business', 'count']
+
+
+def test_business_account_needs_no_other_lookup(lookups):
+    calls, answers = lookups
+    answers['business'] = True
+    result = classify_listing(make_listing('Квартира від власника'))
+    assert (result['is_realtor'], result['decided_by'], result['listings_count']) == (True, 'business', None)
+    assert calls == ['business']
+
+
+@pytest.mark.parametrize('count, is_realtor, decided_by', [(1, True, 'listings_count'), (3, False, 'listings_count'),
+                                                           (None, True, 'keywords')])
+def test_listings_count_decides_realtor_keywords(lookups, count, is_realtor, decided_by):
+    _, answers = lookups
+    answers['count'] = count
+    result = classify_listing(make_listing('Квартира, агентство нерухомості, комісія'))
+    assert (result['is_realtor'], result['decided_by']) == (is_realtor, decided_by)
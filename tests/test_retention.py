@@ -0,0 +1,71 @@
+import time
+import asyncio
+
+import pytest
+
+import retention
+from retention import RetentionWorker
+
+DAY = 24 * 3600
+
+
+def add_free_pages(conn, rows=2000):
+    conn.execute("CREATE TABLE padding (value TEXT)")
+    conn.executemany("INSERT INTO padding VALUES (?)", [('x' * 500,)] * rows)
+    conn.commit()
+    conn.execute("DROP TABLE padding")
+    conn.commit()
+    return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def run_once(worker=None):
+    return asyncio.run(asyncio.wait_for((worker or RetentionWorker()).run_once(), 10))
+
+
+@pytest.fixture(autouse=True)
+def no_pause(monkeypatch):
+    monkeypatch.setattr(retention, 'BATCH_PAUSE', 0)
+
+
+def test_new_database_uses_incremental_vacuum(db):
+    assert db.get_connection().execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+def test_freed_pages_are_returned(db):
+    conn = db.get_connection()
+    assert add_free_pages(conn) > 0
+    run_once()
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+
+
+def test_vacuum_stops_without_incremental_mode(db):
+    # As left by a switch to incremental vacuum that failed
+    conn = db.get_connection()
+    conn.execute("PRAGMA auto_vacuum = NONE")
+    conn.execute("VACUUM")
+    free_pages = add_free_pages(conn)
+    assert free_pages > 0
+    run_once()
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] == free_pages
+
+
+def test_switch_to_incremental_vacuum_is_retried_on_start(db):
+    conn = db.get_connection()
+    conn.execute("PRAGMA auto_vacuum = NONE")
+    conn.execute("VACUUM")
+    db.create_table_if_not_exists()
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+def test_old_listings_are_removed_in_batches(db):
+    conn = db.get_connection()
+    now = time.time()
+    old = now - retention.LISTING_RETENTION - DAY
+    with conn:
+        conn.executemany(
+            "INSERT INTO listings (id, sent, first_seen_at, last_seen_at) VALUES (?, 1, ?, ?)",
+            [(listing_id, old, old) for listing_id in range(1, 8)] + [(100, now, now)]
+        )
+    deleted = run_once(RetentionWorker(batch_size=3))
+    assert deleted['listings'] == 7
+    assert [row[0] for row in conn.execute("SELECT id FROM listings")] == [100]
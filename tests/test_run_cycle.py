@@ -0,0 +1,117 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+from duplicate_index import DuplicateIndex
+from listing_record import Listing
+from seen_index import SeenIndex
+from subscriptions import SubscriptionRouter
+
+PROFILE = {'name': 'test', 'chat_ids': ['100']}
+START = datetime(2024, 5, 1, 12, 0)
+
+
+def make_raw(listing_id):
+    return {
+        'id': listing_id,
+        'title': f"Квартира {listing_id}",
+        'url': f"https://www.olx.ua/d/{listing_id}",
+        'created_time': (START + timedelta(minutes=listing_id)).isoformat(),
+        'last_refresh_time': (START + timedelta(minutes=listing_id)).isoformat()
+    }
+
+
+def parse(raw, listings_count=1):
+    return Listing(
+        id=raw['id'], user_id=raw['id'], district_name='Оболонський', owner_name='Олена', price=12000,
+        title=raw['title'], phone_number=True, url=raw['url'], is_realtor=False, decided_by='keywords',
+        listings_count=listings_count, description=f"Опис {raw['id']} " * raw['id'], created_time=raw['created_time'],
+        last_refresh_time=raw['last_refresh_time']
+    )
+
+
+class FakeOlx:
+    """Newest-first search results and an enrichment that can fail"""
+
+    def __init__(self, listing_ids):
+        self.listings = [make_raw(listing_id) for listing_id in sorted(listing_ids, reverse=True)]
+        self.failing = set()
+        self.listings_counts = {}
+        self.enriched = []
+
+    async def fetch_listings_page(self, client, profile, offset=0, limit=main.PAGE_SIZE):
+        return self.listings[offset:offset + limit]
+
+    async def enrich_listings(self, listings_data):
+        raw_listings = listings_data['data']['clientCompatibleListings']['data']
+        self.enriched.extend(listing['id'] for listing in raw_listings)
+        # Like process_listings_async, a failure drops the whole page
+        if self.failing & {listing['id'] for listing in raw_listings}:
+            return []
+        return [parse(listing, self.listings_counts.get(listing['id'], 1)) for listing in raw_listings]
+
+
+@pytest.fixture
+def olx(db, monkeypatch):
+    fake = FakeOlx(range(1, 4))
+    monkeypatch.setattr(main, 'PAGE_SIZE', 5)
+    monkeypatch.setattr(main, 'seen_index', SeenIndex())
+    monkeypatch.setattr(main, 'duplicate_index', DuplicateIndex())
+    monkeypatch.setattr(main, 'fetch_listings_page', fake.fetch_listings_page)
+    monkeypatch.setattr(main, 'enrich_listings', fake.enrich_listings)
+    monkeypatch.setattr(main, 'subscription_router', SubscriptionRouter())
+    monkeypatch.setattr(main, 'get_async_client', lambda: None)
+    return fake
+
+
+def run_cycle():
+    return asyncio.run(main.run_cycle([PROFILE]))
+
+
+def queued_ids(db, chat_id='100'):
+    return [
+        row[0] for row in db.get_connection().execute(
+            "SELECT listing_id FROM outbox WHERE chat_id = ? ORDER BY listing_id", (chat_id,)
+        )
+    ]
+
+
+def test_new_listings_are_queued_once(db, olx):
+    assert run_cycle() == {'test': 3}
+    assert queued_ids(db) == [1, 2, 3]
+    olx.listings.insert(0, make_raw(4))
+    olx.enriched.clear()
+    assert run_cycle() == {'test': 1}
+    assert olx.enriched == [4]
+    assert queued_ids(db) == [1, 2, 3, 4]
+
+
+def test_listings_dropped_by_enrichment_are_retried_behind_the_watermark(db, olx):
+    olx.failing = {2}
+    run_cycle()
+    assert queued_ids(db) == []
+    assert db.load_watermark('test') is not None
+
+    olx.failing = set()
+    olx.enriched.clear()
+    assert run_cycle() == {'test': 0}
+    assert sorted(olx.enriched) == [1, 2, 3]
+    assert queued_ids(db) == [1, 2, 3]
+
+    # Handled now, so not retried again
+    olx.enriched.clear()
+    run_cycle()
+    assert olx.enriched == []
+    assert queued_ids(db) == [1, 2, 3]
+
+
+@pytest.mark.parametrize('realtors, expected', [('any', [1, 2, 3]), ('maybe', [1, 2, 3]), ('none', [1, 3])])
+def test_realtor_tolerance_of_subscriptions(db, olx, realtors, expected):
+    # The owner of listing 2 is private but has many listings
+    olx.listings_counts = {2: 7}
+    db.save_subscription('200', None, None, '[]', realtors, '[]')
+    run_cycle()
+    assert queued_ids(db, '200') == expected
+    assert queued_ids(db, '100') == [1, 2, 3]
@@ -0,0 +1,67 @@
+import pytest
+
+from scheduler import AdaptiveInterval
+
+
+def interval(**kwargs):
+    settings = dict(min_interval=60, max_interval=900, initial_interval=300, target_new=5, jitter=0, smoothing=0.5)
+    settings.update(kwargs)
+    return AdaptiveInterval(**settings)
+
+
+def test_initial_interval_is_clamped():
+    assert interval().next_delay() == 300
+    assert interval(initial_interval=10).next_delay() == 60
+    assert interval(initial_interval=5000).next_delay() == 900
+
+
+def test_first_cycle_keeps_the_initial_interval():
+    schedule = interval()
+    schedule.record_success(20, None)
+    assert schedule.rate is None
+    assert schedule.next_delay() == 300
+
+
+def test_aims_for_the_target_new_listings_per_cycle():
+    schedule = interval()
+    # 10 new listings in 200 seconds: 5 are expected in 100 seconds
+    schedule.record_success(10, 200)
+    assert schedule.next_delay() == pytest.approx(100)
+
+
+def test_rate_is_smoothed():
+    schedule = interval()
+    schedule.record_success(10, 200)
+    schedule.record_success(2, 200)
+    # (0.05 + 0.01) / 2 = 0.03 listings per second
+    assert schedule.rate == pytest.approx(0.03)
+    assert schedule.next_delay() == pytest.approx(5 / 0.03)
+
+
+def test_busy_and_quiet_profiles_stay_within_bounds():
+    busy = interval()
+    busy.record_success(1000, 10)
+    assert busy.next_delay() == 60
+    quiet = interval()
+    quiet.record_success(0, 600)
+    assert quiet.next_delay() == 900
+
+
+def test_errors_back_off_exponentially_and_success_resets():
+    schedule = interval()
+    schedule.record_error()
+    assert schedule.next_delay() == 600
+    schedule.record_error()
+    assert schedule.next_delay() == 900
+    schedule.record_success(5, 300)
+    assert schedule.errors == 0
+    assert schedule.next_delay() == pytest.approx(300)
+
+
+def test_jitter_stays_within_its_share_and_the_bounds():
+    schedule = interval(jitter=0.1)
+    delays = [schedule.next_delay() for _ in range(500)]
+    assert all(270 <= delay <= 330 for delay in delays)
+    assert len(set(delays)) > 1
+    edge = interval(jitter=0.5, initial_interval=60)
+    assert all(60 <= edge.next_delay() <= 90 for _ in range(500))
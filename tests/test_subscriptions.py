@@ -0,0 +1,77 @@
+import json
+import random
+
+from subscriptions import RoutingIndex
+
+DISTRICTS = ['Оболонський', 'Печерський', 'Подільський', 'Дарницький', 'Святошинський']
+PROFILES = ['kyiv', 'lviv', 'odesa']
+
+
+def make_subscription(chat_id, rng):
+    min_price = rng.choice([None, 5000, 8000, 10000, rng.randint(1, 30) * 1000])
+    max_price = rng.choice([None, 12000, 15000, rng.randint(1, 30) * 1000])
+    districts = rng.sample(DISTRICTS, rng.choice([0, 0, 1, 2]))
+    profiles = rng.sample(PROFILES, rng.choice([0, 0, 1, 2]))
+    realtors = rng.choice(['any', 'maybe', 'none'])
+    return chat_id, min_price, max_price, json.dumps(districts), realtors, json.dumps(profiles)
+
+
+def linear_match(subscriptions, price, district, profile_name):
+    chats = []
+    for chat_id, min_price, max_price, districts, _, profiles in subscriptions:
+        profiles = json.loads(profiles)
+        if profiles and profile_name not in profiles:
+            continue
+        districts = [name.lower() for name in json.loads(districts)]
+        if districts and (not district or district.lower() not in districts):
+            continue
+        if price is None:
+            if min_price is not None or max_price is not None:
+                continue
+        elif (min_price is not None and price < min_price) or (max_price is not None and price > max_price):
+            continue
+        chats.append(str(chat_id))
+    return chats
+
+
+def test_matches_a_linear_scan():
+    rng = random.Random(4)
+    subscriptions = [make_subscription(1000 + number, rng) for number in range(300)]
+    index = RoutingIndex(subscriptions)
+    prices = [None, 0, 5000, 7999, 8000, 10000, 12000, 12001, 15000, 40000]
+    prices += [rng.randint(0, 35) * 1000 for _ in range(20)] + [rng.uniform(0, 35000) for _ in range(20)]
+    for price in prices:
+        for district in DISTRICTS + [None, 'оболонський', 'Невідомий']:
+            for profile_name in PROFILES + ['other']:
+                assert index.match(price, district, profile_name) == linear_match(
+                    subscriptions, price, district, profile_name
+                ), (price, district, profile_name)
+
+
+def test_price_bounds_are_inclusive():
+    index = RoutingIndex([('1', 8000, 12000, '[]', 'any', '[]')])
+    assert index.match(8000, None, 'kyiv') == ['1']
+    assert index.match(12000, None, 'kyiv') == ['1']
+    assert index.match(7999, None, 'kyiv') == []
+    assert index.match(12001, None, 'kyiv') == []
+
+
+def test_unknown_price_only_matches_subscriptions_without_bounds():
+    index = RoutingIndex([('1', None, None, '[]', 'any', '[]'), ('2', None, 12000, '[]', 'any', '[]')])
+    assert index.match(None, None, 'kyiv') == ['1']
+
+
+def test_realtor_tolerance():
+    index = RoutingIndex([
+        ('1', None, None, '[]', 'any', '[]'),
+        ('2', None, None, '[]', 'maybe', '[]'),
+        ('3', None, None, '[]', 'none', '[]')
+    ])
+    assert index.drop_realtors == {'2', '3'}
+    assert index.drop_maybe_realtors == {'3'}
+
+
+def test_empty_index():
+    index = RoutingIndex()
+    assert len(index) == 0
+    assert index.match(10000, 'Оболонський', 'kyiv') == []
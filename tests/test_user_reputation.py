@@ -0,0 +1,91 @@
+import time
+
+import pytest
+
+import user_reputation
+from keyword_matcher import DEFAULT_REALTOR_KEYWORDS
+from user_reputation import HALF_LIFE, UserReputation, decay, merge_observation
+
+
+def observe(row, seen_at, is_realtor, checked=True, keywords=()):
+    return merge_observation(row, ('42', seen_at, is_realtor, checked, bool(keywords), list(keywords)))
+
+
+def test_decay():
+    assert decay(0) == 1
+    assert decay(HALF_LIFE) == pytest.approx(0.5)
+    assert decay(2 * HALF_LIFE) == pytest.approx(0.25)
+    # Clock skew between processes
+    assert decay(-60) == 1
+    assert decay(10 ** 9, half_life=0) == 1
+
+
+def test_new_user():
+    row = observe(None, 100.0, True, keywords=['агентство'])
+    assert row['listings_seen'] == row['realtor_listings'] == row['checked_listings'] == row['keyword_listings'] == 1
+    assert (row['first_seen'], row['last_seen'], row['scored_at']) == (100.0, 100.0, 100.0)
+    assert (row['score'], row['weight']) == (1.0, 1.0)
+    assert row['keywords'] == {'агентство': 1}
+
+
+def test_old_verdicts_count_less():
+    row = observe(None, 0.0, True)
+    row = observe(row, HALF_LIFE, False)
+    # The realtor verdict weighs 0.5 after a half-life, the new one 1
+    assert row['score'] == pytest.approx(0.5 / 1.5)
+    assert row['weight'] == pytest.approx(1.5)
+    assert row['scored_at'] == HALF_LIFE
+
+
+def test_verdicts_from_the_reputation_do_not_change_the_score():
+    row = observe(None, 0.0, True)
+    updated = observe(row, 10.0, False, checked=False)
+    assert (updated['score'], updated['weight'], updated['scored_at']) == (1.0, 1.0, 0.0)
+    assert (updated['listings_seen'], updated['checked_listings']) == (2, 1)
+    assert updated['last_seen'] == 10.0
+    # The row passed in is left alone
+    assert row['listings_seen'] == 1
+
+
+def test_keeps_the_most_used_keywords():
+    row = None
+    for keywords in (['a', 'b'], ['b'], ['c']):
+        row = merge_observation(row, ('42', 0.0, True, True, True, keywords), keyword_limit=2)
+    assert len(row['keywords']) == 2
+    assert row['keywords']['b'] == 2
+
+
+def make_listing(user_id, title='Квартира від власника'):
+    return {'id': 1, 'title': title, 'user': {'id': user_id}}
+
+
+def store(db, user_id, verdicts, seen_at=None):
+    seen_at = time.time() if seen_at is None else seen_at
+    db.update_user_reputation([(str(user_id), seen_at, is_realtor, True, False, []) for is_realtor in verdicts],
+                              merge_observation)
+
+
+@pytest.mark.parametrize('verdicts, expected', [
+    ([True, True, True], True),
+    ([False, False, False], False),
+    # Not enough checked listings
+    ([True, True], None),
+    # Not confident either way
+    ([True, False, False], None),
+])
+def test_verdict_thresholds(db, verdicts, expected):
+    store(db, 1, verdicts)
+    assert UserReputation().verdict(make_listing(1)) is expected
+
+
+def test_no_verdict_for_unknown_users_and_stale_scores(db):
+    store(db, 1, [True, True, True], seen_at=time.time() - user_reputation.SCORE_TTL - 60)
+    reputation = UserReputation()
+    assert reputation.verdict(make_listing(1)) is None
+    assert reputation.verdict(make_listing(2)) is None
+    assert reputation.verdict({'id': 1, 'title': 'Квартира', 'user': None}) is None
+
+
+def test_private_verdict_needs_a_title_without_realtor_keywords(db):
+    store(db, 1, [False, False, False])
+    assert UserReputation().verdict(make_listing(1, title=f"Квартира, {DEFAULT_REALTOR_KEYWORDS[0]}")) is None
@@ -0,0 +1,106 @@
+import asyncio
+
+import user_resolver
+from user_resolver import UserResolver, user_keys
+
+
+class CountingFetch:
+    """Fetch function that counts calls per key and answers after a pause"""
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.calls = []
+
+    async def __call__(self, client, key):
+        self.calls.append(key)
+        await asyncio.sleep(0.01)
+        return self.answer
+
+
+def make_listing(listing_id, user_id=42, user_uuid='uuid-42'):
+    return {
+        'id': listing_id,
+        'title': 'Квартира від власника',
+        'description': 'Затишна квартира.',
+        'user': {'id': user_id, 'uuid': user_uuid}
+    }
+
+
+def test_user_keys():
+    assert user_keys(make_listing(1)) == (42, 'uuid-42')
+    assert user_keys({'user': None}) == (None, None)
+
+
+def test_concurrent_lookups_of_a_key_share_one_call():
+    fetch = CountingFetch(7)
+
+    async def run():
+        resolver = UserResolver(None, asyncio.Semaphore(2))
+        return await asyncio.gather(*(
+            resolver._single_flight('count', key, fetch, None) for key in ['a', 'b', 'a', 'a', 'b']
+        ))
+
+    assert asyncio.run(run()) == [7] * 5
+    assert sorted(fetch.calls) == ['a', 'b']
+
+
+def test_missing_key_returns_the_default_without_a_call():
+    fetch = CountingFetch(7)
+
+    async def run():
+        resolver = UserResolver(None, asyncio.Semaphore(2))
+        return await resolver._single_flight('count', None, fetch, 'default')
+
+    assert asyncio.run(run()) == 'default'
+    assert fetch.calls == []
+
+
+def test_each_user_is_looked_up_once_per_page(db, monkeypatch):
+    business = CountingFetch(False)
+    monkeypatch.setattr(user_resolver, 'is_business_user_async', business)
+    listings = [make_listing(1), make_listing(2), make_listing(3, user_id=7, user_uuid='uuid-7')]
+
+    async def run():
+        resolver = UserResolver(None, asyncio.Semaphore(5))
+        return await resolver.classify_page(listings)
+
+    results = asyncio.run(run())
+    assert [result['is_realtor'] for result in results] == [False, False, False]
+    assert sorted(business.calls) == [7, 42]
+
+
+def classify(listing):
+    async def run():
+        return await UserResolver(None, asyncio.Semaphore(5)).classify(listing)
+
+    return asyncio.run(run())
+
+
+def test_private_verdicts_get_the_listings_count(db, monkeypatch):
+    business = CountingFetch(False)
+    count = CountingFetch(7)
+    monkeypatch.setattr(user_resolver, 'is_business_user_async', business)
+    monkeypatch.setattr(user_resolver, 'get_user_real_estate_listings_count_async', count)
+    result = classify(make_listing(1))
+    assert (result['is_realtor'], result['decided_by'], result['listings_count']) == (False, 'keywords', 7)
+    assert count.calls == ['uuid-42']
+
+
+def test_business_verdicts_skip_the_listings_count(db, monkeypatch):
+    count = CountingFetch(7)
+    monkeypatch.setattr(user_resolver, 'is_business_user_async', CountingFetch(True))
+    monkeypatch.setattr(user_resolver, 'get_user_real_estate_listings_count_async', count)
+    result = classify(make_listing(1))
+    assert (result['is_realtor'], result['listings_count']) == (True, None)
+    assert count.calls == []
+
+
+def test_reputation_verdicts(db, monkeypatch):
+    count = CountingFetch(7)
+    monkeypatch.setattr(user_resolver, 'get_user_real_estate_listings_count_async', count)
+    monkeypatch.setattr(user_resolver.user_reputation, 'verdict', lambda listing: listing['id'] == 1)
+    realtor = classify(make_listing(1))
+    private = classify(make_listing(2))
+    assert (realtor['is_realtor'], realtor['decided_by'], realtor['listings_count']) == (True, 'reputation', None)
+    assert (private['is_realtor'], private['decided_by'], private['listings_count']) == (False, 'reputation', 7)
+    assert count.calls == ['uuid-42']
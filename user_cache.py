@@ -0,0 +1,154 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+
+from database import load_user_profile, save_user_business_flag, save_user_listings_count
+from metrics import USER_CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# Business accounts rarely change, listings counts change as users post
+BUSINESS_TTL = int(os.getenv('USER_BUSINESS_TTL', str(7 * 24 * 3600)))
+LISTINGS_COUNT_TTL = int(os.getenv('USER_LISTINGS_COUNT_TTL', str(6 * 3600)))
+MEMORY_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+
+
+class UserProfileCache:
+    """
+    Cache of OLX user lookups: a bounded in-memory LRU in front of the
+    `user_profiles` SQLite table.
+
+    Every user key maps to a profile dict holding the business flag and
+    the real estate listings count with the time each one was fetched.
+    The two fields expire independently.
+    """
+
+    def __init__(self, business_ttl=BUSINESS_TTL, listings_count_ttl=LISTINGS_COUNT_TTL, max_size=MEMORY_SIZE):
+        self.business_ttl = business_ttl
+        self.listings_count_ttl = listings_count_ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._profiles = OrderedDict()
+
+    def get_business(self, user_key, stale=False):
+        """
+        Get the cached business flag of a user.
+
+        Args:
+            user_key: OLX user ID
+            stale (bool): Also return an expired flag, the fallback when
+                OLX cannot be asked
+
+        Returns:
+            bool: Cached flag or None if missing or expired
+        """
+        return self._get(user_key, 'is_business', 'business_checked_at', self.business_ttl, stale)
+
+    def set_business(self, user_key, is_business):
+        """Store a freshly fetched business flag."""
+        now = time.time()
+        self._update(user_key, is_business=bool(is_business), business_checked_at=now)
+        try:
+            save_user_business_flag(user_key, is_business, now)
+        except Exception as e:
+            logger.error(f"Error saving business flag for user {user_key}: {e}")
+
+    def get_listings_count(self, user_key, stale=False):
+        """
+        Get the cached real estate listings count of a user.
+
+        Args:
+            user_key: OLX user UUID
+            stale (bool): Also return an expired count, the fallback when
+                OLX cannot be asked
+
+        Returns:
+            int: Cached count or None if missing or expired
+        """
+        return self._get(user_key, 'listings_count', 'count_checked_at', self.listings_count_ttl, stale)
+
+    def set_listings_count(self, user_key, listings_count):
+        """Store a freshly fetched real estate listings count."""
+        now = time.time()
+        self._update(user_key, listings_count=listings_count, count_checked_at=now)
+        try:
+            save_user_listings_count(user_key, listings_count, now)
+        except Exception as e:
+            logger.error(f"Error saving listings count for user {user_key}: {e}")
+
+    def stats(self):
+        """
+        Get cache hit/miss counters.
+
+        Returns:
+            dict: Hits, misses, hit ratio and number of users held in memory
+        """
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+            'memory_size': len(self._profiles)
+        }
+
+    def clear(self):
+        """Drop the in-memory layer and reset counters."""
+        self._profiles.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, user_key, field, checked_field, ttl, stale=False):
+        profile = self._profile(str(user_key))
+        checked_at = profile.get(checked_field)
+        if stale:
+            USER_CACHE_LOOKUPS.labels(field, 'stale' if checked_at is not None else 'miss').inc()
+            return profile[field] if checked_at is not None else None
+        if checked_at is not None and time.time() - checked_at < ttl:
+            self.hits += 1
+            USER_CACHE_LOOKUPS.labels(field, 'hit').inc()
+            return profile[field]
+        self.misses += 1
+        USER_CACHE_LOOKUPS.labels(field, 'miss').inc()
+        return None
+
+    def _profile(self, user_key):
+        profile = self._profiles.get(user_key)
+        if profile is not None:
+            self._profiles.move_to_end(user_key)
+            return profile
+
+        profile = {}
+        try:
+            row = load_user_profile(user_key)
+        except Exception as e:
+            logger.error(f"Error loading cached profile for user {user_key}: {e}")
+            row = None
+        if row:
+            is_business, business_checked_at, listings_count, count_checked_at = row
+            if business_checked_at is not None:
+                profile['is_business'] = bool(is_business)
+                profile['business_checked_at'] = business_checked_at
+            if count_checked_at is not None:
+                profile['listings_count'] = listings_count
+                profile['count_checked_at'] = count_checked_at
+        self._store(user_key, profile)
+        return profile
+
+    def _update(self, user_key, **fields):
+        user_key = str(user_key)
+        profile = self._profiles.get(user_key)
+        if profile is None:
+            self._store(user_key, fields)
+        else:
+            profile.update(fields)
+            self._profiles.move_to_end(user_key)
+
+    def _store(self, user_key, profile):
+        self._profiles[user_key] = profile
+        if len(self._profiles) > self.max_size:
+            self._profiles.popitem(last=False)
+
+
+user_cache = UserProfileCache()
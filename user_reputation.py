@@ -0,0 +1,182 @@
+import os
+import time
+import logging
+from collections import Counter, OrderedDict
+
+from database import load_user_reputation, update_user_reputation
+from keyword_matcher import keyword_matcher
+
+logger = logging.getLogger(__name__)
+
+# Days after which a network verdict counts half as much in the score
+HALF_LIFE = float(os.getenv('REPUTATION_HALF_LIFE_DAYS', '30')) * 24 * 3600
+# Seconds a score stays usable without a listing of the user being checked again
+SCORE_TTL = int(os.getenv('REPUTATION_TTL', str(7 * 24 * 3600)))
+# Checked listings needed before the score decides alone
+MIN_LISTINGS = int(os.getenv('REPUTATION_MIN_LISTINGS', '3'))
+# Scores at or above REALTOR_SCORE mean a realtor, at or below PRIVATE_SCORE a private owner
+REALTOR_SCORE = float(os.getenv('REPUTATION_REALTOR_SCORE', '0.9'))
+PRIVATE_SCORE = float(os.getenv('REPUTATION_PRIVATE_SCORE', '0.1'))
+MEMORY_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+
+# Tier of verdicts taken from the reputation, their listings do not change the score
+TIER_REPUTATION = 'reputation'
+
+
+def decay(elapsed, half_life=HALF_LIFE):
+    """Weight left of an observation made `elapsed` seconds ago"""
+    return 0.5 ** (max(elapsed, 0) / half_life) if half_life > 0 else 1.0
+
+
+class UserReputation:
+    """
+    What was learned about OLX users from their earlier listings: a bounded
+    in-memory LRU in front of the `user_reputation` SQLite table.
+
+    Every user row holds how many of their listings were seen and flagged
+    as realtor or by realtor keywords, when the user was first and last
+    seen, the realtor keywords they use and a score. The score is the
+    exponentially decayed share of realtor verdicts among the listings that
+    were checked over the network, so old verdicts fade with HALF_LIFE.
+    Rows are updated incrementally once per page, never rebuilt.
+    """
+
+    def __init__(self, max_size=MEMORY_SIZE):
+        self.max_size = max_size
+        self._users = OrderedDict()
+
+    def verdict(self, listing):
+        """
+        Realtor verdict of a listing from the reputation of its owner.
+
+        A fresh confident score decides without network checks. A private
+        verdict also needs a title without realtor keywords.
+
+        Args:
+            listing (dict): Raw listing data from the API
+
+        Returns:
+            bool: Realtor verdict, None if the user is new, the score stale
+                or not confident
+        """
+        user_id = (listing.get('user') or {}).get('id')
+        if not user_id:
+            return None
+        row = self.get(user_id)
+        if row is None or row['checked_listings'] < MIN_LISTINGS or time.time() - row['scored_at'] > SCORE_TTL:
+            return None
+        if row['score'] >= REALTOR_SCORE:
+            return True
+        if row['score'] <= PRIVATE_SCORE and not keyword_matcher.classify(listing.get('title') or ''):
+            return False
+        return None
+
+    def get(self, user_id):
+        """
+        Get the reputation of a user.
+
+        Args:
+            user_id: OLX user ID
+
+        Returns:
+            dict: Reputation row, None if the user was never seen
+        """
+        user_key = str(user_id)
+        if user_key in self._users:
+            self._users.move_to_end(user_key)
+            return self._users[user_key]
+        try:
+            row = load_user_reputation(user_key)
+        except Exception as e:
+            logger.error(f"Error loading reputation of user {user_key}: {e}")
+            return None
+        self._store(user_key, row)
+        return row
+
+    def record(self, parsed_listings):
+        """
+        Add the verdicts of classified listings to their owners' reputation.
+
+        Args:
+            parsed_listings (list): Parsed Listing records
+        """
+        now = time.time()
+        observations = []
+        for listing in parsed_listings:
+            if not listing.user_id:
+                continue
+            found = keyword_matcher.matches(f"{listing.title or ''}\n{listing.description or ''}")
+            keywords = sorted(keyword for keyword in found if keyword in keyword_matcher.realtor_weights)
+            realtor_score = sum(keyword_matcher.realtor_weights[keyword] for keyword in keywords)
+            private_score = sum(keyword_matcher.private_weights.get(keyword, 0) for keyword in found)
+            observations.append((
+                str(listing.user_id),
+                now,
+                bool(listing.is_realtor),
+                listing.decided_by != TIER_REPUTATION,
+                realtor_score > private_score,
+                keywords
+            ))
+        if not observations:
+            return
+        try:
+            rows = update_user_reputation(observations, merge_observation)
+        except Exception as e:
+            logger.error(f"Error saving reputation of {len(observations)} listings: {e}")
+            return
+        for user_key, row in rows.items():
+            self._store(user_key, row)
+
+    def clear(self):
+        """Drop the in-memory layer."""
+        self._users.clear()
+
+    def _store(self, user_key, row):
+        self._users[user_key] = row
+        self._users.move_to_end(user_key)
+        if len(self._users) > self.max_size:
+            self._users.popitem(last=False)
+
+
+def merge_observation(row, observation, keyword_limit=20):
+    """
+    Update a reputation row with the verdict of one listing.
+
+    Args:
+        row (dict): Current row, None for a new user
+        observation (tuple): (user_key, seen_at, is_realtor, checked,
+            keyword_flag, keywords), checked False for verdicts taken from
+            the reputation itself
+        keyword_limit (int): Most used keywords kept per user
+
+    Returns:
+        dict: Updated row
+    """
+    _, seen_at, is_realtor, checked, keyword_flag, keywords = observation
+    if row is None:
+        row = {
+            'listings_seen': 0, 'realtor_listings': 0, 'keyword_listings': 0, 'checked_listings': 0,
+            'first_seen': seen_at, 'last_seen': seen_at,
+            'score': 0.0, 'weight': 0.0, 'scored_at': seen_at, 'keywords': {}
+        }
+    else:
+        row = dict(row, keywords=dict(row['keywords']))
+    row['listings_seen'] += 1
+    row['realtor_listings'] += int(is_realtor)
+    row['keyword_listings'] += int(keyword_flag)
+    row['first_seen'] = min(row['first_seen'], seen_at)
+    row['last_seen'] = max(row['last_seen'], seen_at)
+    if keywords:
+        counts = Counter(row['keywords'])
+        counts.update(keywords)
+        row['keywords'] = dict(counts.most_common(keyword_limit))
+    if checked:
+        row['checked_listings'] += 1
+        weight = row['weight'] * decay(seen_at - row['scored_at'])
+        row['score'] = (row['score'] * weight + int(is_realtor)) / (weight + 1)
+        row['weight'] = weight + 1
+        row['scored_at'] = seen_at
+    return row
+
+
+user_reputation = UserReputation()
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+
+from metrics import timed
+
+from realtor_detector import (
+    TIER_BUSINESS,
+    TIER_KEYWORDS,
+    TIER_LISTINGS_COUNT,
+    classification,
+    get_listing_description_async,
+    get_user_real_estate_listings_count_async,
+    is_business_user_async,
+    keywords_suggest_realtor
+)
+from user_reputation import TIER_REPUTATION, user_reputation
+
+logger = logging.getLogger(__name__)
+
+
+def user_keys(listing):
+    """
+    Get the OLX user id and uuid of a raw listing.
+
+    Args:
+        listing (dict): Raw listing data from the API
+
+    Returns:
+        tuple: (user_id, user_uuid), either may be None
+    """
+    user = listing.get('user') or {}
+    return user.get('id'), user.get('uuid')
+
+
+class UserResolver:
+    """
+    Resolves OLX user profiles and classifies listings for one fetch cycle.
+
+    Each distinct user id, user uuid and listing description is looked up
+    at most once per cycle.
+    Concurrent requests for the same key await the same in-flight task
+    instead of issuing a second HTTP call.
+    """
+
+    def __init__(self, client, semaphore):
+        self.client = client
+        self.semaphore = semaphore
+        self._tasks = {}
+
+    @timed('classify')
+    async def classify(self, listing):
+        """
+        Async counterpart of realtor_detector.classify_listing.
+
+        Args:
+            listing (dict): Raw listing data from the API
+
+        Returns:
+            dict: Classification result
+        """
+        user_id, user_uuid = user_keys(listing)
+
+        known = user_reputation.verdict(listing)
+        if known:
+            return classification(True, TIER_REPUTATION)
+        if known is not None:
+            return classification(False, TIER_REPUTATION, await self._listings_count(user_uuid))
+
+        if await self._single_flight('business', user_id, is_business_user_async, False):
+            return classification(True, TIER_BUSINESS)
+
+        description = listing.get('description') or await self._single_flight(
+            'description', listing.get('id'), get_listing_description_async, ''
+        )
+        if not keywords_suggest_realtor(listing, description):
+            return classification(False, TIER_KEYWORDS, await self._listings_count(user_uuid), description)
+
+        if not user_uuid:
+            return classification(True, TIER_KEYWORDS, description=description)
+        listings_count = await self._listings_count(user_uuid)
+        if listings_count is None:
+            return classification(True, TIER_KEYWORDS, description=description)
+        return classification(listings_count < 2, TIER_LISTINGS_COUNT, listings_count, description)
+
+    async def classify_page(self, listings):
+        """
+        Classify every listing on a page concurrently.
+
+        Args:
+            listings (list): Raw listing dictionaries
+
+        Returns:
+            list: Classification results in the order of the listings
+        """
+        return await asyncio.gather(*(self.classify(listing) for listing in listings))
+
+    def _listings_count(self, user_uuid):
+        return self._single_flight('listings_count', user_uuid, get_user_real_estate_listings_count_async, None)
+
+    def _single_flight(self, kind, key, fetch, default):
+        if not key:
+            return _constant(default)
+        task = self._tasks.get((kind, key))
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(fetch, key))
+            self._tasks[(kind, key)] = task
+        return task
+
+    async def _fetch(self, fetch, key):
+        async with self.semaphore:
+            return await fetch(self.client, key)
+
+
+async def _constant(value):
+    return value